@@ -24,10 +24,10 @@ import aiohttp
 import prettytable
 import psutil
 import requests
-import yaml
 
 from fc_common import which
 from fc_common.config import Config
+from fc_common.decoder import Decoder
 from fc_common.version import get_runtime_version
 
 
@@ -389,7 +389,9 @@ class Client:
                 if token:
                     cmd = "labgrid-client reservations"
                     reservations_text = subprocess.check_output(cmd, shell=True)
-                    reservations = yaml.load(reservations_text, Loader=yaml.FullLoader)
+                    reservations = Decoder.from_yaml(
+                        reservations_text, "fc_client.reservations"
+                    )
                     for k, v in reservations.items():  # pylint: disable=invalid-name
                         if k == f"Reservation '{token}'":
                             owner = v["owner"]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+"""
+Warm helper process which runs console script entry points of python
+command line tools in process, saving interpreter start and import per call.
+
+Protocol, one json object per line:
+  request on stdin: {"argv": ["lavacli", "-i", "foo", "devices", "list"]}
+  response on stdout: {"returncode": 0, "stdout": "...", "stderr": "..."}
+returncode is null if the executable has no python entry point.
+
+Usage: python3 -m fc_common.coprocess [executable to preload ...]
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+
+
+def find_entry_point(name):
+    try:
+        from importlib.metadata import (  # pylint: disable=import-outside-toplevel
+            entry_points,
+        )
+    except ImportError:  # python < 3.8
+        import pkg_resources  # pylint: disable=import-outside-toplevel
+
+        for entry_point in pkg_resources.iter_entry_points("console_scripts", name):
+            return entry_point.load()
+        return None
+
+    scripts = entry_points()
+    if hasattr(scripts, "select"):
+        scripts = scripts.select(group="console_scripts")
+    else:
+        scripts = scripts.get("console_scripts", [])
+
+    for entry_point in scripts:
+        if entry_point.name == name:
+            return entry_point.load()
+    return None
+
+
+class CoprocessWorker:
+    def __init__(self):
+        self.entries = {}
+
+    def entry(self, name):
+        if name not in self.entries:
+            try:
+                self.entries[name] = find_entry_point(name)
+            except Exception:  # pylint: disable=broad-except
+                traceback.print_exc()
+                self.entries[name] = None
+        return self.entries[name]
+
+    def call(self, argv):
+        entry = self.entry(os.path.basename(argv[0]))
+        if not entry:
+            return {"returncode": None, "stdout": "", "stderr": ""}
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        returncode = 0
+
+        saved_argv, saved_stdin = sys.argv, sys.stdin
+        sys.argv = list(argv)
+        # fresh event loop per call, some tools close their loop when done
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                sys.stdin = io.StringIO()
+                try:
+                    ret = entry()
+                    returncode = ret if isinstance(ret, int) else 0
+                except SystemExit as exit_info:
+                    if exit_info.code is None:
+                        returncode = 0
+                    elif isinstance(exit_info.code, int):
+                        returncode = exit_info.code
+                    else:
+                        print(exit_info.code, file=sys.stderr)
+                        returncode = 1
+                except Exception:  # pylint: disable=broad-except
+                    traceback.print_exc()
+                    returncode = 1
+        finally:
+            sys.argv, sys.stdin = saved_argv, saved_stdin
+            if not loop.is_closed():
+                loop.close()
+
+        return {
+            "returncode": returncode,
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+        }
+
+
+def main():
+    # keep protocol channels private, stray writes to fd 1 go to stderr
+    requests = os.fdopen(os.dup(sys.stdin.fileno()), "r", encoding="utf-8")
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, sys.stdin.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    worker = CoprocessWorker()
+    for name in sys.argv[1:]:
+        worker.entry(name)
+
+    for line in requests:
+        try:
+            response = worker.call(json.loads(line)["argv"])
+        except Exception:  # pylint: disable=broad-except
+            response = {
+                "returncode": 1,
+                "stdout": "",
+                "stderr": traceback.format_exc(),
+            }
+        responses.write(json.dumps(response) + "\n")
+        responses.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import json
+import time
+from contextlib import contextmanager
+
+import yaml
+
+try:
+    YamlLoader = yaml.CSafeLoader
+except AttributeError:  # pyyaml without libyaml
+    YamlLoader = yaml.SafeLoader
+
+
+class DecodeError(ValueError):
+    pass
+
+
+class Decoder:
+    """
+    Decode framework cli/api output, prefer machine formats and fast loaders,
+    parse time is recorded per call site
+    """
+
+    # call site -> [calls, total seconds, max seconds]
+    __stats = {}
+
+    @staticmethod
+    @contextmanager
+    def __timing(site):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cost = time.perf_counter() - start
+            stat = Decoder.__stats.setdefault(site, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += cost
+            stat[2] = max(stat[2], cost)
+
+    @staticmethod
+    def from_json(text, site):
+        if not text or not text.strip():
+            return None
+
+        with Decoder.__timing(site):
+            try:
+                return json.loads(text)
+            except ValueError as error:
+                raise DecodeError(f"{site}: {error}") from error
+
+    @staticmethod
+    def from_yaml(text, site):
+        with Decoder.__timing(site):
+            try:
+                return yaml.load(text, Loader=YamlLoader)
+            except yaml.YAMLError as error:
+                raise DecodeError(f"{site}: {error}") from error
+
+    @staticmethod
+    def stats():
+        return {
+            site: {
+                "calls": calls,
+                "total": round(total, 6),
+                "average": round(total / calls, 6),
+                "max": round(max_cost, 6),
+            }
+            for site, (calls, total, max_cost) in Decoder.__stats.items()
+        }
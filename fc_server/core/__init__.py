@@ -10,6 +10,8 @@ import os
 
 from fc_common.logger import Logger
 from fc_server.core.config import Config
+from fc_server.core.coprocess import CoprocessPool
+from fc_server.core.governor import CmdGovernor
 
 fc_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 Logger.init("fc_server", "fc_server.log")
@@ -19,17 +21,31 @@ Config.parse(fc_path)
 class AsyncRunMixin:  # pylint: disable=too-few-public-methods
     """
     Mixin for async subprocess call
+    Commands are governed per executable, long running commands like
+    blocking waits should pass `governed=False` to not hold a slot
+    With `cmd_runner` in coprocess mode, governed python tools run in warm
+    helpers, long running commands always run in shell to not hold a helper
     """
 
-    async def _run_cmd(self, cmd):  # pylint: disable=no-self-use
-        proc = await asyncio.create_subprocess_shell(
-            cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await proc.communicate()
-
-        if proc.returncode != 0:
-            print(f"{cmd!r}:\n  - exited with {proc.returncode}")
-        if stderr:
-            print(f"  - {stderr.decode()}")
-
-        return proc.returncode, stdout.decode(), stderr.decode()
+    async def _run_cmd(self, cmd, governed=True):
+        if governed:
+            async with CmdGovernor.for_cmd(cmd):
+                return await self.__run_cmd(cmd, True)
+        return await self.__run_cmd(cmd, False)
+
+    @staticmethod
+    async def __run_cmd(cmd, pooled):
+        result = await CoprocessPool.run_cmd(cmd) if pooled else None
+        if result is None:
+            proc = await asyncio.create_subprocess_shell(
+                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await proc.communicate()
+            result = proc.returncode, stdout.decode(), stderr.decode()
+
+        if result[0] != 0:
+            print(f"{cmd!r}:\n  - exited with {result[0]}")
+        if result[2]:
+            print(f"  - {result[2]}")
+
+        return result
@@ -13,8 +13,12 @@ from string import Template
 import flatdict
 from aiohttp import web
 
+from fc_common.decoder import Decoder
 from fc_server.core import AsyncRunMixin
+from fc_server.core.cache import cache_stats
 from fc_server.core.config import Config
+from fc_server.core.decorators import cmd_priority
+from fc_server.core.governor import PRIORITY_HIGH, CmdGovernor
 
 
 class ApiSvr(AsyncRunMixin):
@@ -39,6 +43,7 @@ class ApiSvr(AsyncRunMixin):
     async def verbose_resource_status(self, request):
         return await self.fetch_resource_status(request, True)
 
+    @cmd_priority(PRIORITY_HIGH)
     async def fetch_resource_status(
         self, request, verbose=False
     ):  # pylint: disable=too-many-branches, too-many-locals, too-many-statements
@@ -46,7 +51,7 @@ class ApiSvr(AsyncRunMixin):
         labgrid_managed_resources = []
         comments = {}
         for framework in self.context.framework_instances:
-            if framework.__module__.split(".")[-1] == "labgrid":
+            if framework.__module__.rsplit(".", 1)[-1] == "labgrid":
                 labgrid_managed_resources = framework.managed_resources
                 if verbose:
                     comments = await framework.labgrid_get_comments()
@@ -187,6 +192,42 @@ class ApiSvr(AsyncRunMixin):
     async def pong(_):
         return web.Response(text="pong")
 
+    async def debug_caches(self, _):
+        caches = {"coordinator": cache_stats(self.context)}
+        caches["coordinator"]["seized_status_timeout_records"] = {
+            "size": len(self.context.seized_status_timeout_records)
+        }
+        for framework in self.context.framework_instances:
+            caches[framework.__module__.rsplit(".", 1)[-1]] = cache_stats(framework)
+
+        return web.json_response(caches)
+
+    async def debug_schedule(self, _):
+        schedule = {
+            "coordinator": {"connect_retry": self.context.connect_retry_queue.stats()}
+        }
+        for framework in self.context.framework_instances:
+            schedule[framework.__module__.rsplit(".", 1)[-1]] = {
+                "schedule_interval": framework.schedule_interval,
+                "controller": framework.schedule_controller.stats()
+                if framework.schedule_controller
+                else None,
+            }
+
+        return web.json_response(schedule)
+
+    async def debug_resources(self, _):
+        return web.json_response(self.context.resource_states.stats())
+
+    @staticmethod
+    async def debug_governors(_):
+        return web.json_response(CmdGovernor.stats())
+
+    @staticmethod
+    async def debug_decoders(_):
+        return web.json_response(Decoder.stats())
+
+    @cmd_priority(PRIORITY_HIGH)
     async def booking(self, _):
         cmd = "labgrid-client who | grep -v fc"
         _, bookings_text, _ = await self._run_cmd(cmd)
@@ -227,6 +268,11 @@ class ApiSvr(AsyncRunMixin):
         app.add_routes(
             [web.get("/verbose_resource/{res}", self.verbose_resource_status)]
         )
+        app.add_routes([web.get("/debug/caches", self.debug_caches)])
+        app.add_routes([web.get("/debug/governors", self.debug_governors)])
+        app.add_routes([web.get("/debug/decoders", self.debug_decoders)])
+        app.add_routes([web.get("/debug/schedule", self.debug_schedule)])
+        app.add_routes([web.get("/debug/resources", self.debug_resources)])
 
         app_runner = web.AppRunner(app)
         await app_runner.setup()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import collections.abc
+import time
+
+
+class TTLCache:
+    """
+    Key value cache with per entry time to live, hit/miss counted
+    Concurrent loads of one missing key are coalesced to one loader call
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl  # seconds, None means never expire
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = {}  # key -> (value, expire time)
+        self.__loading = {}  # key -> future of ongoing load
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and not self.__expired(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def __expired(entry):
+        return entry[1] is not None and entry[1] <= time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or self.__expired(entry):
+            self._entries.pop(key, None)
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        expire = time.monotonic() + self.ttl if self.ttl is not None else None
+        self._entries[key] = (value, expire)
+
+    def invalidate(self, *keys):
+        for key in keys:
+            self._entries.pop(key, None)
+            self.__loading.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self.__loading.clear()
+
+    async def get_or_load(self, key, loader):
+        """
+        Return cached value, or load it with `loader` coroutine function,
+        None result of loader is not cached
+        """
+
+        entry = self._entries.get(key)
+        if entry is not None and not self.__expired(entry):
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+
+        if key in self.__loading:
+            return await asyncio.shield(self.__loading[key])
+
+        future = asyncio.ensure_future(loader(key))
+        self.__loading[key] = future
+        try:
+            value = await asyncio.shield(future)
+        except BaseException:
+            if self.__loading.get(key) is future:
+                del self.__loading[key]
+            raise
+
+        # value loaded before an invalidation is outdated, don't cache it
+        if self.__loading.get(key) is future:
+            del self.__loading[key]
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class BoundedCache(collections.abc.MutableMapping):
+    """
+    Dict like cache bounded by size and per entry time to live, oldest written
+    entries are evicted first. `refs` maps a value to the resources it refers,
+    a reverse index of them allows dropping all entries refer to one resource
+    without scanning the whole cache
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, refs=None):
+        self.maxsize = maxsize
+        self.ttl = ttl  # seconds, None means never expire
+        self.refs = refs
+        self.evictions = 0
+
+        self.__entries = {}  # key -> (value, expire time), in write order
+        self.__key_refs = {}  # key -> resources referred by its value
+        self.__ref_keys = {}  # resource -> keys whose value refer to it
+
+    @staticmethod
+    def __expired(entry):
+        return entry[1] is not None and entry[1] <= time.monotonic()
+
+    def __unindex(self, key):
+        for ref in self.__key_refs.pop(key, ()):
+            keys = self.__ref_keys[ref]
+            keys.discard(key)
+            if not keys:
+                del self.__ref_keys[ref]
+
+    def __evict(self):
+        # entries are kept in write order, so also in expiry order
+        while self.__entries:
+            key, entry = next(iter(self.__entries.items()))
+            if len(self.__entries) <= self.maxsize and not self.__expired(entry):
+                break
+            del self.__entries[key]
+            self.__unindex(key)
+            self.evictions += 1
+
+    def __getitem__(self, key):
+        entry = self.__entries[key]
+        if self.__expired(entry):
+            del self[key]
+            raise KeyError(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        expire = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.__entries.pop(key, None)
+        self.__entries[key] = (value, expire)
+
+        if self.refs:
+            self.__unindex(key)
+            key_refs = frozenset(self.refs(value))
+            if key_refs:
+                self.__key_refs[key] = key_refs
+                for ref in key_refs:
+                    self.__ref_keys.setdefault(ref, set()).add(key)
+
+        self.__evict()
+
+    def __delitem__(self, key):
+        del self.__entries[key]
+        self.__unindex(key)
+
+    def __iter__(self):
+        return iter(list(self.__entries))
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self.items())!r})"
+
+    def keys_referring(self, ref):
+        return set(self.__ref_keys.get(ref, ()))
+
+    def invalidate_referring(self, *refs):
+        """
+        Drop all entries whose value refers to any of refs
+        """
+
+        for ref in refs:
+            for key in self.keys_referring(ref):
+                del self[key]
+
+    def stats(self):
+        return {
+            "size": len(self.__entries),
+            "maxsize": self.maxsize,
+            "evictions": self.evictions,
+            "refs": len(self.__ref_keys),
+        }
+
+
+def cache_stats(owner):
+    """
+    Return stats of all caches held as attributes of owner
+    """
+
+    return {
+        name: value.stats()
+        for name, value in vars(owner).items()
+        if isinstance(value, (TTLCache, BoundedCache))
+    }
@@ -81,6 +81,11 @@ class Config:
         Config.registered_frameworks = cfg["registered_frameworks"]
         Config.frameworks_config = cfg["frameworks_config"]
         Config.priority_scheduler = cfg.get("priority_scheduler", False)
+        Config.cmd_governor = cfg.get("cmd_governor", {})
+        Config.cmd_runner = cfg.get("cmd_runner", {})
+        Config.state_journal = cfg.get("state_journal", {})
+        Config.connect_retry = cfg.get("connect_retry", {})
+        Config.seize_policy = cfg.get("seize_policy", {})
 
         Config.api_server = cfg["api_server"]
         if "port" not in Config.api_server:
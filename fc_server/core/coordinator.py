@@ -8,11 +8,19 @@
 import asyncio
 import logging
 import sys
+import time
+import traceback
 from importlib import import_module
 
 from fc_server.core.api_svr import ApiSvr
+from fc_server.core.cache import BoundedCache
 from fc_server.core.config import Config
-from fc_server.core.decorators import check_priority_scheduler
+from fc_server.core.decorators import check_priority_scheduler, cmd_priority
+from fc_server.core.governor import PRIORITY_BULK, PRIORITY_HIGH
+from fc_server.core.journal import StateJournal
+from fc_server.core.retry import RetryQueue
+from fc_server.core.seize import SeizePolicy
+from fc_server.core.state import ResourceFlag, ResourcePhase, ResourceStateTable
 from fc_server_daemon.server_daemon import ServerDaemon
 
 
@@ -21,7 +29,7 @@ class Coordinator:
     FC coordinator which used to coordinate status among different frameworks
     """
 
-    # pylint: disable=too-many-instance-attributes
+    # pylint: disable=too-many-instance-attributes, too-many-public-methods
 
     def __init__(self):
         self.logger = logging.getLogger("fc_server")
@@ -46,7 +54,7 @@ class Coordinator:
         if Config.default_framework:
             self.logger.info("Default framework: %s", Config.default_framework)
             for framework in self.__framework_plugins:
-                if framework.__module__.split(".")[-1] == Config.default_framework:
+                if framework.__module__.rsplit(".", 1)[-1] == Config.default_framework:
                     self.__default_framework_plugin = framework
                     if not hasattr(
                         self.__default_framework_plugin, "default_framework_disconnect"
@@ -61,25 +69,105 @@ class Coordinator:
                         sys.exit(1)
                     break
 
-        self.__managed_resources_status = {}
-        self.__managed_disconnect_resources = []
-        self.__managed_issue_disconnect_resources = []
-
-        for resource in Config.managed_resources:
-            self.__managed_resources_status[resource] = "fc"
+        # all resources belong to fc at start
+        self.resource_states = ResourceStateTable(
+            Config.managed_resources, Config.registered_frameworks
+        )
+        self.__context_owners = {}  # plugin module -> owner code
 
         # assure no seize for this job when already a seize for this job there
-        self.coordinating_job_records = {}
+        self.coordinating_job_records = BoundedCache(
+            ttl=86400, refs=lambda resource: (resource,)
+        )
+
+        # decide which low priority resource to seize
+        self.seize_policy = SeizePolicy.create(Config.seize_policy)
+        self.__seize_demands = {}  # plugin -> job id -> (candidates, on_result)
 
         # record timeout task for seized status
         self.seized_status_timeout_records = {}
+        self.__seized_status_deadlines = {}  # resource -> wall clock deadline
+
+        # optional journal of states to warm restart from
+        self.journal = None
+        self.__restored_state = None
+        if Config.state_journal:
+            self.journal = StateJournal(Config.state_journal["path"])
+            self.__restore_state(self.journal.load())
+            self.resource_states.listener = self.journal.append
+
+        # retry failed default framework connects with backoff per resource
+        self.connect_retry_queue = RetryQueue(**Config.connect_retry)
+        for resource in self.resource_states.flagged(ResourceFlag.ISSUE_DISCONNECT):
+            self.connect_retry_queue.add(resource)
 
         self.logger.info("FC managed resource list:")
         self.logger.info(Config.managed_resources)
 
+    def __restore_state(self, state):
+        """
+        Restore states saved by last run, resources are then only verified
+        by frameworks if their external state disagrees
+        """
+
+        if not state:
+            return
+
+        restored = self.resource_states.restore(state["states"], state["flags"])
+        for job_id, resource in state["seizes"]:
+            if resource in self.resource_states:
+                self.coordinating_job_records[job_id] = resource
+        self.__restored_state = state
+        self.logger.info(
+            "Restored %d resource states saved at %s",
+            restored,
+            time.ctime(state["time"]) if state["time"] else "unknown time",
+        )
+
+    def __journal(self, operation, **fields):
+        if self.journal:
+            self.journal.append(operation, **fields)
+
+    def __snapshot_state(self):
+        self.journal.snapshot(
+            {
+                **self.resource_states.export(),
+                "seizes": [
+                    [job_id, resource]
+                    for job_id, resource in self.coordinating_job_records.items()
+                ],
+                "timers": dict(self.__seized_status_deadlines),
+                "plugins": {
+                    framework.__module__.rsplit(".", 1)[-1]: framework.export_state()
+                    for framework in self.__framework_plugins
+                },
+            }
+        )
+
+    async def __snapshot_states(self):
+        # framework states like lent resources are only saved in snapshots,
+        # lava sweeps its resources missing from them after restart
+        interval = Config.state_journal.get("snapshot_interval", 60)
+        while True:
+            await asyncio.sleep(interval)
+            self.__snapshot_state()
+
     async def __init_frameworks(self):
         self.logger.info("Start to init following frameworks:")
 
+        if self.__restored_state:
+            now = time.time()
+            for resource, deadline in self.__restored_state["timers"].items():
+                if resource in self.resource_states:
+                    self.__start_seized_status_timeout(resource, max(deadline - now, 0))
+            for framework in self.__framework_plugins:
+                await framework.restore_state(
+                    self,
+                    self.__restored_state["plugins"].get(
+                        framework.__module__.rsplit(".", 1)[-1], {}
+                    ),
+                )
+
         init_tasks = []
         for framework in self.__framework_plugins:
             self.logger.info("  - %s", framework.__module__)
@@ -87,33 +175,113 @@ class Coordinator:
 
         await asyncio.gather(*init_tasks)
 
+        if self.journal:
+            self.__snapshot_state()
         self.logger.info("Framework coordinator ready.")
 
-    async def __managed_issue_resources_connect(self):
-        for resource in self.__managed_issue_disconnect_resources:
-            if await self.__default_framework_plugin.default_framework_connect(
-                resource
-            ):
-                self.__managed_issue_disconnect_resources.remove(resource)
+    def __issue_connect(self, resource):
+        # delay default framework connect of this resource to retry queue
+        self.resource_states.set_flag(resource, ResourceFlag.ISSUE_DISCONNECT)
+        self.connect_retry_queue.add(resource)
+
+    @cmd_priority(PRIORITY_HIGH)
+    async def __managed_issue_resource_connect(self, resource, slots):
+        async with slots:
+            try:
+                connected = (
+                    await self.__default_framework_plugin.default_framework_connect(
+                        resource
+                    )
+                )
+            except Exception:  # pylint: disable=broad-except
+                self.logger.error(traceback.format_exc())
+                connected = False
+
+        if connected:
+            self.resource_states.clear_flag(resource, ResourceFlag.ISSUE_DISCONNECT)
+            self.connect_retry_queue.discard(resource)
+        else:
+            delay = self.connect_retry_queue.failed(resource)
+            self.logger.warning(
+                "* %s connect to default framework failed %d times, retry in %.1fs",
+                resource,
+                self.connect_retry_queue.attempts(resource),
+                delay,
+            )
 
-    async def __schedule_frameworks(self):
+    async def __connect_issue_resources(self):
+        # connect resources which disconnect by fc but previously not successful connect
+        slots = asyncio.Semaphore(self.connect_retry_queue.concurrency)
+        attempts = set()  # keep references of running attempts
         while True:
-            # connect all resources which disconnect by fc but previously not successful connect
-            await self.__managed_issue_resources_connect()
+            for resource in self.connect_retry_queue.take_due():
+                if not self.resource_states.has_flag(
+                    resource, ResourceFlag.ISSUE_DISCONNECT
+                ):
+                    self.connect_retry_queue.discard(resource)
+                    continue
+                attempt = asyncio.create_task(
+                    self.__managed_issue_resource_connect(resource, slots)
+                )
+                attempts.add(attempt)
+                attempt.add_done_callback(attempts.discard)
+            await self.connect_retry_queue.wait()
 
-            # schedule different frameworks
-            for framework in self.__framework_plugins:
-                if framework.schedule_tick % framework.schedule_interval == 0:
-                    framework.schedule_tick = 0
-                    await framework.schedule(self)
-                framework.schedule_tick += 1
+    @cmd_priority(PRIORITY_BULK)
+    async def __schedule_framework(self, framework):
+        """
+        Schedule loop of one framework, a slow framework won't delay others
+        """
+
+        name = framework.__module__.rsplit(".", 1)[-1]
+        while True:
+            start = time.monotonic()
+            try:
+                await framework.schedule(self)
+                await self.__seize_requested(framework)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.error("%s schedule failure:", name)
+                self.logger.error(traceback.format_exc())
+
+            cost = time.monotonic() - start
+            if cost > framework.schedule_interval:
+                self.logger.warning(
+                    "%s schedule took %.1fs, overran its %ss interval",
+                    name,
+                    cost,
+                    framework.schedule_interval,
+                )
 
-            await asyncio.sleep(1)
+            await framework.wait_schedule(max(framework.schedule_interval - cost, 0))
+
+    async def __schedule_frameworks(self):
+        await asyncio.gather(
+            self.__connect_issue_resources(),
+            *([self.__snapshot_states()] if self.journal else []),
+            *[
+                self.__schedule_framework(framework)
+                for framework in self.__framework_plugins
+            ],
+        )
+
+    def request_schedule(self, *frameworks):
+        """
+        Ask frameworks, default all, to schedule now
+        """
+
+        for framework in frameworks or self.__framework_plugins:
+            framework.request_schedule()
 
     async def __action(self):
-        await self.__init_frameworks()
-        await ApiSvr(self).start(**Config.api_server)
-        await self.__schedule_frameworks()
+        try:
+            await self.__init_frameworks()
+            await ApiSvr(self).start(**Config.api_server)
+            await self.__schedule_frameworks()
+        finally:
+            await asyncio.gather(
+                *[framework.shutdown() for framework in self.__framework_plugins],
+                return_exceptions=True,
+            )
 
     @property
     def priority_scheduler(self):
@@ -125,7 +293,7 @@ class Coordinator:
 
     @property
     def managed_resources_status(self):
-        return self.__managed_resources_status
+        return self.resource_states.statuses
 
     @property
     def framework_instances(self):
@@ -136,10 +304,19 @@ class Coordinator:
         return self.__framework_seize_strategies
 
     def managed_disconnect_resource(self, resource):
-        return resource in self.__managed_disconnect_resources
+        return self.resource_states.has_flag(resource, ResourceFlag.DISCONNECTED)
 
     def is_default_framework(self, context):  # pylint: disable=no-self-use
-        return context.__module__.split(".")[-1] == Config.default_framework
+        return context.__module__.rsplit(".", 1)[-1] == Config.default_framework
+
+    def __owner_code(self, context):
+        owner = self.__context_owners.get(context.__module__)
+        if owner is None:
+            owner = self.resource_states.owner_code(
+                context.__module__.rsplit(".", 1)[-1]
+            )
+            self.__context_owners[context.__module__] = owner
+        return owner
 
     def __get_low_priority_frameworks(self, cur_framework):
         """
@@ -153,167 +330,374 @@ class Coordinator:
             > self.__framework_priorities[cur_framework]
         ]
 
-    async def is_resource_available(self, context, resource):
-        if self.__managed_resources_status.get(resource, "") == "fc":
-            if Config.default_framework:
-                if context.__module__.split(".")[-1] == Config.default_framework:
-                    return True
-
-                (
-                    disconnect_success,
-                    maintenance_by_fc,
-                ) = await self.__default_framework_plugin.default_framework_disconnect(
-                    resource
-                )
-
-                if maintenance_by_fc:
-                    if not disconnect_success:
-                        # delay default framework connect if race condition
-                        self.__managed_issue_disconnect_resources.append(resource)
-                return disconnect_success
+    async def availability_snapshot(self, context, resources):
+        """
+        Evaluate availability of resources for context once for a scheduling
+        pass, resources need to be disconnected from default framework are
+        disconnected concurrently to let default framework batch them
+        """
 
-            return True
+        owner = self.__owner_code(context)
+        need_disconnect = Config.default_framework and not self.is_default_framework(
+            context
+        )
+        snapshot = {}
+        disconnect_resources = []
+        for resource in dict.fromkeys(resources):
+            if self.resource_states.is_state(resource, ResourceStateTable.FC):
+                if need_disconnect:
+                    disconnect_resources.append(resource)
+                else:
+                    snapshot[resource] = True
+            else:
+                snapshot[resource] = self.resource_states.is_state(
+                    resource, owner, ResourcePhase.SEIZED
+                )
 
-        if (
-            self.__managed_resources_status.get(resource, "")
-            == context.__module__.split(".")[-1] + "_seized"
+        disconnect_results = await asyncio.gather(
+            *[
+                self.__default_framework_plugin.default_framework_disconnect(resource)
+                for resource in disconnect_resources
+            ]
+        )
+        for resource, (disconnect_success, maintenance_by_fc) in zip(
+            disconnect_resources, disconnect_results
         ):
-            return True
+            if maintenance_by_fc and not disconnect_success:
+                # delay default framework connect if race condition
+                self.__issue_connect(resource)
+            snapshot[resource] = disconnect_success
 
-        return False
+        return snapshot
+
+    async def is_resource_available(self, context, resource):
+        return (await self.availability_snapshot(context, [resource]))[resource]
 
     def is_resource_non_available(self, resource):
         return (
-            self.__managed_resources_status.get(resource, "")
-            in Config.registered_frameworks
+            resource in self.resource_states
+            and self.resource_states.owner(resource) > ResourceStateTable.RETIRED
+            and self.resource_states.phase(resource) == ResourcePhase.OWNED
         )
 
     @check_priority_scheduler()
     def is_seized_resource(self, context, resource):
-        return (
-            self.__managed_resources_status.get(resource, "")
-            == context.__module__.split(".")[-1] + "_seized"
+        return self.resource_states.is_state(
+            resource, self.__owner_code(context), ResourcePhase.SEIZED
         )
 
     def clear_seized_job_records(self, device):
-        for job_id in list(self.coordinating_job_records.keys()):
-            if device == self.coordinating_job_records[job_id]:
-                self.coordinating_job_records.pop(job_id)
+        if self.coordinating_job_records.keys_referring(device):
+            self.coordinating_job_records.invalidate_referring(device)
+            self.__journal("unseize", resource=device)
 
     def is_seized_job(self, job_id):
-        # pylint: disable=consider-iterating-dictionary
-        return job_id in list(self.coordinating_job_records.keys())
+        return job_id in self.coordinating_job_records
 
-    async def __seized_status_timeout(self, resource):
-        await asyncio.sleep(90)
+    def __start_seized_status_timeout(self, resource, delay=90):
+        self.seized_status_timeout_records[resource] = asyncio.create_task(
+            self.__seized_status_timeout(resource, delay)
+        )
+        self.__seized_status_deadlines[resource] = time.time() + delay
+        self.__journal(
+            "timer",
+            resource=resource,
+            deadline=self.__seized_status_deadlines[resource],
+        )
+
+    def __cancel_seized_status_timeout(self, resource):
+        self.seized_status_timeout_records.pop(resource).cancel()
+        self.__seized_status_deadlines.pop(resource, None)
+        self.__journal("timer_cancel", resource=resource)
+
+    async def __seized_status_timeout(self, resource, delay=90):
+        await asyncio.sleep(delay)
         self.logger.info("* %s seized status be reset to fc due to timeout", resource)
+        self.seized_status_timeout_records.pop(resource, None)
+        self.__seized_status_deadlines.pop(resource, None)
+        self.__journal("timer_cancel", resource=resource)
         self.reset_resource(resource)
 
+    async def __seize_costs(self, resources):
+        """
+        Return cost of every resource reported by its owner framework
+        """
+
+        costs = {resource: {} for resource in resources}
+        for framework in self.__framework_plugins:
+            owned_resources = [
+                resource
+                for resource in resources
+                if self.resource_states.owner(resource) == self.__owner_code(framework)
+            ]
+            if not owned_resources:
+                continue
+
+            try:
+                reported_costs = await framework.seize_costs(owned_resources)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.error(traceback.format_exc())
+                continue
+            for resource in owned_resources:
+                costs[resource] = reported_costs.get(resource) or {}
+        return costs
+
+    def request_seize(
+        self, context, job_id, candidated_resources, on_result=None, priority=0
+    ):  # pylint: disable=too-many-arguments
+        """
+        Queue demand of a starved job to seize one of candidated resources,
+        demands of context are planned together after its schedule pass,
+        higher `priority` first, `on_result(resources)` gets resources
+        no longer to seize for the job
+        """
+
+        self.__seize_demands.setdefault(context, {})[job_id] = (
+            list(candidated_resources),
+            on_result,
+            priority,
+        )
+
+    async def __seize_requested(self, context):
+        demands = self.__seize_demands.pop(context, None)
+        if not demands:
+            return
+
+        # stable sort, jobs of equal priority keep request order
+        demands = dict(sorted(demands.items(), key=lambda demand: -demand[1][2]))
+        results = await self.seize_resources(
+            context,
+            {job_id: candidates for job_id, (candidates, _, _) in demands.items()},
+        )
+        for job_id, (_, on_result, _) in demands.items():
+            if results and results.get(job_id) and on_result:
+                on_result(results[job_id])
+
+    async def __kick_off(self, context, job_id, resource, seizable):
+        # states possibly changed since the plan was made
+        if self.is_seized_job(job_id) or not seizable(resource):
+            return False
+
+        self.coordinating_job_records[job_id] = resource
+        self.__journal("seize", job=job_id, resource=resource)
+
+        for framework in self.__framework_plugins:
+            if self.__owner_code(framework) == self.resource_states.owner(resource):
+                self.__set_resource_status(
+                    resource, self.__owner_code(context), ResourcePhase.SEIZING
+                )
+                self.logger.info("Force kick off the resource %s.", resource)
+                await framework.force_kick_off(resource)
+                self.__set_resource_status(
+                    resource, self.__owner_code(context), ResourcePhase.SEIZED
+                )
+
+                # timeout for seized status
+                self.__start_seized_status_timeout(resource)
+                break
+        return True
+
+    def __seizable(self, context):
+        low_priority_owners = {
+            self.resource_states.owner_code(framework)
+            for framework in self.__get_low_priority_frameworks(
+                context.__module__.rsplit(".", 1)[-1]
+            )
+        }
+
+        def seizable(resource):
+            return (
+                self.resource_states.owner(resource) in low_priority_owners
+                and self.resource_states.phase(resource) == ResourcePhase.OWNED
+            )
+
+        return seizable
+
+    def __plan_seizes(self, demands, costs):
+        """
+        Assign jobs one by one in priority order, each takes its best free
+        victim ranked by seize policy, return `job id -> resource to seize`
+        """
+
+        assignments = {}
+        planned_resources = set()
+        for job_id, candidates in demands.items():
+            ranked_resources, waiting_resources = self.seize_policy.rank(
+                {
+                    resource: costs[resource]
+                    for resource in candidates
+                    if resource in costs and resource not in planned_resources
+                }
+            )
+            if ranked_resources:
+                assignments[job_id] = ranked_resources[0]
+                planned_resources.add(ranked_resources[0])
+            elif waiting_resources:
+                # retried in later passes until the work finishes
+                self.logger.info(
+                    "Wait for %s to finish instead of seizing for %s",
+                    waiting_resources[0],
+                    job_id,
+                )
+                planned_resources.add(waiting_resources[0])
+        return assignments
+
+    @cmd_priority(PRIORITY_HIGH)
+    async def __execute_seizes(self, context, assignments, seizable):
+        """
+        Kick off planned resources with bounded concurrency, return
+        `job id -> seized resource`
+        """
+
+        slots = asyncio.Semaphore(self.seize_policy.concurrency)
+
+        async def kick_off(job_id, resource):
+            async with slots:
+                return await self.__kick_off(context, job_id, resource, seizable)
+
+        kicked_off = await asyncio.gather(
+            *[kick_off(job_id, resource) for job_id, resource in assignments.items()]
+        )
+        return {
+            job_id: resource
+            for (job_id, resource), success in zip(assignments.items(), kicked_off)
+            if success
+        }
+
     @check_priority_scheduler()
-    async def coordinate_resources(self, context, job_id, *candidated_resources):
+    async def seize_resources(self, context, demands):
         """
-        Seize resource from low priority framework
+        Seize resources from low priority frameworks for starved jobs of
+        context in one plan, `demands` is `job id -> candidated resources`
+        in job priority order. Every job gets at most one resource, no
+        resource is seized twice, kick offs run with bounded concurrency.
+        Return `job id -> resources no longer to seize for the job`
         """
 
-        if not candidated_resources:
-            return []
+        name = context.__module__.rsplit(".", 1)[-1]
+        seizable = self.__seizable(context)
+
+        # collect resources seizable for jobs not yet seized
+        demands = {
+            job_id: list(dict.fromkeys(candidates))
+            for job_id, candidates in demands.items()
+            if not self.is_seized_job(job_id)
+        }
+        results = {
+            job_id: [resource for resource in candidates if not seizable(resource)]
+            for job_id, candidates in demands.items()
+        }
+        candidated_seized_resources = list(
+            dict.fromkeys(
+                resource
+                for candidates in demands.values()
+                for resource in candidates
+                if seizable(resource)
+            )
+        )
+        if not candidated_seized_resources:
+            return results
 
         self.logger.info(
             "[start] seize resource requirement from %s for %s",
-            context.__module__.split(".")[-1],
-            job_id,
+            name,
+            ", ".join(str(job_id) for job_id in demands),
         )
 
-        candidated_seized_resources = [
-            candidated_resource
-            for candidated_resource in candidated_resources
-            if self.managed_resources_status[candidated_resource]
-            in self.__get_low_priority_frameworks(context.__module__.split(".")[-1])
-        ]
+        costs = (
+            await self.__seize_costs(candidated_seized_resources)
+            if self.seize_policy.needs_costs
+            else {resource: {} for resource in candidated_seized_resources}
+        )
+        seized = await self.__execute_seizes(
+            context, self.__plan_seizes(demands, costs), seizable
+        )
+        for job_id, resource in seized.items():
+            results[job_id].append(resource)
 
-        high_priority_resources = list(
-            set(candidated_resources).difference(set(candidated_seized_resources))
+        self.logger.info(
+            "[done] seize resource requirement from %s, %d of %d jobs seized",
+            name,
+            len(seized),
+            len(demands),
         )
-        low_priority_resources = []
 
-        if candidated_seized_resources:
-            candidated_seized_resource = candidated_seized_resources[0]
-            self.coordinating_job_records[job_id] = candidated_seized_resource
+        return results
 
-            # kick off resource
-            for framework in self.__framework_plugins:
-                if (
-                    framework.__module__.split(".")[-1]
-                    == self.managed_resources_status[candidated_seized_resource]
-                ):
-                    self.__set_resource_status(
-                        candidated_seized_resource,
-                        context.__module__.split(".")[-1] + "_seizing",
-                    )
-                    self.logger.info(
-                        "Force kick off the resource %s.", candidated_seized_resource
-                    )
-                    await framework.force_kick_off(candidated_seized_resource)
-                    self.__set_resource_status(
-                        candidated_seized_resource,
-                        context.__module__.split(".")[-1] + "_seized",
-                    )
+    @check_priority_scheduler()
+    async def coordinate_resources(self, context, job_id, *candidated_resources):
+        """
+        Seize resource from low priority framework for one job
+        """
 
-                    # timeout for seized status
-                    timeout_task = asyncio.create_task(
-                        self.__seized_status_timeout(candidated_seized_resource)
-                    )
-                    self.seized_status_timeout_records[
-                        candidated_seized_resource
-                    ] = timeout_task
+        if not candidated_resources:
+            return []
 
-                    break
-            low_priority_resources.append(candidated_seized_resource)
+        results = await self.seize_resources(context, {job_id: candidated_resources})
+        return results.get(job_id, [])
 
+    def __set_resource_status(self, resource, owner, phase=ResourcePhase.OWNED):
+        self.resource_states.set(resource, owner, phase)
         self.logger.info(
-            "[done] seize resource requirement from %s for %s",
-            context.__module__.split(".")[-1],
-            job_id,
+            "* %s now belongs to %s", resource, self.resource_states.status(resource)
         )
 
-        return high_priority_resources + low_priority_resources
-
-    def __set_resource_status(self, resource, status):
-        self.__managed_resources_status[resource] = status
-        self.logger.info("* %s now belongs to %s", resource, status)
-
+    @cmd_priority(PRIORITY_HIGH)
     async def return_resource(self, resource):
-        if (
-            self.__managed_resources_status.get(resource, "")
-            in Config.registered_frameworks
-        ):
-            self.__set_resource_status(resource, "fc")
+        if self.is_resource_non_available(resource):
+            self.__set_resource_status(resource, ResourceStateTable.FC)
 
-        if Config.default_framework and resource in self.__managed_disconnect_resources:
+        if Config.default_framework and self.resource_states.clear_flag(
+            resource, ResourceFlag.DISCONNECTED
+        ):
             # restore default framework resource status
-            self.__managed_disconnect_resources.remove(resource)
             if not await self.__default_framework_plugin.default_framework_connect(
                 resource
             ):
                 # delay default framework connect for this resource if connect api call failure
-                self.__managed_issue_disconnect_resources.append(resource)
+                self.__issue_connect(resource)
+
+        # resource is free now, let frameworks pick it up without waiting
+        self.request_schedule()
+
+    def claim_resource(self, resource, context):
+        """
+        Accept resource for context only if it's still free or seized for
+        context, availability evaluated earlier in a pass is stale once
+        another framework accepted the resource meanwhile
+        """
+
+        if not (
+            self.resource_states.is_state(resource, ResourceStateTable.FC)
+            or self.resource_states.is_state(
+                resource, self.__owner_code(context), ResourcePhase.SEIZED
+            )
+        ):
+            self.logger.info(
+                "* %s taken by %s meanwhile, skip it",
+                resource,
+                self.resource_states.status(resource),
+            )
+            return False
+
+        self.accept_resource(resource, context)
+        return True
 
     def accept_resource(self, resource, context):
         # cancel seized status timeout task if this resource is seized from others
         if resource in self.seized_status_timeout_records:
-            timeout_task = self.seized_status_timeout_records.pop(resource)
-            timeout_task.cancel()
+            self.__cancel_seized_status_timeout(resource)
 
-        self.__set_resource_status(resource, context.__module__.split(".")[-1])
+        self.__set_resource_status(resource, self.__owner_code(context))
         if Config.default_framework:
-            if context.__module__.split(".")[-1] != Config.default_framework:
-                self.__managed_disconnect_resources.append(resource)
+            if not self.is_default_framework(context):
+                self.resource_states.set_flag(resource, ResourceFlag.DISCONNECTED)
 
     def retire_resource(self, resource):
-        self.__set_resource_status(resource, "retired")
+        self.__set_resource_status(resource, ResourceStateTable.RETIRED)
 
     def reset_resource(self, resource):
-        self.__set_resource_status(resource, "fc")
+        self.__set_resource_status(resource, ResourceStateTable.FC)
 
     def start(self):
         if Config.cluster["enable"]:
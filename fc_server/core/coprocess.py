@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import json
+import logging
+import os
+import shlex
+import sys
+
+from fc_server.core.config import Config
+
+
+class Coprocess:
+    """
+    One warm helper process, see fc_common.coprocess
+    """
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.calls = 0
+
+    @classmethod
+    async def start(cls, executables):
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "fc_common.coprocess",
+            *executables,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=64 * 1024 * 1024,  # one response is one line
+        )
+        return cls(proc)
+
+    async def call(self, argv, timeout=None):
+        self.calls += 1
+        self.proc.stdin.write((json.dumps({"argv": argv}) + "\n").encode())
+        await self.proc.stdin.drain()
+
+        line = await asyncio.wait_for(self.proc.stdout.readline(), timeout)
+        if not line:
+            raise ConnectionError("coprocess exited")
+        return json.loads(line)
+
+    def stop(self):
+        if self.proc.returncode is None:
+            self.proc.kill()
+
+
+class CoprocessPool:
+    """
+    Pool of warm helper processes which run python command line tools
+    in process. Commands which need shell features, or whose executable has
+    no python entry point, are left to the shell.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    shell_chars = set("|&;<>()$`\\*?[]{}~!#\n")
+
+    __shared = None
+
+    def __init__(self, executables, size=4, max_calls=100, call_timeout=300):
+        self.executables = set(executables)
+        self.size = size
+        self.max_calls = max_calls  # recycle helper after this many calls
+        self.call_timeout = call_timeout  # kill helper stuck in one call
+
+        self.logger = logging.getLogger("fc_server")
+
+        self.__unsupported = set()
+        self.__idle = []
+        self.__slots = None
+        self.__loop = None
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the pool configured by `cmd_runner`, None in shell mode
+        """
+
+        if cls.__shared is None:
+            runner = Config.cmd_runner
+            if runner.get("mode", "shell") != "coprocess":
+                cls.__shared = False
+            else:
+                cls.__shared = cls(
+                    runner.get("executables", ["lavacli", "labgrid-client"]),
+                    runner.get("pool_size", 4),
+                    runner.get("max_calls", 100),
+                    runner.get("call_timeout", 300),
+                )
+        return cls.__shared or None
+
+    @classmethod
+    def needs_shell(cls, cmd):
+        """
+        Check if cmd uses shell features like pipe, redirect, expansion
+        """
+
+        quote = None
+        for char in cmd:
+            if quote == "'":
+                if char == "'":
+                    quote = None
+            elif quote == '"':
+                if char == '"':
+                    quote = None
+                elif char in "$`\\":
+                    return True
+            elif char in "'\"":
+                quote = char
+            elif char in cls.shell_chars:
+                return True
+        return False
+
+    def argv(self, cmd):
+        """
+        Return argv if cmd could run in a helper, otherwise None
+        """
+
+        if self.needs_shell(cmd):
+            return None
+
+        try:
+            argv = shlex.split(cmd)
+        except ValueError:
+            return None
+
+        if not argv:
+            return None
+        executable = os.path.basename(argv[0])
+        if executable not in self.executables or executable in self.__unsupported:
+            return None
+        return argv
+
+    def __bind_loop(self):
+        # helpers are bound to the loop which spawned them
+        loop = asyncio.get_event_loop()
+        if self.__loop is not loop:
+            for coprocess in self.__idle:
+                coprocess.stop()
+            self.__idle = []
+            self.__slots = asyncio.Semaphore(self.size)
+            self.__loop = loop
+
+    async def run(self, argv):
+        """
+        Return (returncode, stdout, stderr), or None if not runnable in helper
+        """
+
+        self.__bind_loop()
+        slots = self.__slots
+        await slots.acquire()
+        coprocess = None
+        try:
+            coprocess = (
+                self.__idle.pop()
+                if self.__idle
+                else await Coprocess.start(self.executables)
+            )
+            response = await coprocess.call(argv, self.call_timeout)
+        except BaseException:
+            # helper state unknown once interrupted or timed out, never reuse
+            # it, next call spawns a fresh one
+            if coprocess:
+                coprocess.stop()
+            slots.release()
+            raise
+
+        if coprocess.calls < self.max_calls and slots is self.__slots:
+            self.__idle.append(coprocess)
+        else:
+            coprocess.stop()
+        slots.release()
+
+        if response["returncode"] is None:
+            self.logger.warning("No python entry point for %s, use shell", argv[0])
+            self.__unsupported.add(os.path.basename(argv[0]))
+            return None
+        return response["returncode"], response["stdout"], response["stderr"]
+
+    async def close(self):
+        for coprocess in self.__idle:
+            coprocess.stop()
+            await coprocess.proc.wait()
+        self.__idle = []
+
+    @classmethod
+    async def run_cmd(cls, cmd):
+        """
+        Run cmd in shared pool, return None if the shell should run it
+        """
+
+        pool = cls.shared()
+        argv = pool.argv(cmd) if pool else None
+        if not argv:
+            return None
+
+        try:
+            return await pool.run(argv)
+        except asyncio.TimeoutError:
+            # cmd possibly already executed, don't run it again in shell
+            pool.logger.error(
+                "Coprocess killed after %ss for %r", pool.call_timeout, cmd
+            )
+            return 1, "", f"coprocess timeout after {pool.call_timeout}s"
+        except (ConnectionError, ValueError) as error:
+            # cmd possibly already executed, don't run it again in shell
+            pool.logger.error("Coprocess failed for %r: %r", cmd, error)
+            return 1, "", f"coprocess failure: {error!r}"
+        except OSError as error:
+            pool.logger.warning("Coprocess unavailable: %r, use shell", error)
+            return None
@@ -9,6 +9,8 @@ import asyncio
 import logging
 from functools import wraps
 
+from fc_server.core.governor import cmd_priority_lane
+
 logger = logging.getLogger("fc_server")
 
 
@@ -53,7 +55,9 @@ def check_seize_strategy(*decorator_args):
         def decorator(*args):
             driver = decorator_args[0]
             context = decorator_args[1]
-            if not driver.framework_seize_strategies[context.__module__.split(".")[-1]]:
+            if not driver.framework_seize_strategies[
+                context.__module__.rsplit(".", 1)[-1]
+            ]:
                 return False
             return func(*args)
 
@@ -62,6 +66,25 @@ def check_seize_strategy(*decorator_args):
     return wrapper
 
 
+def cmd_priority(priority):
+    """
+    Run commands issued in the decorated coroutine in `priority` lane
+    """
+
+    def wrapper(func):
+        @wraps(func)
+        async def decorator(*args, **kwargs):
+            token = cmd_priority_lane.set(priority)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                cmd_priority_lane.reset(token)
+
+        return decorator
+
+    return wrapper
+
+
 def verify_cmd_results(func):
     @wraps(func)
     async def decorator(*args, desc=None):
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import time
+
+from fc_server.core.config import Config
+
+# priority lanes of commands, lower value goes first
+PRIORITY_HIGH = 0  # user facing: api requests, resource handoffs
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2  # periodic scheduling refreshes
+
+cmd_priority_lane = contextvars.ContextVar("cmd_priority_lane", default=PRIORITY_NORMAL)
+
+
+class CmdGovernor:
+    """
+    Limit concurrency and rate of commands of one executable,
+    waiting commands are granted by priority lane, then by arrival
+    """
+
+    # limits, counters and lane queues are all needed to grant commands
+    # pylint: disable=too-many-instance-attributes
+
+    __governors = {}  # executable -> governor
+
+    def __init__(self, name, concurrency=32, rate=None, burst=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate  # commands per second, None means no rate limit
+        self.burst = burst or (rate and max(int(rate), 1))
+
+        self.active = 0
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        self.__tokens = self.burst
+        self.__refill_time = time.monotonic()
+        self.__waiters = []  # heap of (priority, seq, future)
+        self.__seq = itertools.count()
+        self.__timer = None
+        self.__timer_loop = None
+
+    @property
+    def queue_depth(self):
+        return len(self.__waiters)
+
+    @staticmethod
+    def executable(cmd):
+        words = cmd.split()
+        if len(words) > 2 and words[0] == "timeout":
+            words = words[2:]
+        return os.path.basename(words[0]) if words else ""
+
+    @classmethod
+    def for_cmd(cls, cmd):
+        name = cls.executable(cmd)
+        if name not in cls.__governors:
+            settings = Config.cmd_governor.get(
+                name, Config.cmd_governor.get("default", {})
+            )
+            cls.__governors[name] = cls(name, **settings)
+        return cls.__governors[name]
+
+    @classmethod
+    def stats(cls):
+        return {
+            name: {
+                "concurrency": governor.concurrency,
+                "rate": governor.rate,
+                "active": governor.active,
+                "queue_depth": governor.queue_depth,
+                "granted": governor.granted,
+                "average_wait": round(governor.total_wait / governor.granted, 6)
+                if governor.granted
+                else 0.0,
+                "max_wait": round(governor.max_wait, 6),
+            }
+            for name, governor in cls.__governors.items()
+        }
+
+    def __take_token(self):
+        if not self.rate:
+            return 0
+
+        now = time.monotonic()
+        self.__tokens = min(
+            self.burst, self.__tokens + (now - self.__refill_time) * self.rate
+        )
+        self.__refill_time = now
+        if self.__tokens >= 1:
+            self.__tokens -= 1
+            return 0
+        return (1 - self.__tokens) / self.rate
+
+    def __dispatch(self):
+        self.__timer = None
+        while self.__waiters and self.active < self.concurrency:
+            if self.__waiters[0][2].done():  # cancelled while waiting
+                heapq.heappop(self.__waiters)
+                continue
+
+            delay = self.__take_token()
+            if delay:
+                self.__timer_loop = asyncio.get_event_loop()
+                self.__timer = self.__timer_loop.call_later(delay, self.__dispatch)
+                return
+
+            _, _, future = heapq.heappop(self.__waiters)
+            self.active += 1
+            future.set_result(None)
+
+    async def acquire(self):
+        start = time.monotonic()
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(
+            self.__waiters, (cmd_priority_lane.get(), next(self.__seq), future)
+        )
+        # timer left by a stopped loop never fires
+        if not self.__timer or self.__timer_loop is not asyncio.get_event_loop():
+            self.__dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # granted just before cancelled
+            raise
+
+        wait = time.monotonic() - start
+        self.granted += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def release(self):
+        self.active -= 1
+        if not self.__timer:
+            self.__dispatch()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *_):
+        self.release()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+class AdaptiveInterval:
+    """
+    Polling interval driven by observed demand: tighten to `minimum` once
+    demand shows up, back off towards `maximum` after idle passes
+    """
+
+    def __init__(self, interval, minimum, maximum, backoff=2.0, idle_passes=3):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.idle_passes = idle_passes  # idle passes before backing off
+
+        self.interval = min(max(interval, minimum), maximum)
+        self.reason = "initial"
+        self.__idle = 0
+
+    def observe(self, demand, what="pending"):
+        """
+        Feed demand seen in one pass, return the interval for next pass
+        """
+
+        if demand:
+            self.__idle = 0
+            self.interval = self.minimum
+            self.reason = f"{demand} {what}"
+        else:
+            self.__idle += 1
+            if self.__idle >= self.idle_passes and self.interval < self.maximum:
+                self.interval = min(self.interval * self.backoff, self.maximum)
+                self.reason = f"idle for {self.__idle} passes"
+        return self.interval
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "minimum": self.minimum,
+            "maximum": self.maximum,
+            "reason": self.reason,
+        }
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import json
+import logging
+import os
+import time
+
+
+class StateJournal:
+    """
+    Append-only journal of coordinator state transitions, compacted by
+    periodic snapshots, used to warm restart fc_server.
+
+    `path` holds one json record per line since last snapshot,
+    `path`.snapshot holds the whole state at last snapshot.
+    Records are absolute values, replay them on snapshot gives current state:
+      {"op": "state", "resource": r, "owner": "lava", "phase": 0}
+      {"op": "flags", "resource": r, "flags": 1}
+      {"op": "seize", "job": j, "resource": r}
+      {"op": "unseize", "resource": r}
+      {"op": "timer", "resource": r, "deadline": wall clock time}
+      {"op": "timer_cancel", "resource": r}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshot_path = path + ".snapshot"
+        self.records = 0  # records appended since last snapshot
+
+        self.logger = logging.getLogger("fc_server")
+        self.__handle = None
+
+    @staticmethod
+    def empty_state():
+        return {
+            "time": None,
+            "states": {},
+            "flags": {},
+            "seizes": [],
+            "timers": {},
+            "plugins": {},
+        }
+
+    @staticmethod
+    def apply(state, record):
+        operation = record["op"]
+        resource = record.get("resource")
+        if operation == "state":
+            state["states"][resource] = [record["owner"], record["phase"]]
+        elif operation == "flags":
+            state["flags"][resource] = record["flags"]
+        elif operation == "seize":
+            state["seizes"].append([record["job"], resource])
+        elif operation == "unseize":
+            state["seizes"] = [
+                seize for seize in state["seizes"] if seize[1] != resource
+            ]
+        elif operation == "timer":
+            state["timers"][resource] = record["deadline"]
+        elif operation == "timer_cancel":
+            state["timers"].pop(resource, None)
+
+    def load(self):
+        """
+        Return state of last snapshot with all later records replayed,
+        None if there is no journal
+        """
+
+        if not os.path.exists(self.snapshot_path) and not os.path.exists(self.path):
+            return None
+
+        state = self.empty_state()
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as snapshot:
+                state.update(json.load(snapshot))
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            self.logger.error("Drop corrupted snapshot %s", self.snapshot_path)
+
+        replayed = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        self.apply(state, json.loads(line))
+                        replayed += 1
+                    except (ValueError, KeyError, TypeError):
+                        # last record possibly partly written when fc stopped
+                        self.logger.warning("Drop journal record: %s", line[:200])
+        except FileNotFoundError:
+            pass
+
+        self.logger.info(
+            "Loaded state journal %s, %d records replayed", self.path, replayed
+        )
+        return state
+
+    def append(self, operation, **fields):
+        if not self.__handle:
+            # pylint: disable=consider-using-with
+            self.__handle = open(self.path, "a", encoding="utf-8")
+        self.__handle.write(
+            json.dumps({"op": operation, **fields}, separators=(",", ":")) + "\n"
+        )
+        self.__handle.flush()
+        self.records += 1
+
+    def snapshot(self, state):
+        """
+        Persist whole state atomically, then truncate the journal
+        """
+
+        state = {**state, "time": time.time()}
+        temp_path = self.snapshot_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as snapshot:
+            json.dump(state, snapshot, separators=(",", ":"))
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temp_path, self.snapshot_path)
+
+        # replaying records older than the snapshot is harmless, so a crash
+        # before truncate leaves a valid journal
+        self.close()
+        with open(self.path, "w", encoding="utf-8"):
+            pass
+        self.records = 0
+
+    def close(self):
+        if self.__handle:
+            self.__handle.close()
+            self.__handle = None
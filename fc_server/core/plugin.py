@@ -5,20 +5,98 @@
 # SPDX-License-Identifier: MIT
 
 
+import asyncio
+import logging
 from abc import ABC, abstractmethod
 
+logger = logging.getLogger("fc_server")
+
 
 class FCPlugin(ABC):
     """
     Base plugin of FC
     Detail framework plugins should realize next interfaces
     `init`, `schedule`, `force_kick_off`
+    Every plugin is scheduled in its own loop every `schedule_interval` seconds,
+    `request_schedule` could be called to get an immediate pass
     """
 
     def __init__(self):
         super().__init__()
-        self.schedule_tick = 0
         self.schedule_interval = 1
+        self.schedule_controller = None  # optional AdaptiveInterval
+        self.__schedule_event = None
+
+    @property
+    def schedule_event(self):
+        # created lazily to bind to the running loop
+        if not self.__schedule_event:
+            self.__schedule_event = asyncio.Event()
+        return self.__schedule_event
+
+    def request_schedule(self):
+        """
+        Ask coordinator to schedule this plugin now instead of waiting for
+        `schedule_interval`, e.g. when framework reports an event or
+        a resource returns to FC
+        """
+
+        self.schedule_event.set()
+
+    def adapt_schedule_interval(self, demand, what="pending"):
+        """
+        Feed demand seen in this pass to `schedule_controller` to adapt interval
+        """
+
+        if not self.schedule_controller:
+            return
+
+        interval = self.schedule_controller.observe(demand, what)
+        if interval != self.schedule_interval:
+            logger.info(
+                "%s schedule interval %ss -> %ss: %s",
+                self.__module__.rsplit(".", 1)[-1],
+                self.schedule_interval,
+                interval,
+                self.schedule_controller.reason,
+            )
+            self.schedule_interval = interval
+
+    async def wait_schedule(self, timeout):
+        """
+        Wait until next pass is due or requested
+        """
+
+        try:
+            await asyncio.wait_for(self.schedule_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.schedule_event.clear()
+
+    def export_state(self):  # pylint: disable=no-self-use
+        """
+        Return json serializable plugin state to be saved in state journal
+        """
+
+        return {}
+
+    async def restore_state(self, driver, state):
+        """
+        Restore state saved by `export_state` of last run, called before `init`
+        """
+
+    async def shutdown(self):
+        """
+        Release tasks and connections of this plugin when coordinator stops
+        """
+
+    async def seize_costs(self, resources):  # pylint: disable=unused-argument
+        """
+        Return `resource -> cost` of the work on resources owned by this
+        framework for seize policy, see fc_server.core.seize.SeizePolicy
+        """
+
+        return {}
 
     @abstractmethod
     async def init(self, driver):
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import math
+import random
+import time
+
+
+class RetryQueue:
+    """
+    Retry schedule of failed items, every item backs off exponentially
+    from `base` to `maximum` seconds with +/- `jitter` ratio, so an outage
+    of the target is not hammered, and items don't retry in lockstep
+    """
+
+    def __init__(self, base=1, maximum=300, jitter=0.2, concurrency=4):
+        self.base = base
+        self.maximum = maximum
+        self.jitter = jitter
+        self.concurrency = concurrency  # attempts running at the same time
+
+        # item -> [attempts, monotonic time of next retry, inf while in flight]
+        self.__entries = {}
+        self.__wakeup = None
+
+    def __contains__(self, item):
+        return item in self.__entries
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def wakeup(self):
+        # created lazily to bind to the running loop
+        if not self.__wakeup:
+            self.__wakeup = asyncio.Event()
+        return self.__wakeup
+
+    def add(self, item):
+        """
+        Queue item for an immediate attempt, keep schedule if already queued
+        """
+
+        if item not in self.__entries:
+            self.__entries[item] = [0, time.monotonic()]
+            if self.__wakeup:
+                self.__wakeup.set()
+
+    def discard(self, item):
+        self.__entries.pop(item, None)
+
+    def failed(self, item):
+        """
+        Record one failed attempt of item, return delay to its next attempt
+        """
+
+        entry = self.__entries.get(item)
+        if not entry:
+            return None
+
+        entry[0] += 1
+        delay = min(self.base * 2 ** (entry[0] - 1), self.maximum)
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        entry[1] = time.monotonic() + delay
+        if self.__wakeup:
+            self.__wakeup.set()
+        return delay
+
+    def attempts(self, item):
+        entry = self.__entries.get(item)
+        return entry[0] if entry else 0
+
+    def take_due(self):
+        """
+        Return items due to retry now, most overdue first, they are in flight
+        until `failed` or `discard` is called for them
+        """
+
+        now = time.monotonic()
+        items = sorted(
+            (item for item, entry in self.__entries.items() if entry[1] <= now),
+            key=lambda item: self.__entries[item][1],
+        )
+        for item in items:
+            self.__entries[item][1] = math.inf
+        return items
+
+    def next_delay(self):
+        """
+        Return seconds until next item is due, None if nothing is scheduled
+        """
+
+        retry_time = min((entry[1] for entry in self.__entries.values()), default=None)
+        if retry_time in (None, math.inf):
+            return None
+        return max(retry_time - time.monotonic(), 0)
+
+    async def wait(self):
+        """
+        Wait until next item is due, or a new item is added
+        """
+
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), self.next_delay())
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "pending": len(self.__entries),
+            "concurrency": self.concurrency,
+            "items": {
+                item: {
+                    "attempts": attempts,
+                    "next_retry_in": None
+                    if retry_time == math.inf
+                    else round(max(retry_time - now, 0), 1),
+                }
+                for item, (attempts, retry_time) in self.__entries.items()
+            },
+        }
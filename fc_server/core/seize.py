@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+from importlib import import_module
+
+
+class RuntimeHistory:
+    """
+    Exponentially weighted average runtime of finished work per key,
+    e.g. lava job runtime per device type
+    """
+
+    def __init__(self, weight=0.3):
+        self.weight = weight  # weight of the latest runtime
+        self.__runtimes = {}  # key -> (average, samples)
+
+    def record(self, key, runtime):
+        average, samples = self.__runtimes.get(key, (runtime, 0))
+        self.__runtimes[key] = (
+            average + self.weight * (runtime - average) if samples else runtime,
+            samples + 1,
+        )
+
+    def estimate(self, key):
+        """
+        Return estimated runtime of key, None without history
+        """
+
+        runtime = self.__runtimes.get(key)
+        return runtime[0] if runtime else None
+
+    def stats(self):
+        return {
+            key: {"estimate": round(average, 1), "samples": samples}
+            for key, (average, samples) in self.__runtimes.items()
+        }
+
+
+class SeizePolicy:
+    """
+    Decide which low priority resource to seize for a starved job.
+    This default policy keeps candidate order and never waits.
+
+    Policies get cost of every candidate reported by its owner framework
+    with `seize_costs`, all fields are optional:
+      {"elapsed": seconds the current work has run,
+       "priority": priority of the current work,
+       "estimate": estimated total runtime of the current work}
+    """
+
+    needs_costs = False  # if costs should be queried from frameworks
+
+    def __init__(self, concurrency=8, **_):
+        self.concurrency = concurrency  # kick offs running at the same time
+
+    @staticmethod
+    def create(config):
+        """
+        Create policy from `seize_policy` config, `policy` is `first`,
+        `cost`, or `module:Class` of a custom policy
+        """
+
+        options = dict(config)
+        name = options.pop("policy", "first")
+        if name == "first":
+            return SeizePolicy(**options)
+        if name == "cost":
+            return CostSeizePolicy(**options)
+
+        module, _, cls = name.partition(":")
+        return getattr(import_module(module), cls)(**options)
+
+    def rank(self, costs):
+        """
+        Return (resources to seize in preferred order, resources to wait for),
+        `costs` is `resource -> cost` in candidate order
+        """
+
+        return list(costs), []
+
+
+class CostSeizePolicy(SeizePolicy):
+    """
+    Seize the resource whose current work loses least when cancelled.
+    Work lost is elapsed time weighted by priority. If some work is
+    estimated to finish before the cheapest cancel would even pay off,
+    wait for it instead of cancelling anything.
+    """
+
+    needs_costs = True
+
+    def __init__(self, priority_weight=0.01, wait_threshold=300, **options):
+        super().__init__(**options)
+        self.priority_weight = priority_weight
+        self.wait_threshold = wait_threshold  # longest seconds to wait for
+
+    def loss(self, cost):
+        return (cost.get("elapsed") or 0) * (
+            1 + self.priority_weight * (cost.get("priority") or 0)
+        )
+
+    @staticmethod
+    def remaining(cost):
+        """
+        Return estimated seconds before work finishes, None if unknown
+        """
+
+        if cost.get("elapsed") is None or cost.get("estimate") is None:
+            return None
+        return max(cost["estimate"] - cost["elapsed"], 0)
+
+    def rank(self, costs):
+        # stable sort, candidates with equal loss keep their order
+        ranked = sorted(costs, key=lambda resource: self.loss(costs[resource]))
+        if not ranked:
+            return [], []
+
+        finishing = {
+            resource: remaining
+            for resource, remaining in (
+                (resource, self.remaining(cost)) for resource, cost in costs.items()
+            )
+            if remaining is not None and remaining <= self.wait_threshold
+        }
+        if finishing and min(finishing.values()) < self.loss(costs[ranked[0]]):
+            return [], sorted(finishing, key=finishing.get)
+        return ranked, []
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import array
+import collections.abc
+import enum
+
+
+class ResourcePhase(enum.IntEnum):
+    OWNED = 0  # owned by owner, fc owner means idle
+    SEIZING = 1  # owner framework is kicking off a low priority framework
+    SEIZED = 2  # seized for owner framework, not yet accepted by it
+
+
+class ResourceFlag(enum.IntFlag):
+    DISCONNECTED = 1  # disconnected from default framework by fc
+    ISSUE_DISCONNECT = 2  # connect back to default framework failed, to retry
+
+
+class ResourceStatusView(collections.abc.Mapping):
+    """
+    Read only `resource -> status string` view of ResourceStateTable,
+    status is like `fc`, `lava`, `labgrid_seizing`, `lava_seized`, `retired`
+    """
+
+    def __init__(self, table):
+        self.__table = table
+
+    def __getitem__(self, resource):
+        if resource not in self.__table:
+            raise KeyError(resource)
+        return self.__table.status(resource)
+
+    def __iter__(self):
+        return iter(self.__table.resources)
+
+    def __len__(self):
+        return len(self.__table.resources)
+
+
+class ResourceStateTable:
+    """
+    State of managed resources, indexed by integer resource id.
+    Owner and phase are integer coded columns, membership of every
+    (owner, phase) state and every flag is indexed for O(1) check and count,
+    `version` increases on every change.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    FC = 0
+    RETIRED = 1
+
+    def __init__(self, resources, frameworks):
+        self.owners = ["fc", "retired", *frameworks]
+        self.__owner_codes = {owner: code for code, owner in enumerate(self.owners)}
+
+        self.resources = list(dict.fromkeys(resources))
+        self.__ids = {resource: rid for rid, resource in enumerate(self.resources)}
+
+        size = len(self.resources)
+        self.__owner = array.array("B", [self.FC] * size)
+        self.__phase = array.array("B", [ResourcePhase.OWNED] * size)
+        self.__flags = array.array("B", [0] * size)
+
+        # (owner, phase) -> ordered ids, flag -> ordered ids
+        self.__members = {(self.FC, ResourcePhase.OWNED): dict.fromkeys(range(size))}
+        self.__flagged = {flag: {} for flag in ResourceFlag}
+
+        self.version = 0
+        self.statuses = ResourceStatusView(self)
+        self.listener = None  # listener(op, **fields) of every change
+
+    def __contains__(self, resource):
+        return resource in self.__ids
+
+    def owner_code(self, owner):
+        """
+        Return code of owner name, e.g. `fc`, `retired`, `lava`
+        """
+
+        return self.__owner_codes[owner]
+
+    def owner(self, resource):
+        return self.__owner[self.__ids[resource]]
+
+    def phase(self, resource):
+        return ResourcePhase(self.__phase[self.__ids[resource]])
+
+    def status(self, resource):
+        rid = self.__ids[resource]
+        owner = self.owners[self.__owner[rid]]
+        phase = self.__phase[rid]
+        if phase == ResourcePhase.SEIZING:
+            return owner + "_seizing"
+        if phase == ResourcePhase.SEIZED:
+            return owner + "_seized"
+        return owner
+
+    def is_state(self, resource, owner, phase=ResourcePhase.OWNED):
+        """
+        Check if resource is in (owner code, phase), False for unknown resource
+        """
+
+        rid = self.__ids.get(resource)
+        return (
+            rid is not None
+            and self.__owner[rid] == owner
+            and self.__phase[rid] == phase
+        )
+
+    def set(self, resource, owner, phase=ResourcePhase.OWNED):
+        rid = self.__ids[resource]
+        state = (self.__owner[rid], self.__phase[rid])
+        if state == (owner, phase):
+            return
+
+        del self.__members[state][rid]
+        self.__members.setdefault((owner, phase), {})[rid] = None
+        self.__owner[rid] = owner
+        self.__phase[rid] = phase
+        self.version += 1
+        if self.listener:
+            self.listener(
+                "state", resource=resource, owner=self.owners[owner], phase=int(phase)
+            )
+
+    def members(self, owner, phase=ResourcePhase.OWNED):
+        return [self.resources[rid] for rid in self.__members.get((owner, phase), ())]
+
+    def count(self, owner, phase=ResourcePhase.OWNED):
+        return len(self.__members.get((owner, phase), ()))
+
+    def has_flag(self, resource, flag):
+        rid = self.__ids.get(resource)
+        return rid is not None and bool(self.__flags[rid] & flag)
+
+    def set_flag(self, resource, flag):
+        rid = self.__ids[resource]
+        if not self.__flags[rid] & flag:
+            self.__flags[rid] |= flag
+            self.__flagged[flag][rid] = None
+            self.version += 1
+            if self.listener:
+                self.listener("flags", resource=resource, flags=self.__flags[rid])
+
+    def clear_flag(self, resource, flag):
+        """
+        Clear flag of resource, return True if it was set
+        """
+
+        rid = self.__ids.get(resource)
+        if rid is None or not self.__flags[rid] & flag:
+            return False
+
+        self.__flags[rid] &= ~flag
+        del self.__flagged[flag][rid]
+        self.version += 1
+        if self.listener:
+            self.listener("flags", resource=resource, flags=self.__flags[rid])
+        return True
+
+    def flagged(self, flag):
+        return [self.resources[rid] for rid in self.__flagged[flag]]
+
+    def count_flag(self, flag):
+        return len(self.__flagged[flag])
+
+    def export(self):
+        """
+        Return states and flags differ from initial ones, keyed by names
+        """
+
+        return {
+            "states": {
+                resource: [self.owners[self.__owner[rid]], self.__phase[rid]]
+                for rid, resource in enumerate(self.resources)
+                if self.__owner[rid] != self.FC or self.__phase[rid]
+            },
+            "flags": {
+                resource: self.__flags[rid]
+                for rid, resource in enumerate(self.resources)
+                if self.__flags[rid]
+            },
+        }
+
+    def restore(self, states, flags):
+        """
+        Restore exported states and flags, unknown resources and owners are
+        skipped as configuration possibly changed
+        """
+
+        restored = 0
+        for resource, (owner, phase) in states.items():
+            if resource in self and owner in self.__owner_codes:
+                self.set(resource, self.__owner_codes[owner], ResourcePhase(phase))
+                restored += 1
+        for resource, value in flags.items():
+            for flag in ResourceFlag:
+                if resource in self and value & flag:
+                    self.set_flag(resource, flag)
+        return restored
+
+    def stats(self):
+        states = {}
+        for members in self.__members.values():
+            if members:
+                states[self.status(self.resources[next(iter(members))])] = len(members)
+        return {
+            "version": self.version,
+            "states": states,
+            "flags": {
+                flag.name.lower(): len(ids) for flag, ids in self.__flagged.items()
+            },
+        }
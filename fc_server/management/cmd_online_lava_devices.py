@@ -51,7 +51,7 @@ class LavaManagement(Lava):
 
             # reset all frameworks' control on that device
             for framework in self.__framework_plugins:
-                if framework.__module__.split(".")[-1] != "lava":
+                if framework.__module__.rsplit(".", 1)[-1] != "lava":
                     await asyncio.gather(
                         *[
                             framework.force_kick_off(device)
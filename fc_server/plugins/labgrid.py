@@ -8,13 +8,21 @@
 import asyncio
 import logging
 import os
+import time
+import traceback
+from datetime import datetime
 
+from fc_server.core.cache import BoundedCache
 from fc_server.core.decorators import (
     check_priority_scheduler,
     check_seize_strategy,
+    cmd_priority,
     safe_cache,
 )
+from fc_server.core.governor import PRIORITY_HIGH
+from fc_server.core.interval import AdaptiveInterval
 from fc_server.core.plugin import FCPlugin
+from fc_server.core.retry import RetryQueue
 from fc_server.plugins.utils.labgrid import Labgrid
 
 
@@ -23,9 +31,30 @@ class Plugin(FCPlugin, Labgrid):
     Plugin for [labgrid framework](https://github.com/labgrid-project/labgrid)
     """
 
+    # scheduling caches, reservation waiter and retry states of one framework
+    # pylint: disable=too-many-instance-attributes
+
     def __init__(self, frameworks_config):
         super().__init__()
-        self.schedule_interval = 2  # poll labgrid reserve queues every 2 seconds
+        # poll labgrid reserve queues every 2 seconds, adapted to waiting reservations
+        self.schedule_controller = AdaptiveInterval(
+            2,
+            frameworks_config.get("min_interval", 2),
+            frameworks_config.get("max_interval", 10),
+        )
+        self.schedule_interval = self.schedule_controller.interval
+
+        # place -> token of fc system reservation waiting for the place,
+        # None until a failed reserve succeeds on retry
+        self.__system_reservations = {}
+        self.__reserve_retry_queue = RetryQueue(base=2, maximum=60)
+        self.__system_reservation_waiter = None
+        self.__system_reservation_wakeup = None
+        self.system_reservation_interval = 2  # check reservations every 2 seconds
+        self.system_reservation_refresh = 20  # keep them alive every 20 seconds
+
+        # places reconciled at the same time when start up
+        self.init_concurrency = frameworks_config.get("init_concurrency", 16)
 
         os.environ["LG_CROSSBAR"] = frameworks_config["lg_crossbar"]
         os.environ["LG_HOSTNAME"] = "fc"
@@ -33,7 +62,8 @@ class Plugin(FCPlugin, Labgrid):
 
         self.managed_resources = None
 
-        self.seize_cache = {}  # cache to avoid busy seize
+        # reservation -> resources, cache to avoid busy seize
+        self.seize_cache = BoundedCache(ttl=86400, refs=lambda resources: resources)
 
         self.logger = logging.getLogger("fc_server")
 
@@ -48,39 +78,138 @@ class Plugin(FCPlugin, Labgrid):
 
     async def __labgrid_system_reservation(self, driver, resource):
         self.logger.info("* [start] inject fc reservation for %s", resource)
-        await self.labgrid_create_reservation(resource, priority=100, wait=True)
+        await self.__labgrid_reserve_places([resource])
+
+        if (
+            not self.__system_reservation_waiter
+            or self.__system_reservation_waiter.done()
+        ):
+            self.__system_reservation_wakeup = asyncio.Event()
+            self.__system_reservation_waiter = asyncio.create_task(
+                self.__wait_system_reservations(driver)
+            )
+        else:
+            self.__system_reservation_wakeup.set()
+
+    async def __labgrid_reserve(self, resource):
+        # token of new system reservation, None if failed to reserve
+        ret = await self.labgrid_create_reservation(resource, priority=100, shell=True)
+        if len(ret) == 2:
+            return ret[1]
+        self.logger.error("Unable to reserve %s", resource)
+        return None
+
+    async def __labgrid_reserve_places(self, resources):
+        # reserve places concurrently, failed places back off before retry
+        tokens = await asyncio.gather(
+            *[self.__labgrid_reserve(resource) for resource in resources]
+        )
+        for resource, token in zip(resources, tokens):
+            self.__system_reservations[resource] = token
+            if token:
+                self.__reserve_retry_queue.discard(resource)
+            else:
+                self.__reserve_retry_queue.add(resource)
+                self.__reserve_retry_queue.failed(resource)
+
+    async def __labgrid_take_place(self, driver, resource):
         await self.labgrid_acquire_place(resource)
         self.logger.info("* [done] inject fc reservation for %s", resource)
 
         await driver.return_resource(resource)
 
-    async def __labgrid_init(self, driver, resource):
+    def __check_system_reservations(self, reservations):
+        """
+        Return (resources whose reservation got allocated, resources to reserve
+        again) against one reservation snapshot, allocated ones stop waiting
+        """
+
+        allocated_resources = []
+        reserve_resources = []
+        for resource in self.__reserve_retry_queue.take_due():
+            if resource in self.__system_reservations:
+                reserve_resources.append(resource)
+            else:
+                self.__reserve_retry_queue.discard(resource)
+        for resource, token in list(self.__system_reservations.items()):
+            if not token:
+                continue  # failed to reserve, retried once due
+            state = reservations.get(f"Reservation '{token}'", {}).get("state")
+            if state in ("allocated", "acquired"):
+                del self.__system_reservations[resource]
+                allocated_resources.append(resource)
+            elif state != "waiting":
+                # reservation failed or expired, e.g. coordinator restarted
+                self.logger.warning("Reserve %s again", resource)
+                reserve_resources.append(resource)
+
+        return allocated_resources, reserve_resources
+
+    async def __wait_system_reservations(self, driver):
+        """
+        Single waiter of all pending fc system reservations, places are
+        acquired and returned to fc once their reservations get allocated.
+        All reservations are checked against one reservation snapshot per pass.
+        """
+
+        refresh_time = time.monotonic()
+        while self.__system_reservations:
+            try:
+                await asyncio.wait_for(
+                    self.__system_reservation_wakeup.wait(),
+                    self.system_reservation_interval,
+                )
+            except asyncio.TimeoutError:
+                pass
+            self.__system_reservation_wakeup.clear()
+
+            reservations = await self.labgrid_get_reservations()
+            if reservations is None:
+                continue
+
+            allocated_resources, reserve_resources = self.__check_system_reservations(
+                reservations
+            )
+
+            if reserve_resources:
+                await self.__labgrid_reserve_places(reserve_resources)
+
+            if allocated_resources:
+                await asyncio.gather(
+                    *[
+                        self.__labgrid_take_place(driver, resource)
+                        for resource in allocated_resources
+                    ]
+                )
+
+            if time.monotonic() - refresh_time >= self.system_reservation_refresh:
+                refresh_time = time.monotonic()
+                await asyncio.gather(
+                    *[
+                        self.labgrid_refresh_reservation(token)
+                        for token in self.__system_reservations.values()
+                        if token
+                    ]
+                )
+
+    async def __labgrid_init(self, driver, resource, system_reservations):
         """
         Let FC take over by inject special reservation
         """
         system_reservation_found = False
 
-        reservations = await self.labgrid_get_reservations()
-        if reservations:
-            for _, v in reservations.items():  # pylint: disable=invalid-name
-                if (
-                    v["filters"]["main"] == f"name={resource}"
-                    and v["owner"] == "fc/fc"
-                    and v["prio"] == 100.0
-                ):
-                    if v["state"] == "acquired":
-                        # do nothing if system reservation already there
-                        self.logger.info("- %s system reservation exist", resource)
-                        system_reservation_found = True
-                    else:
-                        await self.labgrid_cancel_reservation(v["token"])
+        for reservation in system_reservations:
+            if reservation["state"] == "acquired":
+                # do nothing if system reservation already there
+                self.logger.info("- %s system reservation exist", resource)
+                system_reservation_found = True
+            else:
+                await self.labgrid_cancel_reservation(reservation["token"])
 
         if not system_reservation_found:
             # add system reservation for bare lock which previously not in FC control
             # or system reservation expired
-            _, reservation = await self.labgrid_create_reservation(
-                resource, priority=100, shell=True
-            )
+            reservation = await self.__labgrid_reserve(resource)
 
             ret, _, _ = await self.labgrid_acquire_place(resource)
             if ret != 0:
@@ -93,10 +222,53 @@ class Plugin(FCPlugin, Labgrid):
             else:
                 self.logger.info("- %s system reservation ready", resource)
 
-        # set correct resource status
-        owner = await self.labgrid_get_place_owner(resource)
-        if owner != "fc/fc":
-            driver.accept_resource(resource, self)
+    async def __labgrid_reconcile(self, driver, resources):
+        """
+        Reconcile all managed places from one reservation snapshot at start up,
+        at most `init_concurrency` places are handled at the same time
+        """
+
+        # system reservations are owned by fc with priority 100
+        system_reservations = {resource: [] for resource in resources}
+        for reservation in (await self.labgrid_get_reservations() or {}).values():
+            resource = reservation["filters"]["main"][5:]
+            if (
+                resource in system_reservations
+                and reservation["owner"] == "fc/fc"
+                and reservation["prio"] == 100.0
+            ):
+                system_reservations[resource].append(reservation)
+
+        semaphore = asyncio.Semaphore(self.init_concurrency)
+        reconciled = 0
+
+        async def reconcile(resource):
+            nonlocal reconciled
+            async with semaphore:
+                try:
+                    await self.__labgrid_init(
+                        driver, resource, system_reservations[resource]
+                    )
+                except Exception:  # pylint: disable=broad-except
+                    self.logger.error(traceback.format_exc())
+
+            reconciled += 1
+            if reconciled % 50 == 0 or reconciled == len(resources):
+                self.logger.info(
+                    "* labgrid places reconciled: %d/%d", reconciled, len(resources)
+                )
+
+        await asyncio.gather(*[reconcile(resource) for resource in resources])
+
+        # set correct resource status, a place restored as labgrid owned
+        # may have been taken back by fc system reservation since
+        places = await self.labgrid_get_place_snapshot()
+        owner = driver.resource_states.owner_code(self.__module__.rsplit(".", 1)[-1])
+        for resource in resources:
+            if places.get(resource, {}).get("owner") != "fc/fc":
+                driver.accept_resource(resource, self)
+            elif driver.resource_states.is_state(resource, owner):
+                await driver.return_resource(resource)
 
     async def force_kick_off(self, resource):
         """
@@ -115,17 +287,55 @@ class Plugin(FCPlugin, Labgrid):
                         await self.labgrid_release_place(resource, True)
                         break
 
-    async def __seize_resource(self, driver, job_id, candidated_resources):
+    async def seize_costs(self, resources):
+        """
+        Return age and priority of reservations holding the places
+        """
+
+        tokens = {
+            resource: await self.labgrid_get_place_token(resource)
+            for resource in resources
+        }
+        if not any(tokens.values()):
+            return {}
+        reservations = await self.labgrid_get_reservations() or {}
+
+        costs = {}
+        for resource, token in tokens.items():
+            reservation = reservations.get(f"Reservation '{token}'")
+            if not reservation:
+                continue
+            try:
+                # labgrid reports local time like 2023-03-28 10:27:14.881492
+                elapsed = max(
+                    (
+                        datetime.now() - datetime.fromisoformat(reservation["created"])
+                    ).total_seconds(),
+                    0,
+                )
+            except (KeyError, TypeError, ValueError):
+                elapsed = None
+            try:
+                priority = float(reservation.get("prio") or 0)
+            except ValueError:
+                priority = None
+            costs[resource] = {"elapsed": elapsed, "priority": priority}
+        return costs
+
+    def __seize_resource(self, driver, job_id, candidated_resources, priority):
         """
-        Request coordinator to seize low priority resource
+        Request coordinator to seize low priority resource, `priority` is
+        the prio of the waiting reservation
         """
 
         if candidated_resources:
-            priority_resources = await driver.coordinate_resources(
-                self, job_id, *candidated_resources
+            driver.request_seize(
+                self,
+                job_id,
+                candidated_resources,
+                lambda resources: self.__update_cache("seize_cache", job_id, resources),
+                priority,
             )
-            if priority_resources:
-                self.__update_cache("seize_cache", job_id, priority_resources)
 
     async def schedule(self, driver):
         """
@@ -134,6 +344,8 @@ class Plugin(FCPlugin, Labgrid):
         Coodinator will call this function periodly
         """
 
+        # handoff goes ahead of bulk refreshes, follow-up reservation inherits it
+        @cmd_priority(PRIORITY_HIGH)
         async def switch_from_fc_to_labgrid(resource):
             # if user release quickly, there possible be a window period during user release and
             # system reservation, to avoid this low probablity issue,
@@ -157,6 +369,14 @@ class Plugin(FCPlugin, Labgrid):
         # query labgrid reservations
         managed_resources_tokens = {}
         reservations = await self.labgrid_get_reservations()
+        self.adapt_schedule_interval(
+            sum(
+                1
+                for v in (reservations or {}).values()
+                if v["owner"] != "fc/fc" and v["state"] == "waiting"
+            ),
+            "waiting reservations",
+        )
         if reservations:
             for _, v in reservations.items():  # pylint: disable=invalid-name
                 resource = v["filters"]["main"][5:]
@@ -175,18 +395,29 @@ class Plugin(FCPlugin, Labgrid):
                     await self.__labgrid_guard_reservation(resource)
                     await self.labgrid_cancel_reservation(v["token"])
 
+            # availability evaluated once per resource in this pass
+            available = await driver.availability_snapshot(
+                self,
+                [
+                    v["filters"]["main"][5:]
+                    for v in reservations.values()
+                    if v["owner"] != "fc/fc" and v["state"] == "waiting"
+                ],
+            )
+
             resource_list = []
             for _, v in reservations.items():  # pylint: disable=invalid-name
                 resource = v["filters"]["main"][5:]
                 if v["owner"] != "fc/fc" and v["state"] == "waiting":
-                    if await driver.is_resource_available(self, resource):
+                    if available[resource]:
                         if driver.is_seized_resource(self, resource):
                             driver.clear_seized_job_records(resource)
 
                         # if has pending reservation not belongs to normal user
                         # meanwhile device currently belongs to fc, accept it
-                        driver.accept_resource(resource, self)
-                        resource_list.append(resource)
+                        if driver.claim_resource(resource, self):
+                            resource_list.append(resource)
+                        available[resource] = False
                     else:
                         job_id = v["token"]
 
@@ -206,10 +437,11 @@ class Plugin(FCPlugin, Labgrid):
                                 and candidated_resources
                             ):
                                 # no available resource found, try to seize from other framework
-                                asyncio.create_task(
-                                    self.__seize_resource(
-                                        driver, job_id, candidated_resources
-                                    )
+                                self.__seize_resource(
+                                    driver,
+                                    job_id,
+                                    candidated_resources,
+                                    float(v.get("prio") or 0),
                                 )
 
                         labgrid_seize_resource(self, "seize_cache", job_id)
@@ -222,6 +454,23 @@ class Plugin(FCPlugin, Labgrid):
                     ]
                 )
 
+    def __on_place_changed(self, name, place):
+        # e.g. a user reservation allocated or a place released,
+        # schedule now instead of waiting for next poll
+        if name in (self.managed_resources or []):
+            self.request_schedule()
+
+        if (
+            place
+            and place["reservation"]
+            and self.__system_reservations.get(name) == place["reservation"]
+        ):
+            self.__system_reservation_wakeup.set()
+
+    async def shutdown(self):
+        if self.labgrid_session:
+            await self.labgrid_session.close()
+
     async def init(self, driver):
         """
         Generate and return tasks to let fc own specified labgrid devices
@@ -232,9 +481,9 @@ class Plugin(FCPlugin, Labgrid):
         self.managed_resources = [
             place for place in places if place in driver.managed_resources
         ]
+        await self.labgrid_watch_places(self.__on_place_changed)
         candidated_init_resources = self.managed_resources.copy()
 
-        return [
-            self.__labgrid_init(driver, resource)
-            for resource in candidated_init_resources
-        ]
+        if not candidated_init_resources:
+            return []
+        return [self.__labgrid_reconcile(driver, candidated_init_resources)]
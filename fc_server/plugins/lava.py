@@ -7,16 +7,24 @@
 
 import asyncio
 import logging
+import time
+from contextlib import suppress
+from datetime import datetime, timezone
 
-from async_lru import alru_cache
-
+from fc_server.core.cache import BoundedCache, TTLCache
 from fc_server.core.decorators import (
     check_priority_scheduler,
     check_seize_strategy,
     safe_cache,
 )
+from fc_server.core.interval import AdaptiveInterval
 from fc_server.core.plugin import FCPlugin
-from fc_server.plugins.utils.lava import Lava
+from fc_server.core.seize import RuntimeHistory
+from fc_server.core.state import ResourceStateTable
+from fc_server.plugins.utils.lava import Lava, LavaQueueError
+from fc_server.plugins.utils.lava_events import LavaEventStream
+from fc_server.plugins.utils.lava_queue import LavaJobQueue
+from fc_server.plugins.utils.lava_tag_index import LavaTagIndex
 
 
 class Plugin(FCPlugin, Lava):
@@ -29,7 +37,13 @@ class Plugin(FCPlugin, Lava):
     def __init__(self, frameworks_config):
         super().__init__()
 
-        self.schedule_interval = 30  # poll lava job queues every 30 seconds
+        # poll lava job queues every 30 seconds, adapted to the queued jobs
+        self.schedule_controller = AdaptiveInterval(
+            30,
+            frameworks_config.get("min_interval", 10),
+            frameworks_config.get("max_interval", 120),
+        )
+        self.schedule_interval = self.schedule_controller.interval
         accurate_scheduler_criteria = frameworks_config.get(
             "accurate_scheduler_criteria", None
         )
@@ -39,9 +53,54 @@ class Plugin(FCPlugin, Lava):
                 "submitter"
             ]
 
-        self.scheduler_cache = {}  # cache to avoid busy scheduling
-        self.seize_cache = {}  # cache to avoid busy seize
-        self.job_tags_cache = {}  # cache to store job tags
+        # job id -> devices, cache to avoid busy scheduling
+        self.scheduler_cache = BoundedCache(ttl=86400, refs=lambda devices: devices)
+        # job id -> devices, cache to avoid busy seize
+        self.seize_cache = BoundedCache(ttl=86400, refs=lambda devices: devices)
+        self.job_tags_cache = BoundedCache(ttl=86400)  # cache to store job tags
+        self.job_queue = LavaJobQueue()  # queued jobs tracked across ticks
+
+        # only match jobs new or whose device type changed, fully every few ticks
+        self.full_schedule_ticks = frameworks_config.get("full_schedule_ticks", 10)
+        self.__schedule_ticks = 0
+        self.__device_type_states = {}  # device type -> resources per category
+
+        # device info rarely changes except health & current job, cache it
+        self.device_info_cache = TTLCache(frameworks_config.get("device_info_ttl", 600))
+        self.__device_states = {}  # hostname -> (health, current_job)
+
+        # job runtime per device type observed by fc, to estimate seize cost
+        self.runtime_history = RuntimeHistory()
+        self.__running_jobs = {}  # hostname -> (job id, monotonic start or None)
+        self.__cancelled_jobs = set()  # jobs cancelled by fc, not a full runtime
+        self.tag_index = LavaTagIndex()  # device tags index for job matching
+
+        self.lend_duration = 90  # seconds lava could schedule on lent devices
+        self.sweep_interval = 60  # check lent devices every 60 seconds
+        self.__lent_resources = {}  # hostname -> deadline, None once in cleanup
+        self.__sweeper = None
+        self.__sweeper_wakeup = None
+
+        # with lava events subscribed, schedule on event and poll only to reconcile
+        self.reconcile_interval = frameworks_config.get("reconcile_interval", 300)
+        self.event_stream = None
+        if frameworks_config.get("event_stream"):
+            self.event_stream = LavaEventStream(
+                frameworks_config["event_stream"],
+                self.__on_lava_event,
+                self.__on_lava_event_connection,
+            )
+        self.__event_task = None
+        self.__managed_devices = {}  # hostname -> device type, for event filter
+
+        # passes on a burst of events are spaced, they match affected device types
+        self.event_schedule_spacing = frameworks_config.get("event_schedule_spacing", 5)
+        self.__schedule_start = None  # monotonic start of last pass
+        self.__event_schedule = None  # delayed schedule request of events
+        self.__event_device_types = set()  # device types of events since last pass
+
+        self.__pending_disconnects = {}  # hostname -> future of disconnect result
+        self.__disconnect_flusher = None
 
         self.logger = logging.getLogger("fc_server")
 
@@ -49,47 +108,182 @@ class Plugin(FCPlugin, Lava):
     def __update_cache(self, cache_name, job_id, value):
         self.__dict__[cache_name][job_id] += value
 
-    async def __reset_possible_resource(self, driver, *possible_resources):
+    def __lend_resources(self, driver, *possible_resources):
         """
-        Maintenance all devices once devices finish scheduling.
-        Meanwhile, return resouces which participate LAVA scheduling to FC if device idle.
+        Record resources lent to LAVA scheduling, the shared sweeper
+        gives them back to FC once LAVA leaves them idle
         """
 
         # let lava scheduler schedule 90 seconds, then do corresponding cleanup
-        await asyncio.sleep(90)
-
-        if not driver.is_default_framework(self):
-            await self.lava_maintenance_devices(*possible_resources)
-
-        freed_possible_resources = []
-
-        # check if possible resource still be used by lava
-        while True:  # pylint: disable=too-many-nested-blocks
-            devices = await self.lava_get_devices()
-            if devices:
-                used_possible_resources = [
-                    device
-                    for device in devices
-                    if device["hostname"] in possible_resources
-                    and device["hostname"] not in freed_possible_resources
-                ]
+        deadline = time.monotonic() + self.lend_duration
+        for resource in possible_resources:
+            self.__lent_resources[resource] = deadline
+
+        if not self.__sweeper or self.__sweeper.done():
+            self.__sweeper_wakeup = asyncio.Event()
+            self.__sweeper = asyncio.create_task(self.__sweep_lent_resources(driver))
+
+    def export_state(self):
+        now = time.monotonic()
+        return {
+            "lent_resources": {
+                resource: None if deadline is None else max(deadline - now, 0)
+                for resource, deadline in self.__lent_resources.items()
+            }
+        }
+
+    async def restore_state(self, driver, state):
+        """
+        Keep sweeping resources lent before restart, lava owned resources
+        lent after last snapshot are swept at once
+        """
+
+        now = time.monotonic()
+        for resource, remaining in state.get("lent_resources", {}).items():
+            if resource in driver.managed_resources:
+                self.__lent_resources[resource] = (
+                    None if remaining is None else now + remaining
+                )
+
+        owner = driver.resource_states.owner_code(self.__module__.rsplit(".", 1)[-1])
+        for resource in driver.resource_states.members(owner):
+            self.__lent_resources.setdefault(resource, now)
+
+        if self.__lent_resources:
+            self.__lend_resources(driver)
+
+    async def __sweep_lent_resources(self, driver):
+        """
+        Maintenance lent devices once their scheduling deadline passes.
+        Meanwhile, return resouces which participate LAVA scheduling to FC if device idle.
+        All lent devices are checked against one device snapshot per sweep.
+        """
+
+        while self.__lent_resources:
+            deadlines = [
+                deadline
+                for deadline in self.__lent_resources.values()
+                if deadline is not None
+            ]
+            delay = self.sweep_interval
+            if deadlines:
+                delay = min(delay, max(min(deadlines) - time.monotonic(), 0))
+            try:
+                await asyncio.wait_for(self.__sweeper_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            self.__sweeper_wakeup.clear()
+
+            now = time.monotonic()
+            due_resources = [
+                resource
+                for resource, deadline in self.__lent_resources.items()
+                if deadline is not None and deadline <= now
+            ]
+            for resource in due_resources:
+                self.__lent_resources[resource] = None  # in cleanup
+
+            if due_resources and not driver.is_default_framework(self):
+                await self.lava_maintenance_devices(*due_resources)
+
+            cleanup_resources = [
+                resource
+                for resource, deadline in self.__lent_resources.items()
+                if deadline is None
+            ]
+            if not cleanup_resources:
+                continue
+
+            # check if possible resource still be used by lava
+            devices = await self.__get_devices()
+            if not devices:
+                continue
+            devices = {device["hostname"]: device for device in devices}
+
+            freed_resources = set()
+            for resource in cleanup_resources:
+                if self.__lent_resources.get(resource) is not None:
+                    continue  # lent again by a later schedule wave
+
+                device = devices.get(resource)
+                if not device or not device["current_job"]:
+                    del self.__lent_resources[resource]
+                if device and not device["current_job"]:
+                    freed_resources.add(resource)
+
+            if not freed_resources:
+                continue
+
+            self.logger.info("Return %d idle lava devices", len(freed_resources))
+            await asyncio.gather(
+                *[driver.return_resource(resource) for resource in freed_resources]
+            )
 
-                if len(used_possible_resources) == 0:
-                    break
+            # clean cache for returned devices
+            self.scheduler_cache.invalidate_referring(*freed_resources)
+            self.seize_cache.invalidate_referring(*freed_resources)
+
+    def __on_lava_event_connection(self, connected):
+        if connected:
+            self.schedule_interval = self.reconcile_interval
+            # catch up changes missed while not subscribed
+            self.request_schedule()
+        else:
+            self.schedule_interval = self.schedule_controller.interval
 
-                for info in used_possible_resources:
-                    if not info["current_job"]:
-                        await driver.return_resource(info["hostname"])
-                        freed_possible_resources.append(info["hostname"])
+    def __request_event_schedule(self, device_type):
+        """
+        Schedule for device type on event, a burst of events is coalesced
+        into passes at least `event_schedule_spacing` seconds apart
+        """
 
-                        # clean cache for returned device
-                        for job_id in list(self.scheduler_cache.keys()):
-                            if info["hostname"] in self.scheduler_cache[job_id]:
-                                del self.scheduler_cache[job_id]
-                        for job_id in list(self.seize_cache.keys()):
-                            if info["hostname"] in self.seize_cache[job_id]:
-                                del self.seize_cache[job_id]
-            await asyncio.sleep(60)
+        self.__event_device_types.add(device_type)
+        if self.__event_schedule:
+            return
+
+        delay = 0
+        if self.__schedule_start is not None:
+            delay = self.__schedule_start + self.event_schedule_spacing
+            delay -= time.monotonic()
+        if delay <= 0:
+            self.request_schedule()
+        else:
+            self.__event_schedule = asyncio.get_running_loop().call_later(
+                delay, self.__on_event_schedule_due
+            )
+
+    def __on_event_schedule_due(self):
+        self.__event_schedule = None
+        self.request_schedule()
+
+    def __on_lava_event(self, kind, data):
+        """
+        Trigger schedule on job submission and managed device state change
+        """
+
+        if kind == "testjob":
+            if data.get("state") == "Submitted" and (
+                not self.__managed_devices
+                or data.get("device_type") in self.__managed_devices.values()
+            ):
+                self.__request_event_schedule(data.get("device_type"))
+
+        elif kind == "device":
+            device = data.get("device")
+            if device not in self.__managed_devices:
+                return
+
+            self.device_info_cache.invalidate(device)
+            self.__request_event_schedule(self.__managed_devices[device])
+
+            # device left by lava, let sweeper return it now
+            if (
+                data.get("state") == "Idle"
+                and device in self.__lent_resources
+                and self.__lent_resources[device] is None
+                and self.__sweeper_wakeup
+            ):
+                self.__sweeper_wakeup.set()
 
     async def __get_job_tags(self, job_id):
         """
@@ -104,26 +298,75 @@ class Plugin(FCPlugin, Lava):
         Return device tag info, issue interface call will return None
         """
 
-        device_info = await self.lava_get_device_info(device)
+        device_info = await self.__get_device_info(device)
         return (device, device_info["tags"]) if device_info else None
 
     async def __get_device_info(self, device, clear=False):
         """
-        Configureable wrapper of lava_get_device_info to clean cache
+        Cached wrapper of lava_get_device_info, `clear` to refresh this device
         """
 
         if clear:
-            self.__get_cached_device_info.cache_clear()  # pylint: disable=no-member
+            self.device_info_cache.invalidate(device)
+
+        return await self.device_info_cache.get_or_load(
+            device, self.lava_get_device_info
+        )
+
+    async def __get_devices(self):
+        """
+        Wrapper of lava_get_devices to drop cached info of devices whose
+        health or current job changed since last fetch
+        """
 
-        return await self.__get_cached_device_info(device)
+        devices = await self.lava_get_devices()
+        for device in devices:
+            state = (device["health"], device["current_job"])
+            if self.__device_states.get(device["hostname"], state) != state:
+                self.device_info_cache.invalidate(device["hostname"])
+            self.__observe_job(device)
+            self.__device_states[device["hostname"]] = state
 
-    @alru_cache(None)
-    async def __get_cached_device_info(self, device):
+        return devices
+
+    def __observe_job(self, device):
         """
-        Cached wrapper of lava_get_device_info
+        Record runtime of jobs fc saw start and finish on device
         """
 
-        return await self.lava_get_device_info(device)
+        now = time.monotonic()
+        job_id = device["current_job"]
+        running_job = self.__running_jobs.get(device["hostname"])
+        if running_job and running_job[0] != job_id:
+            del self.__running_jobs[device["hostname"]]
+            if running_job[0] in self.__cancelled_jobs:
+                self.__cancelled_jobs.discard(running_job[0])
+            elif running_job[1] is not None:
+                self.runtime_history.record(device["type"], now - running_job[1])
+
+        if job_id and device["hostname"] not in self.__running_jobs:
+            # start of jobs already running at first fetch is unknown
+            self.__running_jobs[device["hostname"]] = (
+                job_id,
+                now if device["hostname"] in self.__device_states else None,
+            )
+
+    async def __index_device_tags(self, devices):
+        """
+        Refresh tag index with tags of devices, the ones whose tags
+        failed to fetch are dropped from index
+        """
+
+        device_tags_list = await asyncio.gather(
+            *[self.__get_device_tags(device["hostname"]) for device in devices]
+        )
+        for device, device_tags in zip(devices, device_tags_list):
+            if isinstance(device_tags, tuple):
+                self.tag_index.update(
+                    device["hostname"], device["type"], device_tags[1]
+                )
+            else:
+                self.tag_index.remove(device["hostname"])
 
     async def __get_device_description(self, device):
         """
@@ -148,68 +391,172 @@ class Plugin(FCPlugin, Lava):
         current_job = device_info["current_job"]
 
         if current_job:
+            self.__cancelled_jobs.add(current_job)
             await self.lava_cancel_job(current_job)
 
-    async def __seize_resource(self, driver, job_id, candidated_non_available_devices):
+    @staticmethod
+    def __job_elapsed(job_info):
+        # lava reports utc time like 20181101T07:13:06
+        try:
+            start_time = datetime.strptime(
+                job_info["start_time"], "%Y%m%dT%H:%M:%S"
+            ).replace(tzinfo=timezone.utc)
+        except (TypeError, ValueError):
+            return None
+        return max((datetime.now(timezone.utc) - start_time).total_seconds(), 0)
+
+    async def seize_costs(self, resources):
         """
-        Request coordinator to seize low priority resource
+        Return elapsed time and estimated runtime of current jobs, lava job
+        api reports no priority
         """
 
-        non_available_device_tags_list = await asyncio.gather(
-            *[
-                self.__get_device_tags(candidated_non_available_device)
-                for candidated_non_available_device in candidated_non_available_devices
-            ]
+        device_infos = await asyncio.gather(
+            *[self.__get_device_info(resource) for resource in resources]
         )
-        non_available_device_tags_list = filter(
-            lambda _: isinstance(_, tuple), non_available_device_tags_list
+        current_jobs = {
+            resource: device_info["current_job"]
+            for resource, device_info in zip(resources, device_infos)
+            if device_info and device_info["current_job"]
+        }
+        job_infos = await asyncio.gather(
+            *[self.lava_get_job_info(job_id) for job_id in current_jobs.values()]
         )
-        non_available_device_tags_dict = dict(non_available_device_tags_list)
 
-        candidated_non_available_resources = []
-        for device, tags in non_available_device_tags_dict.items():
-            if set(self.job_tags_cache[job_id]).issubset(tags):
-                candidated_non_available_resources.append(device)
-            else:
-                self.__update_cache("seize_cache", job_id, [device])
+        costs = {}
+        for resource, job_info in zip(current_jobs, job_infos):
+            if job_info:
+                costs[resource] = {
+                    "elapsed": self.__job_elapsed(job_info),
+                    "estimate": self.runtime_history.estimate(job_info["device_type"]),
+                }
+        return costs
+
+    def __seize_resource(
+        self, driver, queued_job, candidated_non_available_devices, priority
+    ):
+        """
+        Request coordinator to seize low priority resource, lava reports no
+        job priority, `priority` is derived from queue age instead
+        """
+
+        job_id = queued_job["id"]
+        device_type = queued_job["requested_device_type"]
+        candidated_bitmap = self.tag_index.bitmap(candidated_non_available_devices)
+        matched_bitmap = self.tag_index.match(
+            device_type, self.job_tags_cache[job_id], candidated_bitmap
+        )
+
+        candidated_non_available_resources = self.tag_index.devices(matched_bitmap)
+        self.__update_cache(
+            "seize_cache",
+            job_id,
+            self.tag_index.devices(candidated_bitmap & ~matched_bitmap),
+        )
 
         if candidated_non_available_resources:
-            priority_resources = await driver.coordinate_resources(
-                self, job_id, *candidated_non_available_resources
+            driver.request_seize(
+                self,
+                job_id,
+                candidated_non_available_resources,
+                lambda resources: self.__update_cache("seize_cache", job_id, resources),
+                priority,
             )
-            if priority_resources:
-                self.__update_cache("seize_cache", job_id, priority_resources)
 
     async def default_framework_disconnect(self, resource):
         """
         Default framework should realize this to let FC control the disconnect
+        Concurrent disconnects are handled together in one batch
         """
 
-        device_info = await self.__get_device_info(resource, clear=True)
-        if not device_info or device_info["current_job"]:
-            return False, False
+        future = self.__pending_disconnects.get(resource)
+        if not future:
+            future = asyncio.get_event_loop().create_future()
+            self.__pending_disconnects[resource] = future
 
-        if device_info["health"] == "Maintenance":
-            self.logger.info("%s default in maintenance.", resource)
-            return True, False
+        if not self.__disconnect_flusher:
+            self.__disconnect_flusher = asyncio.create_task(self.__flush_disconnects())
 
-        if device_info["health"] == "Retired":
-            self.logger.info("%s default in retired.", resource)
-            return False, False
+        return await asyncio.shield(future)
 
-        # ask default framework disconnect this resource
-        self.logger.info("Disconnect %s from default framework", resource)
-        desc = await self.__get_device_description(resource)
-        if not await self.lava_maintenance_devices(
-            resource, desc=f"{self.device_description_prefix}{desc}"
-        ):
-            return False, False
+    async def __flush_disconnects(self):
+        # let all concurrent callers join current batch
+        await asyncio.sleep(0)
+
+        pending_disconnects = self.__pending_disconnects
+        self.__pending_disconnects = {}
+        self.__disconnect_flusher = None
+
+        try:
+            results = await self.__disconnect_resources(list(pending_disconnects))
+        except Exception as error:  # pylint: disable=broad-except
+            for future in pending_disconnects.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
 
-        device_info = await self.__get_device_info(resource, clear=True)
-        if not device_info or device_info["current_job"]:
-            return False, True
+        for resource, result in results.items():
+            if not pending_disconnects[resource].done():
+                pending_disconnects[resource].set_result(result)
 
-        return True, True
+    async def __disconnect_resources(self, resources):
+        """
+        Disconnect resources from lava with one devices list before and after,
+        the maintenance updates are coalesced to one bulk update
+        """
+
+        results = {}
+        devices = {device["hostname"]: device for device in await self.__get_devices()}
+
+        disconnect_resources = []
+        for resource in resources:
+            device = devices.get(resource)
+            if not device or device["current_job"]:
+                results[resource] = (False, False)
+            elif device["health"] == "Maintenance":
+                self.logger.info("%s default in maintenance.", resource)
+                results[resource] = (True, False)
+            elif device["health"] == "Retired":
+                self.logger.info("%s default in retired.", resource)
+                results[resource] = (False, False)
+            else:
+                disconnect_resources.append(resource)
+
+        if not disconnect_resources:
+            return results
+
+        # ask default framework disconnect these resources
+        for resource in disconnect_resources:
+            self.logger.info("Disconnect %s from default framework", resource)
+
+        descs = await asyncio.gather(
+            *[
+                self.__get_device_description(resource)
+                for resource in disconnect_resources
+            ]
+        )
+        maintenance_results = await asyncio.gather(
+            *[
+                self.lava_maintenance_devices(
+                    resource, desc=f"{self.device_description_prefix}{desc}"
+                )
+                for resource, desc in zip(disconnect_resources, descs)
+            ]
+        )
+
+        devices = {device["hostname"]: device for device in await self.__get_devices()}
+        for resource, maintenance_result in zip(
+            disconnect_resources, maintenance_results
+        ):
+            device = devices.get(resource)
+            if not maintenance_result:
+                results[resource] = (False, False)
+            elif not device or device["current_job"]:
+                results[resource] = (False, True)
+            else:
+                results[resource] = (True, True)
+
+        return results
 
     async def default_framework_connect(self, resource):
         """
@@ -219,9 +566,34 @@ class Plugin(FCPlugin, Lava):
         # ask default framework connect this resource
         self.logger.info("Connect %s to default framework", resource)
         desc = await self.__get_device_description(resource)
-        return await self.lava_online_devices(
+        connect_success = await self.lava_online_devices(
             resource, desc=desc.split(self.device_description_prefix)[-1]
         )
+        self.device_info_cache.invalidate(resource)
+        return connect_success
+
+    def __update_device_type_states(self, managed_resources_category):
+        """
+        Record resources of every device type, return device types changed
+        since last tick
+        """
+
+        device_type_states = {}
+        for category_key, category in managed_resources_category.items():
+            for device_type, resources in category.items():
+                device_type_states.setdefault(device_type, {})[category_key] = tuple(
+                    resources
+                )
+
+        changed_device_types = {
+            device_type
+            for device_type in device_type_states.keys()
+            | self.__device_type_states.keys()
+            if device_type_states.get(device_type)
+            != self.__device_type_states.get(device_type)
+        }
+        self.__device_type_states = device_type_states
+        return changed_device_types
 
     async def schedule(
         self, driver
@@ -232,6 +604,13 @@ class Plugin(FCPlugin, Lava):
         Coodinator will call this function periodly
         """
 
+        # this pass covers events so far, delayed event request not needed
+        self.__schedule_start = time.monotonic()
+        if self.__event_schedule:
+            self.__event_schedule.cancel()
+            self.__event_schedule = None
+        event_device_types = set(self.__event_device_types)
+
         async def schedule_prepare():
             # retire managed resources
             devices_assemble = [device["hostname"] for device in devices]
@@ -240,24 +619,25 @@ class Plugin(FCPlugin, Lava):
             )
 
             for retired_managed_resource in retired_managed_resources:
-                if (
-                    driver.managed_resources_status[retired_managed_resource]
-                    != "retired"
+                if not driver.resource_states.is_state(
+                    retired_managed_resource, ResourceStateTable.RETIRED
                 ):
                     driver.retire_resource(retired_managed_resource)
 
-            for managed_resource in driver.managed_resources:
-                if (
-                    driver.managed_resources_status[managed_resource] == "retired"
-                    and managed_resource in devices_assemble
-                ):
+            devices_assemble = set(devices_assemble)
+            for managed_resource in driver.resource_states.members(
+                ResourceStateTable.RETIRED
+            ):
+                if managed_resource in devices_assemble:
                     driver.reset_resource(managed_resource)
 
             # category managed resources
-            for device in devices:
-                if device["hostname"] in driver.managed_resources and device[
-                    "health"
-                ] in (
+            candidated_devices = [
+                device
+                for device in devices
+                if device["hostname"] in driver.managed_resources
+                and device["health"]
+                in (
                     ("Maintenance", "Unknown", "Good", "Bad")
                     if not driver.is_default_framework(self)
                     else (
@@ -265,47 +645,131 @@ class Plugin(FCPlugin, Lava):
                         if driver.managed_disconnect_resource(device["hostname"])
                         else ("Unknown", "Good")
                     )
-                ):
-                    if not driver.is_default_framework(self):
-                        # yield resource which should assure in maintenance mode
-                        if device["health"] in (
-                            "Unknown",
-                            "Good",
-                            "Bad",
-                        ) and await driver.is_resource_available(
-                            self, device["hostname"]
-                        ):
-                            yield device["hostname"]
-
-                    # guard behavior: in case there are some unexpected manual online & jobs there
-                    if device["current_job"] and await driver.is_resource_available(
-                        self, device["hostname"]
+                )
+            ]
+
+            # availability evaluated once per device in this pass
+            available = await driver.availability_snapshot(
+                self, [device["hostname"] for device in candidated_devices]
+            )
+
+            for device in candidated_devices:
+                if not driver.is_default_framework(self):
+                    # yield resource which should assure in maintenance mode
+                    if (
+                        device["health"] in ("Unknown", "Good", "Bad")
+                        and available[device["hostname"]]
                     ):
-                        driver.accept_resource(device["hostname"], self)
-                        asyncio.create_task(
-                            self.__reset_possible_resource(
-                                driver, *(device["hostname"],)
-                            )
-                        )
+                        yield device["hostname"]
+
+                # guard behavior: in case there are some unexpected manual online & jobs there
+                if device["current_job"] and available[device["hostname"]]:
+                    if driver.claim_resource(device["hostname"], self):
+                        self.__lend_resources(driver, device["hostname"])
+                    available[device["hostname"]] = False
+
+                # category devices by devicetypes as LAVA schedule based on devicetypes
+                if available[device["hostname"]]:
+                    category_key = "available"
+                elif driver.is_resource_non_available(device["hostname"]):
+                    category_key = "non-available"
+
+                if device["type"] in managed_resources_category[category_key]:
+                    managed_resources_category[category_key][device["type"]].append(
+                        device["hostname"]
+                    )
+                else:
+                    managed_resources_category[category_key][device["type"]] = [
+                        device["hostname"]
+                    ]
+
+        async def schedule_jobs(queued_jobs):
+            possible_resources = []
+            served_jobs = set()  # jobs found resources or requested seize
 
-                    # category devices by devicetypes as LAVA schedule based on devicetypes
-                    if await driver.is_resource_available(self, device["hostname"]):
-                        category_key = "available"
-                    elif driver.is_resource_non_available(device["hostname"]):
-                        category_key = "non-available"
+            # get tags for queued jobs
+            job_tags_list = await asyncio.gather(
+                *[
+                    self.__get_job_tags(queued_job["id"])
+                    for queued_job in queued_jobs
+                    if queued_job["id"] not in self.job_tags_cache
+                ]
+            )
+            job_tags_list = filter(lambda _: isinstance(_, tuple), job_tags_list)
+            self.job_tags_cache.update(dict(job_tags_list))
+
+            # get devices suitable for queued jobs, older jobs seize first
+            for position, queued_job in enumerate(queued_jobs):
+                job_id = queued_job["id"]
+
+                # delay issue job to next scheduling slot
+                if job_id not in self.job_tags_cache:
+                    self.logger.warning(
+                        "Job %s delayed to next scheduling slot", job_id
+                    )
+                    continue
+
+                if job_id not in self.scheduler_cache:
+                    self.scheduler_cache[job_id] = []
+
+                candidated_available_bitmap = available_bitmaps.get(
+                    queued_job["requested_device_type"], 0
+                ) & ~self.tag_index.bitmap(self.scheduler_cache[job_id])
+
+                candidated_available_resources = self.tag_index.devices(
+                    self.tag_index.match(
+                        queued_job["requested_device_type"],
+                        self.job_tags_cache[job_id],
+                        candidated_available_bitmap,
+                    )
+                )
+                for device in candidated_available_resources:
+                    if driver.is_seized_resource(self, device):
+                        driver.clear_seized_job_records(device)
 
-                    if device["type"] in managed_resources_category[category_key]:
-                        managed_resources_category[category_key][device["type"]].append(
-                            device["hostname"]
+                self.__update_cache(
+                    "scheduler_cache",
+                    job_id,
+                    self.tag_index.devices(candidated_available_bitmap),
+                )
+                possible_resources += candidated_available_resources
+                if candidated_available_resources:
+                    served_jobs.add(job_id)
+
+                # pylint: disable=cell-var-from-loop
+                @check_priority_scheduler(driver)
+                @check_seize_strategy(driver, self)
+                @safe_cache
+                def lava_seize_resource(*_):
+                    candidated_non_available_devices = [
+                        non_available_device
+                        for non_available_device in managed_resources_category[
+                            "non-available"
+                        ].get(queued_job["requested_device_type"], [])
+                        if non_available_device not in self.seize_cache[job_id]
+                    ]
+
+                    if (
+                        not candidated_available_resources
+                        and not driver.is_seized_job(job_id)
+                        and candidated_non_available_devices
+                    ):
+                        # no available resource found, try to seize from other framework
+                        self.__seize_resource(
+                            driver,
+                            queued_job,
+                            candidated_non_available_devices,
+                            -position,
                         )
-                    else:
-                        managed_resources_category[category_key][device["type"]] = [
-                            device["hostname"]
-                        ]
+                        served_jobs.add(job_id)
+
+                lava_seize_resource(self, "seize_cache", job_id)
+
+            return possible_resources, served_jobs
 
         # category devices
         managed_resources_category = {"available": {}, "non-available": {}}
-        devices = await self.lava_get_devices()
+        devices = await self.__get_devices()
 
         if not devices:
             self.logger.warning(
@@ -319,112 +783,122 @@ class Plugin(FCPlugin, Lava):
         else:
             await self.lava_maintenance_devices(schedule_prepare())
 
-        # query job queue
-        possible_resources = []
-        queued_jobs = await self.lava_get_queued_jobs()
-
-        # clean cache to save memory
-        queued_jobs_ids = [queued_job["id"] for queued_job in queued_jobs]
-        for job_id in list(self.job_tags_cache.keys()):
-            if job_id not in queued_jobs_ids:
-                del self.job_tags_cache[job_id]
+        managed_devices = [
+            device
+            for device in devices
+            if device["hostname"] in driver.managed_resources
+        ]
+        self.__managed_devices = {
+            device["hostname"]: device["type"] for device in managed_devices
+        }
+
+        # index tags of managed devices, then match jobs with bitmaps of the index
+        await self.__index_device_tags(managed_devices)
+        available_bitmaps = {
+            device_type: self.tag_index.bitmap(available_devices)
+            for device_type, available_devices in managed_resources_category[
+                "available"
+            ].items()
+        }
+
+        # query job queue, an incomplete queue would make the missing jobs depart
+        queued_jobs = []
+        new_jobs = set()
+        self.job_queue.begin()
+        try:
+            async for queued_jobs_page in self.lava_get_queued_job_pages():
+                new_jobs.update(
+                    queued_job["id"]
+                    for queued_job in self.job_queue.update(queued_jobs_page)
+                )
+                queued_jobs += queued_jobs_page
+        except LavaQueueError as error:
+            self.logger.warning("%s, delay to next scheduling slot", error)
+            return
+        departed_jobs = self.job_queue.commit()
 
-        # get tags for queued jobs
-        job_tags_list = await asyncio.gather(
-            *[
-                self.__get_job_tags(queued_job["id"])
+        # jobs of unchanged device types would match as last tick, skip them
+        # except in a periodic full pass which also retries the seizes,
+        # device types of events since last pass are matched as changed
+        changed_device_types = self.__update_device_type_states(
+            managed_resources_category
+        )
+        changed_device_types |= event_device_types
+        self.__event_device_types -= event_device_types
+        if self.__schedule_ticks % self.full_schedule_ticks:
+            queued_jobs = [
+                queued_job
                 for queued_job in queued_jobs
-                if queued_job["id"] not in self.job_tags_cache
+                if queued_job["id"] in new_jobs
+                or queued_job["id"] not in self.job_tags_cache
+                or queued_job["requested_device_type"] in changed_device_types
             ]
-        )
-        job_tags_list = filter(lambda _: isinstance(_, tuple), job_tags_list)
-        self.job_tags_cache.update(dict(job_tags_list))
+        self.__schedule_ticks += 1
 
-        # get devices suitable for queued jobs
+        # match oldest jobs first
         queued_jobs.reverse()
-        for queued_job in queued_jobs:
-            job_id = queued_job["id"]
-
-            # delay issue job to next scheduling slot
-            if job_id not in self.job_tags_cache:
-                self.logger.warning("Job %s delayed to next scheduling slot", job_id)
-                continue
-
-            candidated_available_devices = managed_resources_category["available"].get(
-                queued_job["requested_device_type"], []
+        possible_resources, served_jobs = await schedule_jobs(queued_jobs)
+
+        if new_jobs or departed_jobs:
+            self.logger.info(
+                "Lava queue: %d jobs, %d new, %d departed",
+                len(self.job_queue),
+                len(new_jobs),
+                len(departed_jobs),
             )
 
-            candidated_available_resources = []
-
-            if job_id not in self.scheduler_cache:
-                self.scheduler_cache[job_id] = []
-
-            available_device_tags_list = await asyncio.gather(
-                *[
-                    self.__get_device_tags(candidated_available_device)
-                    for candidated_available_device in candidated_available_devices
-                    if candidated_available_device not in self.scheduler_cache[job_id]
-                ]
-            )
-            available_device_tags_list = filter(
-                lambda _: isinstance(_, tuple), available_device_tags_list
+        # clean cache of departed jobs to save memory
+        for job_id in departed_jobs:
+            self.job_tags_cache.pop(job_id, None)
+            self.scheduler_cache.pop(job_id, None)
+            self.seize_cache.pop(job_id, None)
+
+        # adapt polling to new demand fc could serve, unless driven by events,
+        # a standing backlog no device could take won't keep polling tight
+        if not (self.event_stream and self.event_stream.connected):
+            managed_device_types = set(self.__managed_devices.values())
+            self.adapt_schedule_interval(
+                len(
+                    served_jobs
+                    | {
+                        job_id
+                        for job_id in new_jobs
+                        if self.job_queue.jobs[job_id]["requested_device_type"]
+                        in managed_device_types
+                    }
+                ),
+                "new or served jobs",
             )
-            available_device_tags_dict = dict(available_device_tags_list)
 
-            for device, tags in available_device_tags_dict.items():
-                if set(self.job_tags_cache[job_id]).issubset(tags):
-                    candidated_available_resources.append(device)
-
-                    if driver.is_seized_resource(self, device):
-                        driver.clear_seized_job_records(device)
-
-            self.__update_cache(
-                "scheduler_cache", job_id, list(available_device_tags_dict.keys())
-            )
-            possible_resources += candidated_available_resources
-
-            # pylint: disable=cell-var-from-loop
-            @check_priority_scheduler(driver)
-            @check_seize_strategy(driver, self)
-            @safe_cache
-            def lava_seize_resource(*_):
-                candidated_non_available_devices = [
-                    non_available_device
-                    for non_available_device in managed_resources_category[
-                        "non-available"
-                    ].get(queued_job["requested_device_type"], [])
-                    if non_available_device not in self.seize_cache[job_id]
-                ]
-
-                if (
-                    not candidated_available_resources
-                    and not driver.is_seized_job(job_id)
-                    and candidated_non_available_devices
-                ):
-                    # no available resource found, try to seize from other framework
-                    asyncio.create_task(
-                        self.__seize_resource(
-                            driver, job_id, candidated_non_available_devices
-                        )
-                    )
-
-            lava_seize_resource(self, "seize_cache", job_id)
-
-        possible_resources = set(possible_resources)
+        # other frameworks may take resources while this pass awaits lava
+        possible_resources = {
+            possible_resource
+            for possible_resource in set(possible_resources)
+            if driver.claim_resource(possible_resource, self)
+        }
 
         # let lava dispatch
         if possible_resources:
-            for possible_resource in possible_resources:
-                driver.accept_resource(possible_resource, self)
-
             if not driver.is_default_framework(self):
                 self.logger.info("Online devices to schedule lava jobs.")
                 await self.lava_online_devices(*possible_resources)
 
             # cleanup
-            asyncio.create_task(
-                self.__reset_possible_resource(driver, *possible_resources)
-            )
+            self.__lend_resources(driver, *possible_resources)
+
+    async def shutdown(self):
+        if self.__event_schedule:
+            self.__event_schedule.cancel()
+            self.__event_schedule = None
+
+        if self.__event_task:
+            self.__event_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.__event_task
+            self.__event_task = None
+
+        if self.lava_rpc:
+            await self.lava_rpc.close()
 
     async def init(self, driver):
         """
@@ -432,12 +906,18 @@ class Plugin(FCPlugin, Lava):
         Called only once when coordinator start
         """
 
+        if self.event_stream:
+            self.__event_task = asyncio.create_task(self.event_stream.run())
+
         if driver.is_default_framework(self):
             return []
 
+        # devices lava owns before restart are expected to be online
+        owner = driver.resource_states.owner_code(self.__module__.rsplit(".", 1)[-1])
         return [
             self.lava_maintenance_devices(device["hostname"])
-            for device in await self.lava_get_devices()
+            for device in await self.__get_devices()
             if device["hostname"] in driver.managed_resources
             and device["health"] in ("Unknown", "Good", "Bad")
+            and not driver.resource_states.is_state(device["hostname"], owner)
         ]
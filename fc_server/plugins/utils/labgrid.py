@@ -5,13 +5,36 @@
 # SPDX-License-Identifier: MIT
 
 
+import asyncio
 import logging
 import traceback
-
-import yaml
+from datetime import datetime
+from functools import wraps
 
 from fc_common import which
+from fc_common.decoder import DecodeError, Decoder
 from fc_server.core import AsyncRunMixin
+from fc_server.core.cache import TTLCache
+from fc_server.core.config import Config
+from fc_server.plugins.utils.labgrid_session import LabgridSession, LabgridSessionError
+
+# labgrid ReservationState values, in case coordinator reports state by value
+LABGRID_RESERVATION_STATES = ("waiting", "allocated", "acquired", "expired", "invalid")
+
+
+def changes_places(func):
+    """
+    Drop place snapshot once fc changed any place
+    """
+
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        try:
+            return await func(self, *args, **kwargs)
+        finally:
+            self.labgrid_place_snapshot.invalidate("places")
+
+    return wrapper
 
 
 class Labgrid(AsyncRunMixin):
@@ -22,43 +45,258 @@ class Labgrid(AsyncRunMixin):
     def __init__(self):
         self.logger = logging.getLogger("fc_server")
 
+        # labgrid-client: fork labgrid-client for every call,
+        # native: in-process calls on one long lived coordinator session
+        labgrid_config = Config.frameworks_config.get("labgrid", {})
+        self.labgrid_backend = labgrid_config.get("backend", "labgrid-client")
+        self.labgrid_session = None
+        if self.labgrid_backend == "native":
+            self.labgrid_session = LabgridSession(labgrid_config["lg_crossbar"])
+
+        # place -> {name, owner, reservation, comment, tags}, shared by all
+        # place queries, dropped once fc changes any place
+        self.labgrid_place_snapshot = TTLCache(
+            labgrid_config.get("place_snapshot_ttl", 2)
+        )
+
+    async def __labgrid_call(self, procedure, *args, **kwargs):
+        return await self.labgrid_session.call(
+            f"org.labgrid.coordinator.{procedure}", *args, **kwargs
+        )
+
+    async def __labgrid_places(self):
+        try:
+            return await self.__labgrid_call("get_places") or {}
+        except LabgridSessionError:
+            self.logger.error(traceback.format_exc())
+            return {}
+
+    @staticmethod
+    def __labgrid_reservation(token, config):
+        # same shape as `labgrid-client reservations` output
+        state = config.get("state")
+        if isinstance(state, int):
+            state = LABGRID_RESERVATION_STATES[state]
+
+        reservation = {"owner": config.get("owner"), "token": token, "state": state}
+        reservation["prio"] = config.get("prio", 0.0)
+        reservation["filters"] = {
+            group: " ".join(f"{k}={v}" for k, v in spec.items())
+            for group, spec in (config.get("filters") or {}).items()
+        }
+        if config.get("allocations"):
+            reservation["allocations"] = {
+                group: ", ".join(places)
+                for group, places in config["allocations"].items()
+            }
+        for key in ("created", "timeout"):
+            if isinstance(config.get(key), (int, float)):
+                reservation[key] = str(datetime.fromtimestamp(config[key]))
+        return reservation
+
+    async def __labgrid_wait_reservation(self, token):
+        while True:
+            config = await self.__labgrid_call("poll_reservation", token)
+            if not config:
+                return 1, "", "reservation not found\n"
+            state = self.__labgrid_reservation(token, config)["state"]
+            if state in ("allocated", "acquired"):
+                return 0, "", ""
+            if state != "waiting":
+                return 1, "", f"reservation in unexpected state {state}\n"
+            await asyncio.sleep(1.0)
+
+    async def __labgrid_native_reserve(self, place, priority, wait, shell):
+        kwargs = {"prio": float(priority)} if priority else {}
+        result = await self.__labgrid_call(
+            "create_reservation", f"name={place}", **kwargs
+        )
+        if not result:
+            return 1, "", f"failed to create reservation for {place}\n"
+
+        ((token, config),) = result.items()
+        if shell:
+            output = f"export LG_TOKEN={token}\n"
+        else:
+            output = f"Reservation '{token}':\n"
+            for key, value in self.__labgrid_reservation(token, config).items():
+                output += f"  {key}: {value}\n"
+
+        if wait:
+            ret, _, err = await self.__labgrid_wait_reservation(token)
+            return ret, output, err
+        return 0, output, ""
+
+    @staticmethod
+    def __parse_places(text):
+        # `labgrid-client -v p` prints every place as `Place 'name':`
+        # followed by its fields indented by two spaces
+        places = {}
+        place = {}  # place being parsed, empty before first place
+        for line in text.splitlines():
+            if line.startswith("Place '"):
+                place = {
+                    "name": line.split("'")[1],
+                    "owner": None,
+                    "reservation": None,
+                    "comment": "",
+                    "tags": {},
+                }
+                places[place["name"]] = place
+            elif place and line.startswith("  ") and not line.startswith("   "):
+                key, _, value = line.strip().partition(": ")
+                if key == "acquired":
+                    place["owner"] = None if value == "None" else value
+                elif key in ("reservation", "comment"):
+                    place[key] = value
+                elif key == "tags":
+                    place["tags"] = dict(
+                        tag.split("=", 1) for tag in value.split(", ") if "=" in tag
+                    )
+        return places
+
+    @staticmethod
+    def __labgrid_place(name, config):
+        return {
+            "name": name,
+            "owner": config.get("acquired"),
+            "reservation": config.get("reservation"),
+            "comment": config.get("comment") or "",
+            "tags": config.get("tags") or {},
+        }
+
+    async def __labgrid_load_places(self, _):
+        if self.labgrid_session:
+            try:
+                places = await self.__labgrid_call("get_places")
+            except LabgridSessionError:
+                self.logger.error(traceback.format_exc())
+                return None
+            return {
+                name: self.__labgrid_place(name, config)
+                for name, config in (places or {}).items()
+            }
+
+        ret, text, _ = await self._run_cmd("labgrid-client -v p")
+        if ret != 0:
+            return None
+        return self.__parse_places(text)
+
+    async def labgrid_get_place_snapshot(self):
+        """
+        Return {place: {name, owner, reservation, comment, tags}}, refreshed
+        at most once per `place_snapshot_ttl`, concurrent refreshes coalesced
+        """
+
+        return (
+            await self.labgrid_place_snapshot.get_or_load(
+                "places", self.__labgrid_load_places
+            )
+            or {}
+        )
+
+    async def labgrid_watch_places(self, on_change):
+        """
+        Follow place changes pushed by coordinator to keep place snapshot
+        current, on_change(name, place) is called for every changed place,
+        place is None once removed. Only native backend could be watched.
+        """
+
+        if not self.labgrid_session:
+            return False
+
+        def place_changed(name, config=None):
+            place = self.__labgrid_place(name, config) if config else None
+            snapshot = self.labgrid_place_snapshot.get("places")
+            if snapshot is not None:
+                if place:
+                    snapshot[name] = place
+                else:
+                    snapshot.pop(name, None)
+            on_change(name, place)
+
+        def connection_changed(_):
+            # changes possibly missed while disconnected
+            self.labgrid_place_snapshot.invalidate("places")
+
+        self.labgrid_session.on_connection = connection_changed
+        try:
+            await self.labgrid_session.subscribe(
+                "org.labgrid.coordinator.place_changed", place_changed
+            )
+        except LabgridSessionError:
+            # subscribed once the session reconnects
+            self.logger.error(traceback.format_exc())
+        return True
+
     async def labgrid_get_places(self):
-        cmd = "labgrid-client -v p"
-        _, places, _ = await self._run_cmd(cmd)
-        place_line = places.splitlines()
-        return [line.split("'")[1] for line in place_line if line.find("Place") >= 0]
+        return list(await self.labgrid_get_place_snapshot())
 
     async def labgrid_get_comments(self):
-        comments = {}
-        cmd = "labgrid-client -v p"
-        _, places, _ = await self._run_cmd(cmd)
-        place_line = places.splitlines()
-        try_to_parse_comment = False
-        for line in place_line:
-            if line.find("Place") >= 0:
-                place = line.split("'")[1]
-                try_to_parse_comment = True
-                continue
-            if try_to_parse_comment:
-                if line.find("comment: ") > 0:
-                    comments[place] = line.split("comment: ")[1]
-                try_to_parse_comment = False
-        return comments
+        return {
+            name: place["comment"]
+            for name, place in (await self.labgrid_get_place_snapshot()).items()
+            if place["comment"]
+        }
 
     async def labgrid_get_reservations(self):
+        if self.labgrid_session:
+            try:
+                reservations = await self.__labgrid_call("get_reservations")
+            except LabgridSessionError:
+                self.logger.error(traceback.format_exc())
+                return None
+            return {
+                f"Reservation '{token}'": self.__labgrid_reservation(token, config)
+                for token, config in sorted(
+                    (reservations or {}).items(),
+                    key=lambda item: (
+                        -item[1].get("prio", 0.0),
+                        item[1].get("created") or 0,
+                    ),
+                )
+            }
+
         cmd = "labgrid-client reservations"
         _, reservations_text, _ = await self._run_cmd(cmd)
         try:  # pylint: disable=too-many-nested-blocks
-            reservations = yaml.load(reservations_text, Loader=yaml.FullLoader)
-        except yaml.YAMLError:
+            reservations = Decoder.from_yaml(reservations_text, "labgrid.reservations")
+        except DecodeError:
             self.logger.error(traceback.format_exc())
             return
 
         return reservations
 
+    @changes_places
     async def labgrid_create_reservation(
         self, place, priority=None, wait=False, shell=False, timeout=None
     ):
+        if self.labgrid_session:
+            try:
+                ret_cmd = await asyncio.wait_for(
+                    self.__labgrid_native_reserve(place, priority, wait, shell),
+                    timeout,
+                )
+            except asyncio.TimeoutError:
+                # same as the return code of `timeout` command
+                ret_cmd = 124, "", ""
+            except LabgridSessionError as error:
+                ret_cmd = 1, "", f"{error}\n"
+        else:
+            ret_cmd = await self.__labgrid_client_reserve(
+                place, priority, wait, shell, timeout
+            )
+
+        if shell and ret_cmd[0] == 0:
+            token_string = ret_cmd[1].split("export LG_TOKEN=")
+            reservation = None
+            if len(token_string) == 2:
+                reservation = token_string[1].strip()
+            return ret_cmd, reservation
+
+        return ret_cmd
+
+    async def __labgrid_client_reserve(self, place, priority, wait, shell, timeout):
         cmd = f"labgrid-client reserve name={place}"
         if timeout:
             cmd = f"timeout {timeout} " + cmd
@@ -68,28 +306,74 @@ class Labgrid(AsyncRunMixin):
             cmd += " --wait"
         if priority:
             cmd += f" --prio {priority}"
-        ret_cmd = await self._run_cmd(cmd)
+        # a blocking wait should not hold a governed command slot
+        return await self._run_cmd(cmd, governed=not wait)
 
-        if shell and ret_cmd[0] == 0:
-            token_string = ret_cmd[1].split("export LG_TOKEN=")
-            reservation = None
-            if len(token_string) == 2:
-                reservation = token_string[1]
-            return ret_cmd, reservation
+    async def labgrid_refresh_reservation(self, token):
+        """
+        Keep a waiting reservation alive, coordinator expires reservations
+        which are not polled for a minute
+        """
 
-        return ret_cmd
+        if self.labgrid_session:
+            try:
+                await self.__labgrid_call("poll_reservation", token)
+            except LabgridSessionError:
+                self.logger.error(traceback.format_exc())
+            return
+
+        # `wait` polls the reservation once, then keeps waiting, stop it early
+        cmd = f"timeout 5 labgrid-client wait {token}"
+        await self._run_cmd(cmd)
 
+    @changes_places
     async def labgrid_cancel_reservation(self, reservation, quiet=False):
+        if self.labgrid_session:
+            try:
+                if not await self.__labgrid_call("cancel_reservation", reservation):
+                    if not quiet:
+                        self.logger.warning("Unable to cancel %s", reservation)
+            except LabgridSessionError:
+                self.logger.error(traceback.format_exc())
+            return
+
         cmd = f"labgrid-client cancel-reservation {reservation}"
         if quiet:
             cmd += " > /dev/null 2>&1"
         await self._run_cmd(cmd)
 
+    @changes_places
     async def labgrid_acquire_place(self, place):
+        if self.labgrid_session:
+            try:
+                if await self.__labgrid_call("acquire_place", place):
+                    return 0, "", ""
+                return 1, "", f"failed to acquire place {place}\n"
+            except LabgridSessionError as error:
+                return 1, "", f"{error}\n"
+
         cmd = f"labgrid-client -p {place} acquire"
         return await self._run_cmd(cmd)
 
+    @changes_places
     async def labgrid_release_place(self, place, force=False, quiet=False):
+        if self.labgrid_session:
+            try:
+                acquired = (
+                    (await self.__labgrid_places()).get(place, {}).get("acquired")
+                )
+                if not acquired or (
+                    acquired != self.labgrid_session.name and not force
+                ):
+                    if not quiet:
+                        self.logger.warning("Unable to release %s", place)
+                elif not await self.__labgrid_call("release_place", place):
+                    if not quiet:
+                        self.logger.warning("Unable to release %s", place)
+            except LabgridSessionError:
+                self.logger.error(traceback.format_exc())
+            return
+
         cmd = f"labgrid-client -p {place} release"
         if force:
             cmd += " -k"
@@ -98,25 +382,9 @@ class Labgrid(AsyncRunMixin):
         await self._run_cmd(cmd)
 
     async def labgrid_get_place_token(self, place):
-        cmd = f"labgrid-client -p {place} show"
-        _, place_info_text, _ = await self._run_cmd(cmd)
-
-        token = ""
-        place_info_lines = place_info_text.splitlines()
-        for line in place_info_lines:
-            if line.find("reservation") >= 0:
-                token = line.split(":")[-1].strip()
-                break
-        return token
+        places = await self.labgrid_get_place_snapshot()
+        return places.get(place, {}).get("reservation") or ""
 
     async def labgrid_get_place_owner(self, place):
-        cmd = f"labgrid-client -p {place} show"
-        _, place_info_text, _ = await self._run_cmd(cmd)
-
-        owner = ""
-        place_info_lines = place_info_text.splitlines()
-        for line in place_info_lines:
-            if line.find("acquired:") >= 0:
-                owner = line.split(":")[-1].strip()
-                break
-        return owner
+        places = await self.labgrid_get_place_snapshot()
+        return places.get(place, {}).get("owner") or ""
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import itertools
+import json
+import logging
+import traceback
+
+import aiohttp
+
+# WAMP message types used by labgrid coordinator clients
+WAMP_HELLO = 1
+WAMP_WELCOME = 2
+WAMP_ABORT = 3
+WAMP_CHALLENGE = 4
+WAMP_AUTHENTICATE = 5
+WAMP_GOODBYE = 6
+WAMP_ERROR = 8
+WAMP_SUBSCRIBE = 32
+WAMP_SUBSCRIBED = 33
+WAMP_EVENT = 36
+WAMP_CALL = 48
+WAMP_RESULT = 50
+
+
+class LabgridSessionError(Exception):
+    pass
+
+
+class LabgridSession:
+    """
+    Native async client of labgrid coordinator, keep one long lived WAMP
+    session on crossbar instead of fork `labgrid-client` for every call
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, url, realm="realm1", name="fc/fc", timeout=30.0):
+        self.url = url
+        self.realm = realm
+        self.name = name  # session name, shown as owner of places & reservations
+        self.timeout = timeout
+        self.on_connection = None  # on_connection(connected)
+
+        self.connections = 0
+        self.logger = logging.getLogger("fc_server")
+
+        self.__http = None
+        self.__websocket = None
+        self.__reader = None
+        self.__lock = None
+        self.__loop = None
+        self.__requests = {}  # request id -> future
+        self.__ids = itertools.count(1)
+        self.__topics = {}  # topic -> handler, subscribed again on reconnect
+        self.__subscriptions = {}  # subscription id -> handler
+        self.__subscribing = {}  # request id -> topic
+
+    @property
+    def connected(self):
+        return bool(self.__websocket and not self.__websocket.closed)
+
+    def __bind_loop(self):
+        # connection is bound to the loop which opened it
+        loop = asyncio.get_event_loop()
+        if self.__loop is not loop:
+            self.__http = None
+            self.__websocket = None
+            self.__reader = None
+            self.__requests = {}
+            self.__subscriptions = {}
+            self.__subscribing = {}
+            self.__lock = asyncio.Lock()
+            self.__loop = loop
+
+    async def __receive(self):
+        message = await self.__websocket.receive(timeout=self.timeout)
+        if message.type != aiohttp.WSMsgType.TEXT:
+            raise LabgridSessionError(f"Connection closed: {message.type!r}")
+        return json.loads(message.data)
+
+    async def __join(self):
+        await self.__websocket.send_json(
+            [
+                WAMP_HELLO,
+                self.realm,
+                {
+                    "roles": {"caller": {}, "subscriber": {}},
+                    "authmethods": ["anonymous", "ticket"],
+                    "authid": f"client/{self.name}",
+                },
+            ]
+        )
+
+        while True:
+            message = await self.__receive()
+            if message[0] == WAMP_WELCOME:
+                return
+            if message[0] == WAMP_CHALLENGE:
+                # labgrid coordinator accepts any ticket
+                await self.__websocket.send_json(
+                    [WAMP_AUTHENTICATE, "dummy-ticket", {}]
+                )
+            elif message[0] == WAMP_ABORT:
+                raise LabgridSessionError(f"Join refused: {message[2]}")
+            else:
+                raise LabgridSessionError(f"Unexpected message: {message}")
+
+    async def __connect(self):
+        self.__bind_loop()
+        async with self.__lock:
+            if self.connected:
+                return
+
+            await self.__disconnect()
+            self.__http = aiohttp.ClientSession()
+            try:
+                self.__websocket = await self.__http.ws_connect(
+                    self.url, protocols=("wamp.2.json",), heartbeat=30
+                )
+                await self.__join()
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                ValueError,
+                IndexError,
+                LabgridSessionError,
+            ) as error:
+                await self.__disconnect()
+                raise LabgridSessionError(f"Unable to connect: {error!r}") from error
+
+            self.connections += 1
+            self.logger.info("Connected labgrid coordinator: %s", self.url)
+            self.__reader = asyncio.create_task(self.__read())
+
+            self.__subscriptions = {}
+            self.__subscribing = {}
+            for topic in self.__topics:
+                await self.__send_subscribe(topic)
+            if self.on_connection:
+                self.on_connection(True)
+
+    async def __send_subscribe(self, topic):
+        request = next(self.__ids)
+        self.__subscribing[request] = topic
+        await self.__websocket.send_json([WAMP_SUBSCRIBE, request, {}, topic])
+
+    def __handle_event(self, handler, args):
+        # failed handler must not end the reader, nor pass as malformed message
+        try:
+            handler(*args)
+        except Exception:  # pylint: disable=broad-except
+            self.logger.error(traceback.format_exc())
+
+    def __dispatch(self, message):
+        if message[0] == WAMP_EVENT:
+            handler = self.__subscriptions.get(message[1])
+            if handler:
+                self.__handle_event(handler, message[4] if len(message) > 4 else [])
+        elif message[0] == WAMP_SUBSCRIBED:
+            topic = self.__subscribing.pop(message[1], None)
+            if topic:
+                self.__subscriptions[message[2]] = self.__topics[topic]
+        elif message[0] == WAMP_ERROR and message[1] == WAMP_SUBSCRIBE:
+            topic = self.__subscribing.pop(message[2], None)
+            self.logger.error("Unable to subscribe %s: %s", topic, message[4])
+        elif message[0] in (WAMP_RESULT, WAMP_ERROR):
+            request = message[1] if message[0] == WAMP_RESULT else message[2]
+            future = self.__requests.get(request)
+            if not future or future.done():
+                return
+            if message[0] == WAMP_RESULT:
+                args = message[3] if len(message) > 3 else []
+                future.set_result(args[0] if args else None)
+            else:
+                future.set_exception(
+                    LabgridSessionError(f"{message[4]}: {message[5:]}")
+                )
+        elif message[0] == WAMP_GOODBYE:
+            asyncio.create_task(
+                self.__websocket.send_json(
+                    [WAMP_GOODBYE, {}, "wamp.close.goodbye_and_out"]
+                )
+            )
+
+    async def __read(self):
+        websocket = self.__websocket
+        try:
+            async for message in websocket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                try:
+                    self.__dispatch(json.loads(message.data))
+                except (ValueError, IndexError, TypeError):
+                    self.logger.warning(
+                        "Drop malformed coordinator message: %s", message.data[:200]
+                    )
+        finally:
+            self.logger.warning("Lost labgrid coordinator: %s", self.url)
+            for future in self.__requests.values():
+                if not future.done():
+                    future.set_exception(LabgridSessionError("Connection lost"))
+            if not websocket.closed:
+                await websocket.close()
+            if self.on_connection:
+                self.on_connection(False)
+
+    async def subscribe(self, topic, handler):
+        """
+        Subscribe coordinator topic, e.g. `org.labgrid.coordinator.place_changed`,
+        handler(*args) is called for every event, also after reconnect
+        """
+
+        self.__topics[topic] = handler
+        if self.connected:
+            await self.__send_subscribe(topic)
+        else:
+            await self.__connect()
+
+    async def call(self, procedure, *args, **kwargs):
+        """
+        Call coordinator procedure, e.g. `org.labgrid.coordinator.get_places`,
+        connect on demand
+        """
+
+        await self.__connect()
+
+        request = next(self.__ids)
+        future = asyncio.get_event_loop().create_future()
+        self.__requests[request] = future
+        try:
+            await self.__websocket.send_json(
+                [WAMP_CALL, request, {}, procedure, list(args), kwargs]
+            )
+            return await asyncio.wait_for(future, self.timeout)
+        except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError) as error:
+            raise LabgridSessionError(f"{procedure} failed: {error!r}") from error
+        finally:
+            self.__requests.pop(request, None)
+
+    async def __disconnect(self):
+        if self.__reader:
+            self.__reader.cancel()
+            self.__reader = None
+        if self.__websocket:
+            await self.__websocket.close()
+            self.__websocket = None
+        if self.__http:
+            await self.__http.close()
+            self.__http = None
+
+    async def close(self):
+        self.__bind_loop()
+        if self.connected:
+            try:
+                await self.__websocket.send_json(
+                    [WAMP_GOODBYE, {}, "wamp.close.normal"]
+                )
+            except (aiohttp.ClientError, ConnectionError):
+                pass
+        await self.__disconnect()
@@ -7,16 +7,17 @@
 # pylint: disable=no-member
 
 import asyncio
+import collections
 import logging
 import traceback
 import types
 
-import yaml
-
 from fc_common import which
+from fc_common.decoder import DecodeError, Decoder
 from fc_server.core import AsyncRunMixin
 from fc_server.core.config import Config
 from fc_server.core.decorators import verify_cmd_results
+from fc_server.plugins.utils.lava_rpc import LavaRpc, LavaRpcError
 
 try:
     from functools import singledispatchmethod
@@ -24,7 +25,14 @@ except ImportError:
     from singledispatchmethod import singledispatchmethod
 
 
+class LavaQueueError(Exception):
+    pass
+
+
 class Lava(AsyncRunMixin):
+    # identities, native rpc client and update coalescing states of one server
+    # pylint: disable=too-many-instance-attributes
+
     @which("lavacli", "Use 'pip3 install lavacli' to install lava client please.")
     def __init__(self):
         self.identities = Config.frameworks_config["lava"]["identities"]
@@ -33,6 +41,146 @@ class Lava(AsyncRunMixin):
 
         self.logger = logging.getLogger("fc_server")
 
+        # lavacli: fork lavacli for every call, native: in-process xmlrpc call
+        self.lava_backend = Config.frameworks_config["lava"].get("backend", "lavacli")
+        self.lava_rpc = None
+        if self.lava_backend == "native":
+            self.lava_rpc = LavaRpc.from_identity(self.identities)
+
+        # native device updates in one window are coalesced to one bulk call,
+        # lavacli has no bulk update so its updates are issued at once
+        self.lava_update_window = (
+            Config.frameworks_config["lava"].get("update_window", 0.2)
+            if self.lava_rpc
+            else 0
+        )
+        self.__pending_updates = {}
+        self.__update_flusher = None
+
+        # queue depth of last full queue fetch, used to size page fetches
+        self.lava_queue_depth = 0
+
+    async def __lava_query(self, cmd, method, *params):
+        """
+        Return decoded response of one query from lavacli json output or native api
+        """
+
+        if self.lava_rpc:
+            try:
+                return await self.lava_rpc.call(method, *params)
+            except LavaRpcError:
+                self.logger.error(traceback.format_exc())
+                return None
+
+        _, text, _ = await self._run_cmd(cmd)
+        try:
+            return Decoder.from_json(text, method)
+        except DecodeError:
+            self.logger.error(traceback.format_exc())
+            return None
+
+    def __lava_update_cmd(self, device, health, desc=None):
+        cmd = f"lavacli -i {self.identities} devices update {device} --health {health}"
+        if desc:
+            cmd += f" --description '{desc}'"
+        return cmd
+
+    async def __lava_update_devices(self, health, devices, desc=None):
+        """
+        Put native device updates into current coalescing window, issue
+        lavacli ones at once, return command like results which could be
+        checked by verify_cmd_results
+        """
+
+        cmd_list = [self.__lava_update_cmd(device, health, desc) for device in devices]
+        if not self.lava_rpc:
+            results = await asyncio.gather(*[self._run_cmd(cmd) for cmd in cmd_list])
+            return results, cmd_list
+
+        loop = asyncio.get_event_loop()
+
+        futures = []
+        for device in devices:
+            # requesters of the same update in one window share its result,
+            # a repeated update moves to the end to still apply last
+            update = (device, health, desc)
+            future = self.__pending_updates.pop(update, None) or loop.create_future()
+            self.__pending_updates[update] = future
+            futures.append(future)
+
+        if self.__pending_updates and not self.__update_flusher:
+            self.__update_flusher = asyncio.create_task(self.__flush_updates())
+            self.__update_flusher.add_done_callback(self.__drop_updates)
+
+        # shield the shared futures from cancellation of one caller
+        results = await asyncio.gather(*[asyncio.shield(future) for future in futures])
+        return results, cmd_list
+
+    async def __flush_updates(self):
+        pending_updates = {}
+        try:
+            await asyncio.sleep(self.lava_update_window)
+
+            pending_updates = self.__pending_updates
+            self.__pending_updates = {}
+            self.__update_flusher = None
+
+            updates = list(pending_updates)
+            self.logger.info("Flush %d device updates", len(updates))
+            try:
+                results = await self.__lava_bulk_update(updates)
+            except Exception as error:  # pylint: disable=broad-except
+                self.logger.error(traceback.format_exc())
+                results = [(1, f"Unable to update device: {error!r}", "")] * len(
+                    updates
+                )
+
+            for future, result in zip(pending_updates.values(), results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            # never leave requesters waiting once the flusher is gone
+            for future in pending_updates.values():
+                if not future.done():
+                    future.cancel()
+
+    def __drop_updates(self, flusher):
+        if self.__update_flusher is not flusher:
+            return
+
+        # flusher cancelled within the window, updates never taken
+        pending_updates = self.__pending_updates
+        self.__pending_updates = {}
+        self.__update_flusher = None
+        for future in pending_updates.values():
+            if not future.done():
+                future.cancel()
+
+    async def __lava_bulk_update(self, updates):
+        """
+        Issue all updates in one multicall, results kept in the same order as updates
+        """
+
+        try:
+            responses = await self.lava_rpc.multicall(
+                [
+                    (
+                        "scheduler.devices.update",
+                        (device, None, None, None, None, health, desc),
+                    )
+                    for device, health, desc in updates
+                ]
+            )
+        except LavaRpcError as error:
+            responses = [error] * len(updates)
+
+        return [
+            (1, f"Unable to call 'devices.update': {response}", "")
+            if isinstance(response, LavaRpcError)
+            else (0, "", "")
+            for response in responses
+        ]
+
     @singledispatchmethod
     async def lava_maintenance_devices(
         self, *devices, desc=None
@@ -42,130 +190,111 @@ class Lava(AsyncRunMixin):
     @lava_maintenance_devices.register(str)
     @verify_cmd_results
     async def _(self, *devices, desc=None):
-        cmd_list = []
         for device in devices:
-            cmd = (
-                f"lavacli -i {self.identities} "
-                f"devices update {device} --health MAINTENANCE"
-            )
-            if desc:
-                cmd += f" --description '{desc}'"
-            self.logger.info(cmd)
-            cmd_list.append(cmd)
-        results = await asyncio.gather(*[self._run_cmd(cmd) for cmd in cmd_list])
-
-        return results, cmd_list
+            self.logger.info("Maintenance %s", device)
+        return await self.__lava_update_devices("MAINTENANCE", devices, desc)
 
     @lava_maintenance_devices.register(types.AsyncGeneratorType)
     @verify_cmd_results
     async def _(self, devices, desc=None):
-        cmd_list = []
+        device_list = []
         async for device in devices:
-            cmd = (
-                f"lavacli -i {self.identities} "
-                f"devices update {device} --health MAINTENANCE"
-            )
-            if desc:
-                cmd += f" --description '{desc}'"
-            self.logger.info(cmd)
-            cmd_list.append(cmd)
-        results = await asyncio.gather(*[self._run_cmd(cmd) for cmd in cmd_list])
-
-        return results, cmd_list
+            self.logger.info("Maintenance %s", device)
+            device_list.append(device)
+        return await self.__lava_update_devices("MAINTENANCE", device_list, desc)
 
     @verify_cmd_results
     async def lava_online_devices(self, *devices, desc=None):
-        cmd_list = []
-        for device in devices:
-            cmd = (
-                f"lavacli -i {self.identities} "
-                f"devices update {device} --health GOOD"
-            )
-            if desc:
-                cmd += f" --description '{desc}'"
-            cmd_list.append(cmd)
-        results = await asyncio.gather(*[self._run_cmd(cmd) for cmd in cmd_list])
-
-        return results, cmd_list
-
-    async def lava_get_queued_jobs(self):
+        return await self.__lava_update_devices("GOOD", devices, desc)
+
+    def __lava_queue_page(self, page, jobs_per_page):
+        start = page * jobs_per_page
+        cmd = (
+            f"lavacli -i {self.identities} jobs queue "
+            f"--start={start} --limit={jobs_per_page} --json"
+        )
+        return asyncio.ensure_future(
+            self.__lava_query(cmd, "scheduler.jobs.queue", None, start, jobs_per_page)
+        )
+
+    async def lava_get_queued_job_pages(self):
         """
-        LAVA limit at most 100 jobs return for api call
+        Yield queued jobs page by page in queue order as soon as one page arrives.
+        LAVA limit at most 100 jobs return for api call, the number of pages
+        fetched in parallel is sized by the queue depth of last full fetch.
+        Raise LavaQueueError if one page failed, as the queue is then incomplete.
         """
 
-        queued_jobs = []
-        seq = 0
-
-        while True:
-            cmd_list = []
-            batch_num = 5
-            jobs_per_batch = 100
-            for cnt in range(batch_num):
-                cmd = (
-                    f"lavacli -i {self.identities} jobs queue "
-                    f"--start={batch_num * jobs_per_batch * seq + cnt * jobs_per_batch} "
-                    f"--limit={jobs_per_batch} --yaml"
-                )
-                cmd_list.append(cmd)
+        jobs_per_page = 100
+        max_pages_in_flight = 5
+        pages_in_flight = min(
+            self.lava_queue_depth // jobs_per_page + 1, max_pages_in_flight
+        )
 
-            queued_jobs_infos = await asyncio.gather(
-                *[self._run_cmd(cmd) for cmd in cmd_list]
-            )
+        pages = collections.deque(
+            self.__lava_queue_page(page, jobs_per_page)
+            for page in range(pages_in_flight)
+        )
+        next_page = pages_in_flight
+        queue_depth = 0
 
-            one_batch_queued_jobs = []
-            for queued_jobs_info in queued_jobs_infos:
-                try:
-                    one_batch_queued_jobs += yaml.load(
-                        queued_jobs_info[1], Loader=yaml.FullLoader
+        try:
+            while pages:
+                queued_jobs = await pages.popleft()
+                if queued_jobs is None:
+                    raise LavaQueueError(
+                        f"Unable to fetch queued jobs from {queue_depth}"
                     )
-                except yaml.YAMLError:
-                    self.logger.error(traceback.format_exc())
+                queue_depth += len(queued_jobs)
+
+                if len(queued_jobs) == jobs_per_page:
+                    # queue continues, widen the pages in flight in case depth grows
+                    pages_in_flight = min(pages_in_flight * 2, max_pages_in_flight)
+                    while len(pages) < pages_in_flight:
+                        pages.append(self.__lava_queue_page(next_page, jobs_per_page))
+                        next_page += 1
+                else:
+                    # tail reached, outstanding pages are useless
+                    for page in pages:
+                        page.cancel()
+                    pages.clear()
+
+                if queued_jobs:
+                    yield queued_jobs
+
+            self.lava_queue_depth = queue_depth
+        finally:
+            for page in pages:
+                page.cancel()
 
-            queued_jobs += one_batch_queued_jobs
-
-            if len(one_batch_queued_jobs) < batch_num * jobs_per_batch:
-                break
-
-            seq += 1
+    async def lava_get_queued_jobs(self):
+        """
+        Yield queued jobs one by one in queue order
+        """
 
-        return queued_jobs
+        async for queued_jobs in self.lava_get_queued_job_pages():
+            for queued_job in queued_jobs:
+                yield queued_job
 
     async def lava_get_job_info(self, job_id):
-        cmd = f"lavacli -i {self.identities} jobs show {job_id} --yaml"
-        _, job_info_text, _ = await self._run_cmd(cmd)
-
-        try:
-            job_info = yaml.load(job_info_text, Loader=yaml.FullLoader)
-        except yaml.YAMLError:
-            self.logger.error(traceback.format_exc())
-            return
-
-        return job_info
+        cmd = f"lavacli -i {self.identities} jobs show {job_id} --json"
+        return await self.__lava_query(cmd, "scheduler.jobs.show", job_id)
 
     async def lava_get_device_info(self, device):
-        cmd = f"lavacli -i {self.identities} devices show {device} --yaml"
-        _, device_info_text, _ = await self._run_cmd(cmd)
-
-        try:
-            device_info = yaml.load(device_info_text, Loader=yaml.FullLoader)
-        except yaml.YAMLError:
-            self.logger.error(traceback.format_exc())
-            return
-
-        return device_info
+        cmd = f"lavacli -i {self.identities} devices show {device} --json"
+        return await self.__lava_query(cmd, "scheduler.devices.show", device)
 
     async def lava_get_devices(self):
-        cmd = f"lavacli -i {self.identities} devices list --yaml"
-        _, devices_text, _ = await self._run_cmd(cmd)
-
-        try:
-            devices = yaml.load(devices_text, Loader=yaml.FullLoader)
-        except yaml.YAMLError:
-            self.logger.error(traceback.format_exc())
-            return []
-
-        return devices
+        cmd = f"lavacli -i {self.identities} devices list --json"
+        return await self.__lava_query(cmd, "scheduler.devices.list") or []
 
     async def lava_cancel_job(self, job_id):
+        if self.lava_rpc:
+            try:
+                await self.lava_rpc.call("scheduler.jobs.cancel", job_id)
+            except LavaRpcError as error:
+                self.logger.error("Unable to cancel job %s: %s", job_id, error)
+            return
+
         cmd = f"lavacli -i {self.identities} jobs cancel {job_id}"
         await self._run_cmd(cmd)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import logging
+import traceback
+
+import aiohttp
+
+from fc_common.decoder import DecodeError, Decoder
+
+
+class LavaEventStream:
+    """
+    Subscriber of lava event notifications published on lava websocket,
+    every message is `[topic, uuid, datetime, username, data]` with data in json
+    """
+
+    def __init__(self, url, on_event, on_connection=None, retry_interval=10):
+        self.url = url
+        self.on_event = on_event  # on_event(kind, data), kind: testjob, device...
+        self.on_connection = on_connection  # on_connection(connected)
+        self.retry_interval = retry_interval
+        self.connected = False
+
+        self.logger = logging.getLogger("fc_server")
+
+    def __set_connected(self, connected):
+        if self.connected != connected:
+            self.connected = connected
+            if self.on_connection:
+                self.on_connection(connected)
+
+    def __dispatch(self, text):
+        try:
+            message = Decoder.from_json(text, "lava.events")
+            topic, data = message[0], message[4]
+            kind = topic.rsplit(".", 1)[-1]
+            if isinstance(data, str):
+                data = Decoder.from_json(data, "lava.events")
+        except (AttributeError, DecodeError, IndexError, KeyError, TypeError):
+            self.logger.warning("Drop malformed lava event: %s", text[:200])
+            return
+
+        # one bad event must not end the subscription
+        try:
+            self.on_event(kind, data or {})
+        except Exception:  # pylint: disable=broad-except
+            self.logger.error(traceback.format_exc())
+
+    async def run(self):
+        """
+        Keep subscribing, reconnect after `retry_interval` seconds on any loss
+        """
+
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(self.url, heartbeat=30) as websocket:
+                        self.logger.info("Subscribed lava events: %s", self.url)
+                        self.__set_connected(True)
+                        async for message in websocket:
+                            if message.type == aiohttp.WSMsgType.TEXT:
+                                self.__dispatch(message.data)
+                            elif message.type == aiohttp.WSMsgType.ERROR:
+                                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                self.logger.warning("Lava events unavailable: %r", error)
+            finally:
+                self.__set_connected(False)
+
+            await asyncio.sleep(self.retry_interval)
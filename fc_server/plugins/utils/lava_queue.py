@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+class LavaJobQueue:
+    """
+    Incremental view of lava job queue kept across schedule ticks
+    Jobs are kept in queue order and indexed by job id, a tick only needs to
+    handle jobs which newly arrive or depart since last tick
+    """
+
+    def __init__(self):
+        self.jobs = {}  # job id -> job, in queue order
+        self.__ticking_jobs = None
+
+    def __contains__(self, job_id):
+        return job_id in self.jobs
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def begin(self):
+        self.__ticking_jobs = {}
+
+    def update(self, queued_jobs):
+        """
+        Record one page of current queue, return jobs new or changed since last tick
+        """
+
+        new_jobs = []
+        for queued_job in queued_jobs:
+            self.__ticking_jobs[queued_job["id"]] = queued_job
+            if self.jobs.get(queued_job["id"]) != queued_job:
+                new_jobs.append(queued_job)
+
+        return new_jobs
+
+    def commit(self):
+        """
+        Finish one tick, return ids of jobs departed from queue since last tick
+        """
+
+        departed_jobs = self.jobs.keys() - self.__ticking_jobs.keys()
+        self.jobs = self.__ticking_jobs
+        self.__ticking_jobs = None
+        return departed_jobs
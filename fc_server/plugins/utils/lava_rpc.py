@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+import asyncio
+import os
+import xmlrpc.client
+
+import aiohttp
+import yaml
+
+
+class LavaRpcError(Exception):
+    pass
+
+
+class LavaRpc:
+    """
+    Native async client for LAVA XML-RPC api, share one pooled http session
+    instead of fork `lavacli` for every call
+    """
+
+    def __init__(
+        self,
+        uri,
+        *,
+        username=None,
+        token=None,
+        timeout=20.0,
+        proxy=None,
+        verify_ssl_cert=True,
+        max_connections=16,
+    ):
+        self.uri = uri
+        self.auth = aiohttp.BasicAuth(username, token) if username and token else None
+        self.timeout = timeout
+        self.proxy = proxy
+        self.verify_ssl_cert = verify_ssl_cert
+        self.max_connections = max_connections
+
+        self.__session = None
+
+    @staticmethod
+    def load_identity(identity):
+        """
+        Load identity from lavacli configuration, same lookup rule as lavacli
+        """
+
+        config_dir = os.environ.get("XDG_CONFIG_HOME", "~/.config")
+        config_file = os.path.expanduser(os.path.join(config_dir, "lavacli.yaml"))
+
+        try:
+            with open(config_file, "r", encoding="utf-8") as config_handle:
+                return yaml.load(config_handle, Loader=yaml.SafeLoader)[identity]
+        except (FileNotFoundError, KeyError, TypeError):
+            return {}
+
+    @classmethod
+    def from_identity(cls, identity, **kwargs):
+        config = cls.load_identity(identity)
+        if not config.get("uri"):
+            raise LavaRpcError(f"Unknown identity '{identity}'")
+
+        return cls(
+            config["uri"],
+            username=config.get("username"),
+            token=config.get("token"),
+            timeout=config.get("timeout", 20.0),
+            proxy=config.get("proxy"),
+            verify_ssl_cert=config.get("verify_ssl_cert", True),
+            **kwargs,
+        )
+
+    def __get_session(self):
+        # session must be created inside the running loop
+        if not self.__session or self.__session.closed:
+            self.__session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    ssl=None if self.verify_ssl_cert else False,
+                ),
+                auth=self.auth,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.__session
+
+    @staticmethod
+    def __plain(value):
+        # keep same output as lavacli which converts xmlrpc datetime to raw string
+        if isinstance(value, xmlrpc.client.DateTime):
+            return value.value
+        if isinstance(value, dict):
+            return {k: LavaRpc.__plain(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [LavaRpc.__plain(v) for v in value]
+        return value
+
+    async def __post(self, body):
+        try:
+            async with self.__get_session().post(
+                self.uri,
+                data=body,
+                headers={"Content-Type": "text/xml"},
+                proxy=self.proxy,
+            ) as response:
+                if response.status != 200:
+                    raise LavaRpcError(
+                        f"{self.uri}: {response.status} {response.reason}"
+                    )
+                payload = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise LavaRpcError(f"Unable to connect: {error!r}") from error
+
+        try:
+            return xmlrpc.client.loads(payload)[0][0]
+        except xmlrpc.client.Fault as fault:
+            raise LavaRpcError(fault.faultString) from fault
+        except Exception as error:  # pylint: disable=broad-except
+            raise LavaRpcError(f"Bad response: {error!r}") from error
+
+    async def call(self, method, *params):
+        body = xmlrpc.client.dumps(params, method, allow_none=True)
+        return LavaRpc.__plain(await self.__post(body))
+
+    async def multicall(self, calls):
+        """
+        Issue a batch of (method, params) in one request via `system.multicall`,
+        return result or LavaRpcError for each call
+        """
+
+        body = xmlrpc.client.dumps(
+            (
+                [
+                    {"methodName": method, "params": list(params)}
+                    for method, params in calls
+                ],
+            ),
+            "system.multicall",
+            allow_none=True,
+        )
+        return [
+            LavaRpcError(result["faultString"])
+            if isinstance(result, dict)
+            else LavaRpc.__plain(result[0])
+            for result in await self.__post(body)
+        ]
+
+    async def close(self):
+        if self.__session:
+            await self.__session.close()
+            self.__session = None
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2024 NXP
+#
+# SPDX-License-Identifier: MIT
+
+
+class LavaTagIndex:
+    """
+    Inverted index from device tag to device bitmap, kept per device type
+    Every indexed device owns one bit, so devices suitable for a job are just
+    the bitwise AND of the bitmaps of all its tags
+    """
+
+    def __init__(self):
+        self.__slots = {}  # hostname -> bit position
+        self.__hostnames = []  # bit position -> hostname
+        self.__free_slots = []
+
+        self.__device_tags = {}  # hostname -> (device type, tags)
+        self.__type_bitmaps = {}  # device type -> bitmap of all its devices
+        self.__tag_bitmaps = {}  # device type -> {tag -> bitmap}
+
+    def __contains__(self, device):
+        return device in self.__slots
+
+    def __len__(self):
+        return len(self.__slots)
+
+    def update(self, device, device_type, tags):
+        """
+        Index device with its latest tags, only touch bitmaps when changed
+        """
+
+        tags = frozenset(tags)
+        if self.__device_tags.get(device) == (device_type, tags):
+            return
+
+        self.remove(device)
+
+        if self.__free_slots:
+            slot = self.__free_slots.pop()
+            self.__hostnames[slot] = device
+        else:
+            slot = len(self.__hostnames)
+            self.__hostnames.append(device)
+        self.__slots[device] = slot
+        self.__device_tags[device] = (device_type, tags)
+
+        bit = 1 << slot
+        self.__type_bitmaps[device_type] = self.__type_bitmaps.get(device_type, 0) | bit
+        tag_bitmaps = self.__tag_bitmaps.setdefault(device_type, {})
+        for tag in tags:
+            tag_bitmaps[tag] = tag_bitmaps.get(tag, 0) | bit
+
+    def remove(self, device):
+        slot = self.__slots.pop(device, None)
+        if slot is None:
+            return
+
+        device_type, tags = self.__device_tags.pop(device)
+        mask = ~(1 << slot)
+        self.__type_bitmaps[device_type] &= mask
+        tag_bitmaps = self.__tag_bitmaps[device_type]
+        for tag in tags:
+            tag_bitmaps[tag] &= mask
+            if not tag_bitmaps[tag]:
+                del tag_bitmaps[tag]
+
+        self.__hostnames[slot] = None
+        self.__free_slots.append(slot)
+
+    def bitmap(self, devices):
+        """
+        Return bitmap of the indexed ones in devices
+        """
+
+        bitmap = 0
+        for device in devices:
+            slot = self.__slots.get(device)
+            if slot is not None:
+                bitmap |= 1 << slot
+        return bitmap
+
+    def devices(self, bitmap):
+        """
+        Return hostnames of the devices in bitmap
+        """
+
+        devices = []
+        while bitmap:
+            lowest = bitmap & -bitmap
+            devices.append(self.__hostnames[lowest.bit_length() - 1])
+            bitmap ^= lowest
+        return devices
+
+    def match(self, device_type, tags, bitmap=None):
+        """
+        Return bitmap of devices of device_type which have all tags,
+        optionally limited to the devices in bitmap
+        """
+
+        matched = self.__type_bitmaps.get(device_type, 0)
+        if bitmap is not None:
+            matched &= bitmap
+
+        tag_bitmaps = self.__tag_bitmaps.get(device_type, {})
+        for tag in tags:
+            if not matched:
+                break
+            matched &= tag_bitmaps.get(tag, 0)
+        return matched
@@ -6,10 +6,17 @@
 
 
 import asyncio
+import copy
+import json
 import os
 import sys
+import uuid
+from xmlrpc.server import SimpleXMLRPCDispatcher
 
 import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
 
 cfg_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "config"))
 os.environ["FC_SERVER_CFG_PATH"] = cfg_path
@@ -46,3 +53,333 @@ def asyncio_patch():
         return mocker.patch(target, return_value=future)
 
     return _asyncio_patch
+
+
+class LavaStandin:
+    """
+    Local stand-in of lava server xmlrpc api and event publisher websocket
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, device_num=0, job_num=0):
+        self.devices = {
+            f"docker-{i:04d}": {
+                "hostname": f"docker-{i:04d}",
+                "type": "docker",
+                "health": "Maintenance",
+                "state": "Idle",
+                "current_job": None,
+                "pipeline": True,
+                "description": "Created automatically by LAVA.",
+                "tags": [],
+            }
+            for i in range(device_num)
+        }
+        self.jobs = [
+            {
+                "id": i,
+                "description": "foo",
+                "requested_device_type": "docker",
+                "submitter": "bar",
+            }
+            for i in range(job_num)
+        ]
+        self.calls = []
+        self.requests = 0
+        self.subscribers = []
+        self.failing_pages = set()  # queue pages which raise fault
+
+        self.dispatcher = SimpleXMLRPCDispatcher(allow_none=True, encoding=None)
+        self.dispatcher.register_multicall_functions()
+        for name, func in {
+            "system.version": lambda: "2023.10",
+            "scheduler.devices.list": self.devices_list,
+            "scheduler.devices.show": self.devices_show,
+            "scheduler.devices.update": self.devices_update,
+            "scheduler.jobs.queue": self.jobs_queue,
+            "scheduler.jobs.show": self.jobs_show,
+            "scheduler.jobs.cancel": self.jobs_cancel,
+        }.items():
+            self.dispatcher.register_function(func, name)
+
+        self.server = None
+
+    def devices_list(self, show_all=False):  # pylint: disable=unused-argument
+        self.calls.append("devices.list")
+        return [
+            {k: v for k, v in device.items() if k not in ("description", "tags")}
+            for device in self.devices.values()
+        ]
+
+    def devices_show(self, hostname):
+        self.calls.append("devices.show")
+        device = self.devices[hostname]
+        return {**device, "device_type": device["type"]}
+
+    def devices_update(
+        self, hostname, worker, user, group, public, health, description
+    ):  # pylint: disable=unused-argument, too-many-arguments, too-many-positional-arguments
+        self.calls.append("devices.update")
+        if hostname not in self.devices:
+            raise ValueError(f"Unable to find device '{hostname}'")
+        if health:
+            self.devices[hostname]["health"] = health.capitalize()
+        if description is not None:
+            self.devices[hostname]["description"] = description
+
+    def jobs_queue(self, device_types=None, start=0, limit=100):
+        # pylint: disable=unused-argument
+        self.calls.append("jobs.queue")
+        if start // limit in self.failing_pages:
+            raise ValueError("Unable to query queue")
+        return self.jobs[start : start + limit]
+
+    def jobs_show(self, job_id):
+        self.calls.append("jobs.show")
+        return {"id": job_id, "tags": [], "state": "Submitted"}
+
+    def jobs_cancel(self, job_id):
+        self.calls.append("jobs.cancel")
+        self.jobs = [job for job in self.jobs if str(job["id"]) != str(job_id)]
+
+    async def rpc(self, request):
+        self.requests += 1
+        body = await request.read()
+        return web.Response(
+            body=self.dispatcher._marshaled_dispatch(  # pylint: disable=protected-access
+                body
+            ),
+            content_type="text/xml",
+        )
+
+    async def events(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.subscribers.append(websocket)
+        try:
+            async for _ in websocket:
+                pass
+        finally:
+            self.subscribers.remove(websocket)
+        return websocket
+
+    async def publish(self, kind, data):
+        message = json.dumps(
+            [
+                f"org.lavasoftware.standin.{kind}",
+                str(uuid.uuid1()),
+                "2024-01-01T00:00:00.000000",
+                "lavaserver",
+                json.dumps(data),
+            ]
+        )
+        for websocket in list(self.subscribers):
+            await websocket.send_str(message)
+
+    @property
+    def uri(self):
+        return str(self.server.make_url("/RPC2"))
+
+    @property
+    def event_url(self):
+        return str(self.server.make_url("/ws/"))
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([web.post("/RPC2", self.rpc), web.get("/ws/", self.events)])
+        self.server = TestServer(app, host="127.0.0.1")
+        await self.server.start_server()
+
+    async def close(self):
+        for websocket in list(self.subscribers):
+            await websocket.close()
+        await self.server.close()
+
+
+@pytest_asyncio.fixture
+async def lava_standin(request):
+    standin = LavaStandin(*getattr(request, "param", ()))
+    await standin.start()
+    yield standin
+    await standin.close()
+
+
+class LabgridStandin:
+    """
+    Local stand-in of labgrid coordinator speaking WAMP over websocket
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, place_num=0):
+        self.places = {
+            f"place-{i:04d}": {
+                "aliases": [],
+                "comment": "",
+                "tags": {},
+                "matches": [],
+                "acquired": None,
+                "acquired_resources": [],
+                "allowed": [],
+                "created": 1700000000.0,
+                "changed": 1700000000.0,
+                "reservation": None,
+            }
+            for i in range(place_num)
+        }
+        self.reservations = {}
+        self.calls = []
+        self.connections = 0
+        self.clients = []
+        self.subscribers = []  # (websocket, subscription id) of place_changed
+        self.procedures = {
+            "get_places": self.get_places,
+            "get_reservations": self.get_reservations,
+            "create_reservation": self.create_reservation,
+            "cancel_reservation": self.cancel_reservation,
+            "poll_reservation": self.poll_reservation,
+            "acquire_place": self.acquire_place,
+            "release_place": self.release_place,
+        }
+
+        self.server = None
+
+    def get_places(self, _):
+        return self.places
+
+    def get_reservations(self, _):
+        return self.reservations
+
+    def create_reservation(self, session, spec, prio=0.0):
+        token = uuid.uuid4().hex[:10].upper()
+        self.reservations[token] = {
+            "owner": session,
+            "state": "waiting",
+            "prio": prio,
+            "filters": {"main": dict(pair.split("=") for pair in spec.split())},
+            "allocations": {},
+            "created": 1700000000.0 + len(self.reservations),
+            "timeout": 1700000060.0,
+        }
+        self.schedule_reservations()
+        return {token: self.reservations[token]}
+
+    def cancel_reservation(self, _, token):
+        if token not in self.reservations:
+            return False
+        self.reservations.pop(token)
+        for place in self.places.values():
+            if place["reservation"] == token:
+                place["reservation"] = None
+        self.schedule_reservations()
+        return True
+
+    def poll_reservation(self, _, token):
+        return self.reservations.get(token)
+
+    def acquire_place(self, session, name):
+        place = self.places.get(name)
+        if not place or place["acquired"]:
+            return False
+        reservation = self.reservations.get(place["reservation"])
+        if reservation:
+            if reservation["owner"] != session:
+                return False
+            reservation["state"] = "acquired"
+        place["acquired"] = session
+        return True
+
+    def release_place(self, _, name):
+        place = self.places.get(name)
+        if not place or not place["acquired"]:
+            return False
+        place["acquired"] = None
+        self.schedule_reservations()
+        return True
+
+    def schedule_reservations(self):
+        # allocate free places to waiting reservations by priority
+        for token, reservation in sorted(
+            self.reservations.items(), key=lambda x: (-x[1]["prio"], x[1]["created"])
+        ):
+            if reservation["state"] != "waiting":
+                continue
+            name = reservation["filters"]["main"].get("name")
+            place = self.places.get(name)
+            if place and not place["reservation"] and not place["acquired"]:
+                place["reservation"] = token
+                reservation["state"] = "allocated"
+                reservation["allocations"] = {"main": [name]}
+
+    async def publish_place(self, name):
+        place = self.places.get(name, {})
+        for websocket, subscription in list(self.subscribers):
+            await websocket.send_json([36, subscription, 0, {}, [name, place]])
+
+    async def wamp(self, request):
+        websocket = web.WebSocketResponse(protocols=("wamp.2.json",))
+        await websocket.prepare(request)
+        self.connections += 1
+        self.clients.append(websocket)
+        session = None
+        try:
+            async for message in websocket:
+                message = json.loads(message.data)
+                if message[0] == 1:  # HELLO
+                    session = message[2]["authid"].split("/", 1)[1]
+                    await websocket.send_json([4, "ticket", {}])  # CHALLENGE
+                elif message[0] == 5:  # AUTHENTICATE
+                    await websocket.send_json([2, self.connections, {}])  # WELCOME
+                elif message[0] == 48:  # CALL
+                    _, request_id, _, procedure, args, kwargs = message
+                    procedure = procedure.rsplit(".", 1)[-1]
+                    self.calls.append(procedure)
+                    if procedure not in self.procedures:
+                        await websocket.send_json(
+                            [8, 48, request_id, {}, "wamp.error.no_such_procedure"]
+                        )
+                        continue
+                    places = copy.deepcopy(self.places)
+                    result = self.procedures[procedure](session, *args, **kwargs)
+                    await websocket.send_json([50, request_id, {}, [result]])
+                    for name, place in self.places.items():
+                        if place != places.get(name):
+                            await self.publish_place(name)
+                elif message[0] == 32:  # SUBSCRIBE
+                    subscription = len(self.subscribers) + 1
+                    self.subscribers.append((websocket, subscription))
+                    await websocket.send_json([33, message[1], subscription])
+                elif message[0] == 6:  # GOODBYE
+                    break
+        finally:
+            self.clients.remove(websocket)
+            self.subscribers = [
+                subscriber
+                for subscriber in self.subscribers
+                if subscriber[0] != websocket
+            ]
+        return websocket
+
+    @property
+    def url(self):
+        return str(self.server.make_url("/ws"))
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([web.get("/ws", self.wamp)])
+        self.server = TestServer(app, host="127.0.0.1")
+        await self.server.start_server()
+
+    async def close(self):
+        for websocket in list(self.clients):
+            await websocket.close()
+        await self.server.close()
+
+
+@pytest_asyncio.fixture
+async def labgrid_standin(request):
+    standin = LabgridStandin(*getattr(request, "param", ()))
+    await standin.start()
+    yield standin
+    await standin.close()
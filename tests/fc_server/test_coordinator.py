@@ -10,6 +10,11 @@ from unittest.mock import MagicMock
 
 import pytest
 
+from fc_server.core.config import Config
+from fc_server.core.coordinator import Coordinator
+from fc_server.core.decorators import cmd_priority
+from fc_server.core.governor import PRIORITY_BULK, PRIORITY_HIGH, cmd_priority_lane
+from fc_server.core.state import ResourceFlag
 from fc_server.plugins.labgrid import Plugin as LabgridPlugin
 from fc_server.plugins.lava import Plugin as LavaPlugin
 
@@ -30,8 +35,13 @@ def get_labgrid_plugin(plugins):
     return plugins[1]
 
 
+async def no_tasks(*_):
+    return []
+
+
 # pylint: disable=protected-access
 class TestCoordinator:
+    # pylint: disable=too-many-public-methods
     def test_init_coordinator(self, lava_plugin, labgrid_plugin, coordinator):
         assert isinstance(lava_plugin, LavaPlugin)
         assert isinstance(labgrid_plugin, LabgridPlugin)
@@ -141,8 +151,80 @@ class TestCoordinator:
             == expected[0]
         )
         assert (
-            coordinator._Coordinator__managed_issue_disconnect_resources == expected[2]
+            coordinator.resource_states.flagged(ResourceFlag.ISSUE_DISCONNECT)
+            == expected[2]
+        )
+
+    @pytest.mark.asyncio
+    async def test_availability_snapshot(
+        self, asyncio_patch, mocker, lava_plugin, labgrid_plugin, coordinator
+    ):
+        mocker_disconnect = asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin.default_framework_disconnect",
+            (True, True),
         )
+        coordinator.accept_resource("$resource2", lava_plugin)
+
+        assert await coordinator.availability_snapshot(
+            labgrid_plugin, ["$resource1", "$resource2", "$resource1"]
+        ) == {"$resource1": True, "$resource2": False}
+        mocker_disconnect.assert_called_once_with("$resource1")
+
+        # default framework needs no disconnect
+        assert await coordinator.availability_snapshot(
+            lava_plugin, ["$resource1", "$resource2"]
+        ) == {"$resource1": True, "$resource2": False}
+        assert mocker_disconnect.call_count == 1
+
+        # disconnects of a scheduling pass stay in the lane of the pass
+        lanes = []
+
+        async def disconnect(*_):
+            lanes.append(cmd_priority_lane.get())
+            return True, True
+
+        mocker_disconnect.side_effect = disconnect
+        coordinator.reset_resource("$resource1")
+        await cmd_priority(PRIORITY_BULK)(coordinator.availability_snapshot)(
+            labgrid_plugin, ["$resource1"]
+        )
+        assert lanes == [PRIORITY_BULK]
+
+    @pytest.mark.asyncio
+    async def test_schedule_frameworks(
+        self, mocker, lava_plugin, labgrid_plugin, coordinator
+    ):
+        passes = {"lava": 0, "labgrid": 0}
+
+        async def slow_schedule(_):
+            passes["lava"] += 1
+            await asyncio.sleep(10)
+
+        async def broken_schedule(_):
+            passes["labgrid"] += 1
+            raise RuntimeError("labgrid unreachable")
+
+        mocker.patch.object(lava_plugin, "schedule", side_effect=slow_schedule)
+        mocker.patch.object(labgrid_plugin, "schedule", side_effect=broken_schedule)
+        labgrid_plugin.schedule_interval = 0.05
+
+        task = asyncio.create_task(coordinator._Coordinator__schedule_frameworks())
+        await asyncio.sleep(0.3)
+
+        # labgrid keeps its pace while lava pass is stuck, and survives failure
+        assert passes["lava"] == 1
+        assert passes["labgrid"] >= 3
+
+        # immediate pass on request
+        labgrid_plugin.schedule_interval = 100
+        await asyncio.sleep(0.1)
+        labgrid_passes = passes["labgrid"]
+        coordinator.request_schedule(labgrid_plugin)
+        await asyncio.sleep(0.05)
+        assert passes["labgrid"] == labgrid_passes + 1
+
+        task.cancel()
 
     def test_is_resource_non_available(self, coordinator):
         assert not coordinator.is_resource_non_available("$resource1")
@@ -154,16 +236,101 @@ class TestCoordinator:
     def test_is_seized_job(self, coordinator):
         assert not coordinator.is_seized_job(0)
 
+    def test_clear_seized_job_records(self, coordinator):
+        coordinator.coordinating_job_records["0"] = "$resource1"
+        coordinator.coordinating_job_records["1"] = "$resource2"
+        coordinator.clear_seized_job_records("$resource1")
+        assert not coordinator.is_seized_job("0")
+        assert coordinator.is_seized_job("1")
+
     def test_accept_resource(self, coordinator, lava_plugin):
         coordinator.accept_resource("$resource1", lava_plugin)
         assert coordinator.managed_resources_status["$resource1"] == "lava"
 
+    def test_claim_resource(self, coordinator, lava_plugin, labgrid_plugin):
+        assert coordinator.claim_resource("$resource1", labgrid_plugin)
+        assert not coordinator.claim_resource("$resource1", lava_plugin)
+        assert coordinator.managed_resources_status["$resource1"] == "labgrid"
+
     @pytest.mark.asyncio
-    async def test_return_resource(self, coordinator, lava_plugin):
+    async def test_claim_interleaved_passes(
+        self, asyncio_patch, mocker, coordinator, lava_plugin, labgrid_plugin
+    ):
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin.lava_get_devices",
+            [
+                {
+                    "current_job": None,
+                    "health": "Unknown",
+                    "hostname": "$resource1",
+                    "state": "Idle",
+                    "type": "docker",
+                }
+            ],
+        )
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin._Plugin__get_device_tags",
+            ("$resource1", []),
+        )
+        asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_job_info", {"tags": []}
+        )
+        mocker_lend = mocker.patch(
+            "fc_server.plugins.lava.Plugin._Plugin__lend_resources"
+        )
+        mocker_disconnect = asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin.default_framework_disconnect",
+            (True, True),
+        )
+
+        async def queued_job_pages():
+            # labgrid pass takes the board while lava pass awaits its queue
+            available = await coordinator.availability_snapshot(
+                labgrid_plugin, ["$resource1"]
+            )
+            assert available["$resource1"]
+            assert coordinator.claim_resource("$resource1", labgrid_plugin)
+            yield [{"id": "0", "requested_device_type": "docker"}]
+
+        mocker.patch.object(
+            lava_plugin,
+            "lava_get_queued_job_pages",
+            MagicMock(side_effect=queued_job_pages),
+        )
+
+        # lava saw the board free at the start of its pass, but must not take it
+        await lava_plugin.schedule(coordinator)
+        mocker_disconnect.assert_called_once_with("$resource1")
+        assert lava_plugin.scheduler_cache["0"] == ["$resource1"]
+        mocker_lend.assert_not_called()
+        assert coordinator.managed_resources_status["$resource1"] == "labgrid"
+
+    @pytest.mark.asyncio
+    async def test_return_resource(
+        self, mocker, coordinator, lava_plugin, labgrid_plugin
+    ):
         coordinator.accept_resource("$resource1", lava_plugin)
         await coordinator.return_resource("$resource1")
         assert coordinator.managed_resources_status["$resource1"] == "fc"
 
+        # handoff returned from a scheduling pass goes ahead of bulk commands
+        lanes = []
+
+        async def connect(_):
+            lanes.append(cmd_priority_lane.get())
+            return True
+
+        mocker.patch.object(
+            lava_plugin, "default_framework_connect", MagicMock(side_effect=connect)
+        )
+        coordinator.accept_resource("$resource1", labgrid_plugin)
+        coordinator.resource_states.set_flag("$resource1", ResourceFlag.DISCONNECTED)
+        await cmd_priority(PRIORITY_BULK)(coordinator.return_resource)("$resource1")
+        assert lanes == [PRIORITY_HIGH]
+
     def test_retire_resource(self, coordinator):
         coordinator.retire_resource("$resource1")
         assert coordinator.managed_resources_status["$resource1"] == "retired"
@@ -222,8 +389,274 @@ class TestCoordinator:
         ]
 
         if seized_resource_awared:
-            coordinator.accept_resource("$resource1", get_lava_plugin)
+            coordinator.accept_resource("$resource1", lava_plugin)
         await native_sleep(0)
 
         mocker_force_kick_off.assert_called_with("$resource1")
         assert mocker_reset_resource.called == (not seized_resource_awared)
+
+    @pytest.mark.asyncio
+    async def test_coordinate_resources_seize_policy(self, mocker):
+        mocker.patch.object(Config, "seize_policy", {"policy": "cost"})
+        coordinator = Coordinator()
+        lava_plugin, labgrid_plugin = coordinator.framework_instances
+        coordinator.accept_resource("$resource1", labgrid_plugin)
+        coordinator.accept_resource("$resource2", labgrid_plugin)
+
+        costs = {
+            "$resource1": {"elapsed": 3000, "estimate": 3600},
+            "$resource2": {"elapsed": 60},
+        }
+
+        async def seize_costs(resources):
+            return {resource: costs[resource] for resource in resources}
+
+        mocker.patch.object(
+            labgrid_plugin, "seize_costs", MagicMock(side_effect=seize_costs)
+        )
+        mocker_force_kick_off = mocker.patch.object(
+            labgrid_plugin, "force_kick_off", MagicMock(side_effect=no_tasks)
+        )
+
+        assert await coordinator.coordinate_resources(
+            lava_plugin, "0", "$resource1", "$resource2"
+        ) == ["$resource2"]
+        mocker_force_kick_off.assert_called_once_with("$resource2")
+        assert coordinator.managed_resources_status["$resource2"] == "lava_seized"
+
+        # wait for the job finishing in 600 seconds rather than cancel it
+        costs["$resource1"]["elapsed"] = 3500
+        assert await coordinator.coordinate_resources(
+            lava_plugin, "1", "$resource1", "$resource2"
+        ) == ["$resource2"]
+        assert mocker_force_kick_off.call_count == 1
+        assert not coordinator.is_seized_job("1")
+
+        coordinator.seized_status_timeout_records.pop("$resource2").cancel()
+
+    @pytest.mark.parametrize(
+        "seize_policy, seized_jobs",
+        [
+            ({"concurrency": 1}, {"0": "$resource1", "1": "$resource2"}),
+            ({"policy": "cost", "concurrency": 1}, {"0": "$resource2"}),
+        ],
+    )
+    @pytest.mark.asyncio
+    async def test_seize_resources(self, mocker, seize_policy, seized_jobs):
+        mocker.patch.object(Config, "seize_policy", seize_policy)
+        coordinator = Coordinator()
+        lava_plugin, labgrid_plugin = coordinator.framework_instances
+        coordinator.accept_resource("$resource1", labgrid_plugin)
+        coordinator.accept_resource("$resource2", labgrid_plugin)
+
+        # $resource1 finishes in 100 seconds, cancel $resource2 loses 60 seconds
+        async def seize_costs(_):
+            return {
+                "$resource1": {"elapsed": 3500, "estimate": 3600},
+                "$resource2": {"elapsed": 60},
+            }
+
+        running = []
+
+        async def force_kick_off(resource):
+            running.append(resource)
+            assert len(running) == 1
+            await asyncio.sleep(0)
+            running.remove(resource)
+
+        mocker.patch.object(
+            labgrid_plugin, "seize_costs", MagicMock(side_effect=seize_costs)
+        )
+        mocker_force_kick_off = mocker.patch.object(
+            labgrid_plugin, "force_kick_off", MagicMock(side_effect=force_kick_off)
+        )
+
+        candidates = ["$resource1", "$resource2"]
+        results = []
+        for job_id in ("0", "1", "2"):
+            coordinator.request_seize(
+                lava_plugin,
+                job_id,
+                candidates,
+                lambda _, job_id=job_id: results.append(job_id),
+            )
+        await coordinator._Coordinator__seize_requested(lava_plugin)
+
+        # every job seizes at most one resource, no resource seized twice
+        assert mocker_force_kick_off.call_count == len(seized_jobs)
+        assert sorted(results) == sorted(seized_jobs)
+        for job_id, resource in seized_jobs.items():
+            assert coordinator.coordinating_job_records[job_id] == resource
+            assert coordinator.managed_resources_status[resource] == "lava_seized"
+            coordinator.seized_status_timeout_records.pop(resource).cancel()
+        assert not coordinator.is_seized_job("2")
+
+    @pytest.mark.asyncio
+    async def test_seize_priority(self, mocker):
+        mocker.patch.object(Config, "seize_policy", {"concurrency": 1})
+        coordinator = Coordinator()
+        lava_plugin, labgrid_plugin = coordinator.framework_instances
+        coordinator.accept_resource("$resource1", labgrid_plugin)
+
+        lanes = []
+
+        async def force_kick_off(_):
+            lanes.append(cmd_priority_lane.get())
+            await asyncio.sleep(0)
+
+        mocker_force_kick_off = mocker.patch.object(
+            labgrid_plugin, "force_kick_off", MagicMock(side_effect=force_kick_off)
+        )
+
+        # the later requested job has higher priority, it seizes the resource
+        coordinator.request_seize(lava_plugin, "0", ["$resource1"], priority=0)
+        coordinator.request_seize(lava_plugin, "1", ["$resource1"], priority=5)
+        await cmd_priority(PRIORITY_BULK)(coordinator._Coordinator__seize_requested)(
+            lava_plugin
+        )
+
+        mocker_force_kick_off.assert_called_once_with("$resource1")
+        # kick off of a scheduling pass goes ahead of bulk commands
+        assert lanes == [PRIORITY_HIGH]
+        assert coordinator.coordinating_job_records == {"1": "$resource1"}
+        coordinator.seized_status_timeout_records.pop("$resource1").cancel()
+
+    @pytest.mark.asyncio
+    async def test_connect_retry(self, mocker):
+        mocker.patch.object(
+            Config, "connect_retry", {"base": 0.01, "jitter": 0, "concurrency": 1}
+        )
+        coordinator = Coordinator()
+        lava_plugin = coordinator.framework_instances[0]
+
+        running = []
+        results = {"$resource1": [False, False, True], "$resource2": [True]}
+
+        async def connect(resource):
+            running.append(resource)
+            assert len(running) == 1
+            await asyncio.sleep(0)
+            running.remove(resource)
+            return results[resource].pop(0)
+
+        mocker_connect = mocker.patch.object(
+            lava_plugin, "default_framework_connect", MagicMock(side_effect=connect)
+        )
+        retry = asyncio.create_task(coordinator._Coordinator__connect_issue_resources())
+        coordinator._Coordinator__issue_connect("$resource1")
+        coordinator._Coordinator__issue_connect("$resource2")
+
+        await asyncio.sleep(0.01)
+        assert coordinator.connect_retry_queue.attempts("$resource1") == 1
+        assert "$resource2" not in coordinator.connect_retry_queue
+
+        # backoff 0.01s and 0.02s before the third attempt succeeds
+        await asyncio.sleep(0.1)
+        retry.cancel()
+        assert mocker_connect.call_count == 4
+        assert len(coordinator.connect_retry_queue) == 0
+        assert not coordinator.resource_states.flagged(ResourceFlag.ISSUE_DISCONNECT)
+
+    @pytest.mark.asyncio
+    async def test_state_journal(self, mocker, tmp_path):
+        mocker.patch.object(
+            Config, "state_journal", {"path": str(tmp_path / "journal")}
+        )
+        coordinator = Coordinator()
+        lava_plugin, labgrid_plugin = coordinator.framework_instances
+        coordinator.accept_resource("$resource1", labgrid_plugin)
+        coordinator.retire_resource("$resource2")
+        coordinator.coordinating_job_records["0"] = "$resource1"
+        coordinator._Coordinator__journal("seize", job="0", resource="$resource1")
+        coordinator._Coordinator__start_seized_status_timeout("$resource1")
+        coordinator.seized_status_timeout_records["$resource1"].cancel()
+        coordinator.journal.close()
+
+        # warm restart from journal records
+        restarted = Coordinator()
+        assert restarted.managed_resources_status["$resource1"] == "labgrid"
+        assert restarted.managed_resources_status["$resource2"] == "retired"
+        assert restarted.managed_disconnect_resource("$resource1")
+        assert restarted.is_seized_job("0")
+
+        # warm restart from snapshot, journal truncated
+        coordinator._Coordinator__snapshot_state()
+        assert (tmp_path / "journal").read_text() == ""
+        restarted = Coordinator()
+        assert restarted.managed_resources_status["$resource1"] == "labgrid"
+        assert restarted.is_seized_job("0")
+
+        lava_plugin, labgrid_plugin = restarted.framework_instances
+        mocker.patch.object(lava_plugin, "init", MagicMock(side_effect=no_tasks))
+        mocker.patch.object(labgrid_plugin, "init", MagicMock(side_effect=no_tasks))
+        await restarted._Coordinator__init_frameworks()
+        restarted.seized_status_timeout_records.pop("$resource1").cancel()
+
+    @pytest.mark.asyncio
+    async def test_state_journal_lent(self, asyncio_patch, mocker, tmp_path):
+        mocker.patch.object(
+            Config, "state_journal", {"path": str(tmp_path / "journal")}
+        )
+        coordinator = Coordinator()
+        lava_plugin, _ = coordinator.framework_instances
+        coordinator._Coordinator__snapshot_state()
+
+        # lent after last snapshot, only the lava claim is journaled
+        assert coordinator.claim_resource("$resource1", lava_plugin)
+        coordinator.journal.close()
+
+        restarted = Coordinator()
+        assert restarted.managed_resources_status["$resource1"] == "lava"
+        lava_plugin, labgrid_plugin = restarted.framework_instances
+        mocker.patch.object(lava_plugin, "init", MagicMock(side_effect=no_tasks))
+        mocker.patch.object(labgrid_plugin, "init", MagicMock(side_effect=no_tasks))
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin._Plugin__get_devices",
+            [{"hostname": "$resource1", "current_job": None}],
+        )
+        await restarted._Coordinator__init_frameworks()
+
+        # swept at once, idle device is returned to fc
+        await asyncio.sleep(0.1)
+        assert not lava_plugin._Plugin__lent_resources
+        assert restarted.managed_resources_status["$resource1"] == "fc"
+        restarted.journal.close()
+
+    @pytest.mark.asyncio
+    async def test_state_journal_reconcile(self, asyncio_patch, mocker, tmp_path):
+        mocker.patch.object(
+            Config, "state_journal", {"path": str(tmp_path / "journal")}
+        )
+        coordinator = Coordinator()
+        _, labgrid_plugin = coordinator.framework_instances
+        coordinator.accept_resource("$resource1", labgrid_plugin)
+        coordinator.accept_resource("$resource2", labgrid_plugin)
+        coordinator.journal.close()
+
+        # fc system reservation acquired $resource1 while fc was down
+        restarted = Coordinator()
+        _, labgrid_plugin = restarted.framework_instances
+        asyncio_patch(
+            mocker, "fc_server.plugins.labgrid.Plugin.labgrid_get_reservations", {}
+        )
+        asyncio_patch(
+            mocker, "fc_server.plugins.labgrid.Plugin._Plugin__labgrid_init", None
+        )
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.labgrid.Plugin.labgrid_get_place_snapshot",
+            {"$resource1": {"owner": "fc/fc"}, "$resource2": {"owner": "foo/bar"}},
+        )
+        mocker_connect = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.default_framework_connect", True
+        )
+
+        await labgrid_plugin._Plugin__labgrid_reconcile(
+            restarted, ["$resource1", "$resource2"]
+        )
+        assert restarted.managed_resources_status["$resource1"] == "fc"
+        assert not restarted.managed_disconnect_resource("$resource1")
+        mocker_connect.assert_called_once_with("$resource1")
+        assert restarted.managed_resources_status["$resource2"] == "labgrid"
+        restarted.journal.close()
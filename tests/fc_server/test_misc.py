@@ -5,9 +5,25 @@
 # SPDX-License-Identifier: MIT
 
 
+import asyncio
+import shutil
+import sys
+import time
+from unittest.mock import MagicMock
+
 import pytest
 
+from fc_common.coprocess import CoprocessWorker
+from fc_common.decoder import DecodeError, Decoder
 from fc_server.core import AsyncRunMixin
+from fc_server.core.cache import BoundedCache, TTLCache, cache_stats
+from fc_server.core.coprocess import Coprocess, CoprocessPool
+from fc_server.core.decorators import cmd_priority
+from fc_server.core.governor import PRIORITY_BULK, PRIORITY_HIGH, CmdGovernor
+from fc_server.core.interval import AdaptiveInterval
+from fc_server.core.retry import RetryQueue
+from fc_server.core.seize import CostSeizePolicy, RuntimeHistory, SeizePolicy
+from fc_server.core.state import ResourceFlag, ResourcePhase, ResourceStateTable
 
 
 # pylint: disable=protected-access
@@ -17,3 +33,381 @@ class TestAsyncRunMixin:
     async def test_run_cmd(self, cmd, ret):
         exit_code = await AsyncRunMixin()._run_cmd(cmd)
         assert exit_code[0] == ret
+
+
+class TestDecoder:
+    def test_from_json(self):
+        assert Decoder.from_json('[{"hostname": "foo"}]', "test.json") == [
+            {"hostname": "foo"}
+        ]
+        assert Decoder.from_json("", "test.json") is None
+
+        with pytest.raises(DecodeError):
+            Decoder.from_json("Unable to call 'devices.show'", "test.json")
+
+        assert Decoder.stats()["test.json"]["calls"] == 2
+
+    def test_from_yaml(self):
+        assert Decoder.from_yaml("Reservation 'foo':\n  owner: fc/fc", "test.yaml") == {
+            "Reservation 'foo'": {"owner": "fc/fc"}
+        }
+
+        with pytest.raises(DecodeError):
+            Decoder.from_yaml("foo: [", "test.yaml")
+
+        assert Decoder.stats()["test.yaml"]["calls"] == 2
+
+
+class TestBoundedCache:
+    def test_evict(self, mocker):
+        cache = BoundedCache(maxsize=2, ttl=10)
+        cache["0"] = ["foo"]
+        cache["1"] = ["bar"]
+        cache["0"] = ["foo"]  # rewrite makes it newest
+        cache["2"] = ["baz"]
+        assert list(cache) == ["0", "2"]
+        assert cache.evictions == 1
+
+        now = time.monotonic()
+        mocker.patch("time.monotonic", return_value=now + 11)
+        assert "0" not in cache
+        cache["3"] = []
+        assert dict(cache) == {"3": []}
+
+    def test_invalidate_referring(self):
+        cache = BoundedCache(refs=lambda devices: devices)
+        cache["0"] = ["foo"]
+        cache["0"] += ["bar"]
+        cache["1"] = ["bar"]
+        cache["2"] = ["baz"]
+        assert cache.keys_referring("bar") == {"0", "1"}
+
+        cache.invalidate_referring("bar")
+        assert dict(cache) == {"2": ["baz"]}
+        assert cache.keys_referring("foo") == set()
+        assert cache.stats() == {"size": 1, "maxsize": 10000, "evictions": 0, "refs": 1}
+
+    def test_cache_stats(self):
+        class Owner:  # pylint: disable=too-few-public-methods
+            def __init__(self):
+                self.job_cache = BoundedCache()
+                self.info_cache = TTLCache()
+                self.records = {}
+
+        assert set(cache_stats(Owner())) == {"job_cache", "info_cache"}
+
+
+class TestCmdGovernor:
+    def test_executable(self):
+        assert CmdGovernor.executable("lavacli -i foo jobs queue") == "lavacli"
+        assert (
+            CmdGovernor.executable("timeout 30 /usr/bin/labgrid-client reserve")
+            == "labgrid-client"
+        )
+        assert CmdGovernor.for_cmd("echo foo") is CmdGovernor.for_cmd("echo bar")
+
+    @pytest.mark.asyncio
+    async def test_concurrency_priority(self):
+        governor = CmdGovernor("test", concurrency=2)
+        order = []
+        peak = 0
+
+        async def run(name):
+            nonlocal peak
+            async with governor:
+                peak = max(peak, governor.active)
+                await asyncio.sleep(0.01)
+                order.append(name)
+
+        @cmd_priority(PRIORITY_BULK)
+        async def bulk(name):
+            await run(name)
+
+        @cmd_priority(PRIORITY_HIGH)
+        async def high(name):
+            await run(name)
+
+        runs = asyncio.gather(*[bulk(f"bulk{i}") for i in range(4)], high("high"))
+        await asyncio.sleep(0)
+        assert governor.queue_depth == 3
+        await runs
+        assert peak == 2
+        assert governor.queue_depth == 0
+        # high priority command overtakes queued bulk ones
+        assert order.index("high") < order.index("bulk2")
+        assert governor.granted == 5
+        assert governor.active == 0
+
+    @pytest.mark.asyncio
+    async def test_rate(self):
+        governor = CmdGovernor("test", concurrency=10, rate=50, burst=2)
+
+        async def run():
+            async with governor:
+                pass
+
+        start = time.monotonic()
+        await asyncio.gather(*[run() for _ in range(7)])
+        # 2 in burst, then 5 paced at 50 per second
+        assert time.monotonic() - start >= 0.09
+        assert governor.max_wait >= 0.09
+
+    @pytest.mark.asyncio
+    async def test_run_cmd_governed(self):
+        await AsyncRunMixin()._run_cmd("true")
+        await AsyncRunMixin()._run_cmd("true", governed=False)
+        assert CmdGovernor.stats()["true"]["granted"] == 1
+
+
+class TestCoprocess:
+    @pytest.mark.parametrize(
+        "cmd, argv",
+        [
+            (
+                "lavacli -i foo devices update bar --description '[FC]baz qux'",
+                [
+                    "lavacli",
+                    "-i",
+                    "foo",
+                    "devices",
+                    "update",
+                    "bar",
+                    "--description",
+                    "[FC]baz qux",
+                ],
+            ),
+            ("labgrid-client -p foo release > /dev/null 2>&1", None),
+            ("labgrid-client -p $PLACE show", None),
+            ('labgrid-client -p "$PLACE" show', None),
+            ("timeout 5 labgrid-client reserve name=foo", None),
+            ("echo foo", None),
+        ],
+    )
+    def test_argv(self, cmd, argv):
+        pool = CoprocessPool(["lavacli", "labgrid-client"])
+        assert pool.argv(cmd) == argv
+
+    def test_worker_call(self):
+        def tool():
+            print(" ".join(sys.argv[1:]))
+            print("warn", file=sys.stderr)
+            sys.exit(3)
+
+        worker = CoprocessWorker()
+        worker.entries.update({"tool": tool, "broken": lambda: 1 / 0})
+
+        assert worker.call(["tool", "foo", "bar"]) == {
+            "returncode": 3,
+            "stdout": "foo bar\n",
+            "stderr": "warn\n",
+        }
+        stdin = sys.stdin
+        assert worker.call(["broken"])["returncode"] == 1
+        assert "ZeroDivisionError" in worker.call(["broken"])["stderr"]
+        assert sys.stdin is stdin
+
+    @pytest.mark.asyncio
+    async def test_pool_timeout(self, mocker):
+        helpers = []
+
+        async def start_hung(_):
+            helpers.append(
+                Coprocess(
+                    await asyncio.create_subprocess_exec(
+                        sys.executable,
+                        "-c",
+                        "import time; time.sleep(60)",
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.PIPE,
+                    )
+                )
+            )
+            return helpers[-1]
+
+        mocker.patch.object(Coprocess, "start", MagicMock(side_effect=start_hung))
+        pool = CoprocessPool(["lavacli"], call_timeout=0.1)
+        mocker.patch.object(CoprocessPool, "shared", return_value=pool)
+
+        # stuck helper is killed, next call spawns a fresh one
+        for _ in range(2):
+            assert await CoprocessPool.run_cmd("lavacli devices list") == (
+                1,
+                "",
+                "coprocess timeout after 0.1s",
+            )
+        assert len(helpers) == 2
+        for helper in helpers:
+            assert await helper.proc.wait() != 0
+
+        # blocking waits are never sent to a helper
+        mocker_run_cmd = mocker.patch.object(CoprocessPool, "run_cmd")
+        await AsyncRunMixin()._run_cmd("true", governed=False)
+        mocker_run_cmd.assert_not_called()
+
+    @pytest.mark.skipif(not shutil.which("lavacli"), reason="lavacli not installed")
+    @pytest.mark.asyncio
+    async def test_pool_run(self):
+        pool = CoprocessPool(["lavacli", "true"], size=2, max_calls=2)
+
+        results = await asyncio.gather(
+            *[pool.run(["lavacli", "--version"]) for _ in range(3)]
+        )
+        proc = await asyncio.create_subprocess_shell(
+            "lavacli --version", stdout=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await proc.communicate()
+        assert all(result == (0, stdout.decode(), "") for result in results)
+
+        # no python entry point, leave it to shell from now on
+        assert await pool.run(["true"]) is None
+        assert pool.argv("true") is None
+
+        await pool.close()
+
+
+class TestAdaptiveInterval:
+    def test_observe(self):
+        controller = AdaptiveInterval(30, 10, 100, idle_passes=2)
+        assert controller.interval == 30
+
+        assert controller.observe(0) == 30
+        assert controller.observe(0) == 60
+        assert controller.reason == "idle for 2 passes"
+        assert controller.observe(0) == 100
+        assert controller.observe(0) == 100
+
+        assert controller.observe(3, "queued jobs") == 10
+        assert controller.stats() == {
+            "interval": 10,
+            "minimum": 10,
+            "maximum": 100,
+            "reason": "3 queued jobs",
+        }
+        assert controller.observe(0) == 10
+
+
+class TestResourceStateTable:
+    def test_states(self):
+        table = ResourceStateTable(["foo", "bar", "baz"], ["lava", "labgrid"])
+        lava = table.owner_code("lava")
+        labgrid = table.owner_code("labgrid")
+        assert table.count(ResourceStateTable.FC) == 3
+        assert table.statuses == {"foo": "fc", "bar": "fc", "baz": "fc"}
+
+        table.set("foo", lava)
+        table.set("bar", labgrid, ResourcePhase.SEIZING)
+        table.set("bar", labgrid, ResourcePhase.SEIZED)
+        table.set("baz", ResourceStateTable.RETIRED)
+        assert table.version == 4
+        table.set("baz", ResourceStateTable.RETIRED)
+        assert table.version == 4
+
+        assert table.is_state("foo", lava)
+        assert table.is_state("bar", labgrid, ResourcePhase.SEIZED)
+        assert not table.is_state("bar", labgrid)
+        assert not table.is_state("unknown", ResourceStateTable.FC)
+        assert table.members(ResourceStateTable.RETIRED) == ["baz"]
+        assert table.count(ResourceStateTable.FC) == 0
+        assert dict(table.statuses) == {
+            "foo": "lava",
+            "bar": "labgrid_seized",
+            "baz": "retired",
+        }
+        assert table.statuses.get("unknown", "") == ""
+
+    def test_flags(self):
+        table = ResourceStateTable(["foo", "bar"], ["lava"])
+
+        table.set_flag("bar", ResourceFlag.ISSUE_DISCONNECT)
+        table.set_flag("foo", ResourceFlag.ISSUE_DISCONNECT)
+        table.set_flag("foo", ResourceFlag.DISCONNECTED)
+        table.set_flag("foo", ResourceFlag.DISCONNECTED)
+        assert table.flagged(ResourceFlag.ISSUE_DISCONNECT) == ["bar", "foo"]
+        assert table.count_flag(ResourceFlag.DISCONNECTED) == 1
+
+        assert table.clear_flag("foo", ResourceFlag.DISCONNECTED)
+        assert not table.clear_flag("foo", ResourceFlag.DISCONNECTED)
+        assert not table.has_flag("foo", ResourceFlag.DISCONNECTED)
+        assert table.has_flag("foo", ResourceFlag.ISSUE_DISCONNECT)
+        assert table.stats() == {
+            "version": 4,
+            "states": {"fc": 2},
+            "flags": {"disconnected": 0, "issue_disconnect": 2},
+        }
+
+
+class TestRetryQueue:
+    def test_backoff(self, mocker):
+        mocker.patch("time.monotonic", return_value=100)
+        queue = RetryQueue(base=1, maximum=4, jitter=0.5, concurrency=2)
+        queue.add("foo")
+        queue.add("bar")
+        assert queue.take_due() == ["foo", "bar"]
+        assert queue.take_due() == []
+        assert queue.next_delay() is None
+
+        mocker.patch("random.uniform", return_value=0)
+        assert [queue.failed("foo") for _ in range(4)] == [1, 2, 4, 4]
+        assert queue.attempts("foo") == 4
+        assert queue.next_delay() == 4
+
+        mocker.patch("random.uniform", return_value=-0.5)
+        assert queue.failed("bar") == 0.5
+        queue.add("bar")
+        assert queue.stats() == {
+            "pending": 2,
+            "concurrency": 2,
+            "items": {
+                "foo": {"attempts": 4, "next_retry_in": 4},
+                "bar": {"attempts": 1, "next_retry_in": 0.5},
+            },
+        }
+
+        mocker.patch("time.monotonic", return_value=104)
+        assert queue.take_due() == ["bar", "foo"]
+        queue.discard("bar")
+        assert "bar" not in queue
+        assert len(queue) == 1
+
+
+class TestSeizePolicy:
+    def test_runtime_history(self):
+        history = RuntimeHistory(weight=0.5)
+        assert history.estimate("docker") is None
+        history.record("docker", 100)
+        history.record("docker", 200)
+        assert history.estimate("docker") == 150
+        assert history.stats() == {"docker": {"estimate": 150, "samples": 2}}
+
+    def test_create(self):
+        policy = SeizePolicy.create({})
+        assert isinstance(policy, SeizePolicy)
+        assert not isinstance(policy, CostSeizePolicy)
+        policy = SeizePolicy.create({"policy": "cost", "wait_threshold": 60})
+        assert isinstance(policy, CostSeizePolicy)
+        assert policy.wait_threshold == 60
+        policy = SeizePolicy.create(
+            {"policy": "fc_server.core.seize:CostSeizePolicy", "priority_weight": 0}
+        )
+        assert policy.priority_weight == 0
+
+    def test_rank(self):
+        costs = {
+            "foo": {"elapsed": 3000, "priority": 50, "estimate": 3600},
+            "bar": {"elapsed": 600, "priority": 100},
+            "baz": {},
+            "qux": {"elapsed": 500},
+        }
+        assert SeizePolicy().rank(costs) == (["foo", "bar", "baz", "qux"], [])
+
+        policy = CostSeizePolicy(wait_threshold=900)
+        assert policy.rank(costs) == (["baz", "qux", "bar", "foo"], [])
+        assert policy.rank({}) == ([], [])
+
+        # foo finishes in 600 seconds, cheaper than cancel any other job
+        del costs["baz"]
+        costs["qux"]["elapsed"] = 700
+        assert policy.rank(costs) == ([], ["foo"])
+
+        policy.wait_threshold = 300
+        assert policy.rank(costs) == (["qux", "bar", "foo"], [])
@@ -5,10 +5,16 @@
 # SPDX-License-Identifier: MIT
 
 
+import asyncio
 from unittest.mock import MagicMock
 
 import pytest
+import pytest_asyncio
 
+from fc_server.core.config import Config
+from fc_server.core.decorators import cmd_priority
+from fc_server.core.governor import PRIORITY_BULK, PRIORITY_HIGH, cmd_priority_lane
+from fc_server.core.retry import RetryQueue
 from fc_server.plugins.labgrid import Plugin
 
 
@@ -22,6 +28,18 @@ def labgrid_plugin():
     return Plugin(config)
 
 
+@pytest_asyncio.fixture(name="native_plugin")
+async def labgrid_native_plugin(mocker, labgrid_standin):
+    mocker.patch.dict(
+        Config.frameworks_config["labgrid"],
+        {"lg_crossbar": labgrid_standin.url, "backend": "native"},
+    )
+    config = {"lg_crossbar": labgrid_standin.url, "priority": 2, "seize": False}
+    plugin = Plugin(config)
+    yield plugin
+    await plugin.shutdown()
+
+
 # pylint: disable=protected-access
 class TestPluginLabgrid:
     @pytest.mark.asyncio
@@ -66,16 +84,44 @@ class TestPluginLabgrid:
         mocker_labgrid_cancel_reservation.assert_called()
         mocker_labgrid_release_place.assert_called()
 
+    @pytest.mark.asyncio
+    async def test_seize_costs(self, asyncio_patch, mocker, plugin):
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.labgrid.Plugin.labgrid_get_place_token",
+            "7GN5HFQOEU",
+        )
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.labgrid.Plugin.labgrid_get_reservations",
+            {
+                "Reservation '7GN5HFQOEU'": {
+                    "owner": "foo/bar",
+                    "token": "7GN5HFQOEU",
+                    "state": "acquired",
+                    "prio": "100.0",
+                    "created": "2023-03-28 10:27:14.881492",
+                }
+            },
+        )
+
+        costs = await plugin.seize_costs(["$resource1"])
+        assert costs["$resource1"]["elapsed"] > 0
+        assert costs["$resource1"]["priority"] == 100
+
     @pytest.mark.asyncio
     async def test_seize_resource(self, asyncio_patch, mocker, coordinator, plugin):
-        mocker_coordinate_resources = asyncio_patch(
+        mocker_seize_resources = asyncio_patch(
             mocker,
-            "fc_server.core.coordinator.Coordinator.coordinate_resources",
-            MagicMock(),
+            "fc_server.core.coordinator.Coordinator.seize_resources",
+            {"foo": ["$resource1"]},
         )
-        await plugin._Plugin__seize_resource(coordinator, "foo", ["$resource1"])
+        plugin.seize_cache["foo"] = []
 
-        mocker_coordinate_resources.assert_called()
+        plugin._Plugin__seize_resource(coordinator, "foo", ["$resource1"], 0)
+        await coordinator._Coordinator__seize_requested(plugin)
+        mocker_seize_resources.assert_called_once_with(plugin, {"foo": ["$resource1"]})
+        assert plugin.seize_cache["foo"] == ["$resource1"]
 
     @pytest.mark.asyncio
     async def test_schedule(self, asyncio_patch, mocker, plugin, coordinator):
@@ -128,10 +174,13 @@ class TestPluginLabgrid:
             "fc_server.plugins.labgrid.Plugin.labgrid_cancel_reservation",
             MagicMock(),
         )
-        asyncio_patch(
-            mocker,
-            "fc_server.plugins.labgrid.Plugin.labgrid_release_place",
-            MagicMock(),
+        lanes = []
+
+        async def release_place(*_):
+            lanes.append(cmd_priority_lane.get())
+
+        mocker.patch.object(
+            plugin, "labgrid_release_place", MagicMock(side_effect=release_place)
         )
 
         async def mocker_labgrid_system_reservation():
@@ -142,5 +191,273 @@ class TestPluginLabgrid:
             return_value=mocker_labgrid_system_reservation(),
         )
 
-        await plugin.schedule(coordinator)
+        await cmd_priority(PRIORITY_BULK)(plugin.schedule)(coordinator)
         mocker_labgrid_system_reservation.assert_called()
+        # switch to labgrid goes ahead of bulk commands of the pass
+        assert lanes == [PRIORITY_HIGH]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(2,)], indirect=True)
+    async def test_native_backend(self, labgrid_standin, native_plugin):
+        labgrid_standin.places["place-0000"]["comment"] = "foo"
+        assert await native_plugin.labgrid_get_places() == ["place-0000", "place-0001"]
+        assert await native_plugin.labgrid_get_comments() == {"place-0000": "foo"}
+
+        ret, token = await native_plugin.labgrid_create_reservation(
+            "place-0000", priority=100, wait=True, shell=True
+        )
+        assert ret[0] == 0
+        assert ret[1] == f"export LG_TOKEN={token}\n"
+
+        ret = await native_plugin.labgrid_acquire_place("place-0000")
+        assert ret[0] == 0
+        assert await native_plugin.labgrid_get_place_owner("place-0000") == "fc/fc"
+        assert await native_plugin.labgrid_get_place_token("place-0000") == token
+
+        reservations = await native_plugin.labgrid_get_reservations()
+        assert reservations[f"Reservation '{token}'"]["owner"] == "fc/fc"
+        assert reservations[f"Reservation '{token}'"]["token"] == token
+        assert reservations[f"Reservation '{token}'"]["state"] == "acquired"
+        assert reservations[f"Reservation '{token}'"]["prio"] == 100.0
+        assert reservations[f"Reservation '{token}'"]["filters"] == {
+            "main": "name=place-0000"
+        }
+
+        await native_plugin.labgrid_release_place("place-0000")
+        await native_plugin.labgrid_cancel_reservation(token)
+        assert not labgrid_standin.places["place-0000"]["acquired"]
+        assert not labgrid_standin.reservations
+
+        # all calls share one coordinator session
+        assert labgrid_standin.connections == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(1,)], indirect=True)
+    async def test_native_backend_wait_timeout(self, labgrid_standin, native_plugin):
+        labgrid_standin.places["place-0000"]["acquired"] = "foo/bar"
+
+        ret = await native_plugin.labgrid_create_reservation(
+            "place-0000", priority=100, wait=True, timeout=0.1
+        )
+        assert ret[0] == 124
+        assert list(labgrid_standin.reservations.values())[0]["state"] == "waiting"
+
+        ret = await native_plugin.labgrid_acquire_place("place-0000")
+        assert ret[0] != 0
+
+    @pytest.mark.asyncio
+    async def test_native_backend_unreachable(self, mocker):
+        mocker.patch.dict(
+            Config.frameworks_config["labgrid"],
+            {"lg_crossbar": "ws://127.0.0.1:9/ws", "backend": "native"},
+        )
+        plugin = Plugin({"lg_crossbar": "ws://127.0.0.1:9/ws"})
+
+        assert await plugin.labgrid_get_places() == []
+        assert await plugin.labgrid_get_reservations() is None
+        ret = await plugin.labgrid_acquire_place("place-0000")
+        assert ret[0] == 1
+
+    @pytest.mark.asyncio
+    async def test_place_snapshot(self, asyncio_patch, mocker, plugin):
+        places_text = (
+            "Place '$resource1':\n"
+            "  aliases: foo\n"
+            "  comment: bar\n"
+            "  tags: board=imx8, soc=mx8\n"
+            "  matches:\n"
+            "    */$resource1/*\n"
+            "  acquired: fc/fc\n"
+            "  acquired resources:\n"
+            "  created: 2023-03-28 09:27:14.881492\n"
+            "  changed: 2023-03-28 09:27:14.881492\n"
+            "  reservation: 83UF223356\n"
+            "Place '$resource2':\n"
+            "  matches:\n"
+            "  acquired: None\n"
+            "  acquired resources:\n"
+        )
+        mocker_run_cmd = asyncio_patch(
+            mocker,
+            "fc_server.plugins.labgrid.Plugin._run_cmd",
+            (0, places_text, ""),
+        )
+
+        snapshot = await plugin.labgrid_get_place_snapshot()
+        assert snapshot["$resource1"] == {
+            "name": "$resource1",
+            "owner": "fc/fc",
+            "reservation": "83UF223356",
+            "comment": "bar",
+            "tags": {"board": "imx8", "soc": "mx8"},
+        }
+        assert snapshot["$resource2"]["owner"] is None
+
+        assert await plugin.labgrid_get_places() == ["$resource1", "$resource2"]
+        assert await plugin.labgrid_get_comments() == {"$resource1": "bar"}
+        assert await plugin.labgrid_get_place_token("$resource1") == "83UF223356"
+        assert await plugin.labgrid_get_place_owner("$resource1") == "fc/fc"
+        assert await plugin.labgrid_get_place_owner("$resource2") == ""
+        mocker_run_cmd.assert_called_once()
+
+        # changes by fc drop the snapshot
+        await plugin.labgrid_acquire_place("$resource2")
+        await plugin.labgrid_get_place_owner("$resource2")
+        assert mocker_run_cmd.call_count == 3
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(2,)], indirect=True)
+    async def test_place_snapshot_coalesced(self, labgrid_standin, native_plugin):
+        owners = await asyncio.gather(
+            *[
+                native_plugin.labgrid_get_place_owner(f"place-000{i % 2}")
+                for i in range(10)
+            ]
+        )
+        assert owners == [""] * 10
+        assert labgrid_standin.calls.count("get_places") == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(2,)], indirect=True)
+    async def test_watch_places(self, labgrid_standin, native_plugin):
+        native_plugin.managed_resources = ["place-0000"]
+        await native_plugin.labgrid_watch_places(
+            native_plugin._Plugin__on_place_changed
+        )
+        assert await native_plugin.labgrid_get_place_owner("place-0000") == ""
+
+        # pushed changes keep snapshot current, managed place scheduled at once
+        labgrid_standin.places["place-0000"]["acquired"] = "foo/bar"
+        await labgrid_standin.publish_place("place-0000")
+        await asyncio.wait_for(native_plugin.schedule_event.wait(), 1)
+        assert await native_plugin.labgrid_get_place_owner("place-0000") == "foo/bar"
+        assert labgrid_standin.calls.count("get_places") == 1
+
+        native_plugin.schedule_event.clear()
+        labgrid_standin.places["place-0001"]["acquired"] = "foo/bar"
+        await labgrid_standin.publish_place("place-0001")
+        await native_plugin.labgrid_get_reservations()
+        assert not native_plugin.schedule_event.is_set()
+        assert await native_plugin.labgrid_get_place_owner("place-0001") == "foo/bar"
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(1,)], indirect=True)
+    async def test_watch_places_failure(self, labgrid_standin, native_plugin):
+        changes = []
+
+        def on_change(name, _):
+            changes.append(name)
+            raise KeyError(name)
+
+        await native_plugin.labgrid_watch_places(on_change)
+        await native_plugin.labgrid_get_places()
+
+        # failed handler keeps the coordinator connection for later calls
+        await labgrid_standin.publish_place("place-0000")
+        assert await native_plugin.labgrid_get_reservations() == {}
+        assert changes == ["place-0000"]
+        assert native_plugin.labgrid_session.connected
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(3,)], indirect=True)
+    async def test_reconcile(self, mocker, labgrid_standin, native_plugin):
+        async def noop(*_):
+            pass
+
+        mocker_system_reservation = mocker.patch(
+            "fc_server.plugins.labgrid.Plugin._Plugin__labgrid_system_reservation",
+            MagicMock(side_effect=noop),
+        )
+
+        # place-0000 already taken by fc, place-0002 locked by user
+        labgrid_standin.create_reservation("fc/fc", "name=place-0000", 100.0)
+        labgrid_standin.acquire_place("fc/fc", "place-0000")
+        labgrid_standin.places["place-0002"]["acquired"] = "foo/bar"
+
+        driver = MagicMock()
+        driver.managed_resources = ["place-0000", "place-0001", "place-0002"]
+        driver.resource_states.is_state.return_value = False  # nothing restored
+        tasks = await native_plugin.init(driver)
+        assert len(tasks) == 1
+        await tasks[0]
+
+        assert labgrid_standin.calls.count("get_reservations") == 1
+        assert labgrid_standin.calls.count("create_reservation") == 2
+        assert labgrid_standin.places["place-0001"]["acquired"] == "fc/fc"
+        mocker_system_reservation.assert_called_once_with(driver, "place-0002")
+        driver.accept_resource.assert_called_once_with("place-0002", native_plugin)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("labgrid_standin", [(3,)], indirect=True)
+    async def test_wait_system_reservations(self, labgrid_standin, native_plugin):
+        returned = []
+
+        async def return_resource(resource):
+            returned.append(resource)
+
+        driver = MagicMock()
+        driver.return_resource = MagicMock(side_effect=return_resource)
+        native_plugin.system_reservation_interval = 0.05
+        native_plugin.system_reservation_refresh = 0
+
+        for place in labgrid_standin.places.values():
+            place["acquired"] = "foo/bar"
+        for i in range(3):
+            await native_plugin._Plugin__labgrid_system_reservation(
+                driver, f"place-000{i}"
+            )
+        waiter = native_plugin._Plugin__system_reservation_waiter
+        assert len(native_plugin._Plugin__system_reservations) == 3
+
+        # users release places one by one, one waiter serves all of them
+        for i in range(3):
+            labgrid_standin.release_place("foo/bar", f"place-000{i}")
+            while len(returned) <= i:
+                await asyncio.sleep(0.01)
+            assert labgrid_standin.places[f"place-000{i}"]["acquired"] == "fc/fc"
+            assert native_plugin._Plugin__system_reservation_waiter is waiter
+
+        assert returned == ["place-0000", "place-0001", "place-0002"]
+        assert "poll_reservation" in labgrid_standin.calls
+        await asyncio.wait_for(waiter, 1)
+
+    @pytest.mark.asyncio
+    async def test_reserve_again(self, asyncio_patch, mocker, plugin):
+        calls = {"place-0000": 0, "place-0001": 0, "place-0002": 0}
+        running = 0
+        peak = 0
+
+        async def reserve(resource):
+            nonlocal running, peak
+            calls[resource] += 1
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return None if resource == "place-0002" else f"{resource}-token"
+
+        mocker.patch.object(
+            plugin, "_Plugin__labgrid_reserve", MagicMock(side_effect=reserve)
+        )
+        # every system reservation expired, e.g. coordinator restarted
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.labgrid.Plugin.labgrid_get_reservations",
+            {},
+        )
+        plugin.system_reservation_interval = 0.01
+        plugin._Plugin__reserve_retry_queue = RetryQueue(
+            base=0.1, maximum=0.1, jitter=0
+        )
+
+        for resource in calls:
+            await plugin._Plugin__labgrid_system_reservation(MagicMock(), resource)
+        await asyncio.sleep(0.3)
+        plugin._Plugin__system_reservation_waiter.cancel()
+
+        # expired places are reserved again together every pass,
+        # failed place backs off instead
+        assert peak >= 2
+        assert calls["place-0000"] > 5
+        assert calls["place-0002"] <= 4
+        assert plugin._Plugin__system_reservations["place-0002"] is None
@@ -5,11 +5,21 @@
 # SPDX-License-Identifier: MIT
 
 
+import asyncio
+import importlib.util
+import json
+import time
 from unittest.mock import MagicMock
 
 import pytest
+import pytest_asyncio
+import yaml
 
+from fc_server.core.config import Config
 from fc_server.plugins.lava import Plugin
+from fc_server.plugins.utils.lava import LavaQueueError
+from fc_server.plugins.utils.lava_queue import LavaJobQueue
+from fc_server.plugins.utils.lava_tag_index import LavaTagIndex
 
 
 @pytest.fixture(name="plugin")
@@ -18,6 +28,26 @@ def lava_plugin():
     return Plugin(config)
 
 
+@pytest.fixture(name="lavacli_identity")
+def create_lavacli_identity(monkeypatch, tmp_path, lava_standin):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path))
+    with open(tmp_path / "lavacli.yaml", "w", encoding="utf-8") as config_handle:
+        yaml.dump({"standin": {"uri": lava_standin.uri}}, config_handle)
+    return "standin"
+
+
+@pytest_asyncio.fixture(name="native_plugin")
+async def lava_native_plugin(mocker, lavacli_identity):
+    mocker.patch.dict(
+        Config.frameworks_config["lava"],
+        {"identities": lavacli_identity, "backend": "native"},
+    )
+    config = {"identities": lavacli_identity, "priority": 1, "default": True}
+    plugin = Plugin(config)
+    yield plugin
+    await plugin.shutdown()
+
+
 @pytest.fixture(name="lava_job_info")
 def create_lava_job_info():
     job_info = {
@@ -80,6 +110,28 @@ class TestPluginLava:
         plugin._Plugin__update_cache("scheduler_cache", "0", ["foo"])
         assert plugin.scheduler_cache["0"] == ["foo"]
 
+    @pytest.mark.asyncio
+    async def test_device_updates(self, asyncio_patch, mocker, plugin):
+        mocker_run_cmd = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin._run_cmd", (0, "", "")
+        )
+
+        results = await asyncio.gather(
+            plugin.lava_maintenance_devices("$resource1"),
+            plugin.lava_online_devices("$resource1", "$resource2"),
+        )
+
+        # lavacli has no bulk update, every update is issued at once
+        assert plugin.lava_update_window == 0
+        assert plugin._Lava__update_flusher is None
+        assert results == [True, True]
+        updates = [cmd.args[0].split()[5:8] for cmd in mocker_run_cmd.call_args_list]
+        assert updates == [
+            ["$resource1", "--health", "MAINTENANCE"],
+            ["$resource1", "--health", "GOOD"],
+            ["$resource2", "--health", "GOOD"],
+        ]
+
     @pytest.mark.asyncio
     async def test_get_job_tags(self, asyncio_patch, mocker, plugin, lava_job_info):
         asyncio_patch(
@@ -108,9 +160,14 @@ class TestPluginLava:
         asyncio_patch(
             mocker, "fc_server.plugins.lava.Plugin.lava_get_device_info", None
         )
-        ret = await plugin._Plugin__get_device_tags("$resource1")
+        ret = await plugin._Plugin__get_device_tags("$resource2")
         assert ret is None
 
+        # tags of $resource1 served from device info cache
+        ret = await plugin._Plugin__get_device_tags("$resource1")
+        assert ret == ("$resource1", [])
+        assert plugin.device_info_cache.hits == 1
+
     @pytest.mark.asyncio
     async def test_get_device_info(
         self,
@@ -144,6 +201,67 @@ class TestPluginLava:
         ret = await plugin._Plugin__get_device_info("$resource1")
         assert ret == lava_device_info_good
 
+    @pytest.mark.asyncio
+    async def test_invalidate_changed_device_info(
+        self, asyncio_patch, mocker, plugin, lava_device_info
+    ):
+        mocker_lava_get_device_info = asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin.lava_get_device_info",
+            lava_device_info,
+        )
+        devices = [
+            {"hostname": "$resource1", "health": "Good", "current_job": None},
+            {"hostname": "$resource2", "health": "Good", "current_job": None},
+        ]
+        asyncio_patch(mocker, "fc_server.plugins.lava.Plugin.lava_get_devices", devices)
+
+        await plugin._Plugin__get_devices()
+        await plugin._Plugin__get_device_info("$resource1")
+        await plugin._Plugin__get_device_info("$resource2")
+        assert mocker_lava_get_device_info.call_count == 2
+
+        # only device whose current job changed be refetched
+        devices[0]["current_job"] = "1"
+        await plugin._Plugin__get_devices()
+        await plugin._Plugin__get_device_info("$resource1")
+        await plugin._Plugin__get_device_info("$resource2")
+        assert mocker_lava_get_device_info.call_count == 3
+        assert plugin.device_info_cache.stats() == {"size": 2, "hits": 1, "misses": 3}
+
+    @pytest.mark.asyncio
+    async def test_default_framework_disconnect(self, asyncio_patch, mocker, plugin):
+        devices = [
+            {"hostname": "$resource1", "health": "Good", "current_job": None},
+            {"hostname": "$resource2", "health": "Good", "current_job": "1"},
+            {"hostname": "$resource3", "health": "Maintenance", "current_job": None},
+            {"hostname": "$resource4", "health": "Good", "current_job": None},
+        ]
+        mocker_lava_get_devices = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_devices", devices
+        )
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin.lava_get_device_info",
+            {"description": "foo"},
+        )
+        mocker_lava_maintenance_devices = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_maintenance_devices", True
+        )
+
+        results = await asyncio.gather(
+            *[
+                plugin.default_framework_disconnect(resource)
+                for resource in ("$resource1", "$resource2", "$resource3", "$resource4")
+            ]
+        )
+        assert results == [(True, True), (False, False), (True, False), (True, True)]
+
+        # one devices list before and one after for the whole batch
+        assert mocker_lava_get_devices.call_count == 2
+        assert mocker_lava_maintenance_devices.call_count == 2
+        mocker_lava_maintenance_devices.assert_any_call("$resource1", desc="[FC]foo")
+
     @pytest.mark.asyncio
     async def test_force_kick_off(
         self, asyncio_patch, mocker, plugin, lava_device_info_with_job
@@ -161,23 +279,141 @@ class TestPluginLava:
         mocker_lava_cancel_job.assert_called_with("1")
 
     @pytest.mark.asyncio
-    async def test_seize_resource(self, asyncio_patch, mocker, coordinator, plugin):
+    async def test_seize_costs(
+        self, asyncio_patch, mocker, plugin, lava_device_info_with_job, lava_job_info
+    ):
+        mocker_time = mocker.patch("fc_server.plugins.lava.time")
+        devices = [
+            {"hostname": "$resource1", "type": "docker", "health": "Good"},
+        ]
+        asyncio_patch(mocker, "fc_server.plugins.lava.Plugin.lava_get_devices", devices)
+        asyncio_patch(mocker, "fc_server.plugins.lava.Plugin.lava_cancel_job", None)
+
+        async def fetch_devices(now, current_job):
+            mocker_time.monotonic.return_value = now
+            devices[0]["current_job"] = current_job
+            await plugin._Plugin__get_devices()
+
+        # runtime is only recorded for jobs fc saw start and finish normally
+        await fetch_devices(0, "1")
+        await fetch_devices(100, "2")
+        await fetch_devices(400, None)
+        await fetch_devices(500, "3")
         asyncio_patch(
             mocker,
-            "fc_server.plugins.lava.Plugin._Plugin__get_device_tags",
-            ("$resource1", []),
+            "fc_server.plugins.lava.Plugin.lava_get_device_info",
+            dict(lava_device_info_with_job, current_job="3"),
         )
+        await plugin.force_kick_off("$resource1")
+        await fetch_devices(600, None)
+        assert plugin.runtime_history.stats() == {
+            "docker": {"estimate": 300, "samples": 1}
+        }
 
-        mocker_coordinate_resources = asyncio_patch(
+        plugin.device_info_cache.invalidate("$resource1")
+        asyncio_patch(
             mocker,
-            "fc_server.core.coordinator.Coordinator.coordinate_resources",
-            MagicMock(),
+            "fc_server.plugins.lava.Plugin.lava_get_device_info",
+            lava_device_info_with_job,
+        )
+        lava_job_info["start_time"] = "20181101T07:13:06"
+        mocker_job_info = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_job_info", lava_job_info
+        )
+        costs = await plugin.seize_costs(["$resource1"])
+        mocker_job_info.assert_called_once_with("1")
+        assert costs["$resource1"]["elapsed"] > 0
+        assert "priority" not in costs["$resource1"]
+        assert costs["$resource1"]["estimate"] == 300
+
+    @pytest.mark.asyncio
+    async def test_seize_resource(self, asyncio_patch, mocker, coordinator, plugin):
+        plugin.tag_index.update("$resource1", "docker", [])
+
+        mocker_seize_resources = asyncio_patch(
+            mocker,
+            "fc_server.core.coordinator.Coordinator.seize_resources",
+            {"0": ["$resource1"]},
         )
 
         plugin.job_tags_cache["0"] = []
+        plugin.seize_cache["0"] = []
+
+        plugin._Plugin__seize_resource(
+            coordinator,
+            {"id": "0", "requested_device_type": "docker"},
+            ["$resource1"],
+            0,
+        )
+        await coordinator._Coordinator__seize_requested(plugin)
+        mocker_seize_resources.assert_called_once_with(plugin, {"0": ["$resource1"]})
+        assert plugin.seize_cache["0"] == ["$resource1"]
+
+    @pytest.mark.asyncio
+    async def test_index_device_tags(self, mocker, plugin):
+        async def mocker_get_device_tags(device):
+            return (device, ["foo"]) if device != "$resource3" else None
 
-        await plugin._Plugin__seize_resource(coordinator, "0", ["$resource1"])
-        mocker_coordinate_resources.assert_called()
+        mocker.patch(
+            "fc_server.plugins.lava.Plugin._Plugin__get_device_tags",
+            side_effect=mocker_get_device_tags,
+        )
+        plugin.tag_index.update("$resource3", "docker", [])
+
+        await plugin._Plugin__index_device_tags(
+            [
+                {"hostname": "$resource1", "type": "docker"},
+                {"hostname": "$resource2", "type": "docker"},
+                {"hostname": "$resource3", "type": "docker"},
+            ]
+        )
+        assert len(plugin.tag_index) == 2
+        assert "$resource3" not in plugin.tag_index
+        assert plugin.tag_index.devices(plugin.tag_index.match("docker", ["foo"])) == [
+            "$resource1",
+            "$resource2",
+        ]
+
+    @pytest.mark.asyncio
+    async def test_sweep_lent_resources(self, asyncio_patch, mocker, plugin):
+        driver = MagicMock()
+        driver.is_default_framework.return_value = False
+
+        async def mocker_return_resource(_):
+            pass
+
+        driver.return_resource = MagicMock(side_effect=mocker_return_resource)
+        mocker_lava_maintenance_devices = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_maintenance_devices", True
+        )
+        devices = [
+            {"hostname": "$resource1", "health": "Good", "current_job": None},
+            {"hostname": "$resource2", "health": "Good", "current_job": "1"},
+        ]
+        mocker_lava_get_devices = asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_devices", devices
+        )
+        plugin.scheduler_cache.update({"0": ["$resource1"], "1": ["$resource2"]})
+        plugin.lend_duration = 0
+        plugin.sweep_interval = 0.01
+
+        plugin._Plugin__lend_resources(driver, "$resource1", "$resource2")
+        plugin._Plugin__lend_resources(driver, "$resource3")
+        await asyncio.sleep(0.1)
+
+        # one bulk maintenance, then one device snapshot shared by all devices
+        mocker_lava_maintenance_devices.assert_any_call(
+            "$resource1", "$resource2", "$resource3"
+        )
+        driver.return_resource.assert_called_once_with("$resource1")
+        assert plugin.scheduler_cache == {"1": ["$resource2"]}
+        assert mocker_lava_get_devices.call_count > 1
+
+        # sweeper quits once busy device freed
+        devices[1]["current_job"] = None
+        await asyncio.sleep(0.1)
+        driver.return_resource.assert_called_with("$resource2")
+        assert plugin._Plugin__sweeper.done()
 
     @pytest.mark.parametrize(
         "device, seize",
@@ -224,10 +460,13 @@ class TestPluginLava:
                 "submitter": "bar",
             }
         ]
-        asyncio_patch(
-            mocker,
-            "fc_server.plugins.lava.Plugin.lava_get_queued_jobs",
-            queued_job_info,
+
+        async def mocker_queued_job_pages():
+            yield queued_job_info
+
+        mocker.patch(
+            "fc_server.plugins.lava.Plugin.lava_get_queued_job_pages",
+            return_value=mocker_queued_job_pages(),
         )
 
         job_info = {
@@ -257,21 +496,420 @@ class TestPluginLava:
             device_tags,
         )
 
-        async def mocker_coro():
-            pass
+        mocker.patch("fc_server.plugins.lava.Plugin._Plugin__lend_resources")
+
+        mocker_seize = mocker.patch(
+            "fc_server.plugins.lava.Plugin._Plugin__seize_resource"
+        )
+
+        await plugin.schedule(coordinator)
+        assert mocker_seize.called == seize
+
+        # queued job for managed device type tightens polling
+        assert plugin.schedule_interval == plugin.schedule_controller.minimum
+
+    @pytest.mark.asyncio
+    async def test_schedule_queue(self, asyncio_patch, mocker, plugin, coordinator):
+        device = {
+            "current_job": None,
+            "health": "Unknown",
+            "hostname": "$resource1",
+            "state": "Idle",
+            "type": "docker",
+        }
+        asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_devices", [device]
+        )
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin._Plugin__get_device_tags",
+            ("$resource1", []),
+        )
+        mocker.patch("fc_server.plugins.lava.Plugin._Plugin__lend_resources")
+
+        queued_jobs = [
+            {"id": job_id, "requested_device_type": "docker"}
+            for job_id in ("2", "1", "0")
+        ]
+
+        async def queued_job_pages(fail=False):
+            yield queued_jobs[:2]
+            if fail:
+                raise LavaQueueError("Unable to fetch queued jobs from 2")
+            yield queued_jobs[2:]
+
+        matched_jobs = []
+
+        async def get_job_info(job_id):
+            matched_jobs.append(job_id)
+            return {"tags": []}
+
+        mocker.patch.object(
+            plugin, "lava_get_job_info", MagicMock(side_effect=get_job_info)
+        )
+
+        mocker.patch.object(
+            plugin, "lava_get_queued_job_pages", MagicMock(side_effect=queued_job_pages)
+        )
+        await plugin.schedule(coordinator)
+        assert matched_jobs == ["0", "1", "2"]
+
+        # failed page aborts the pass instead of departing jobs behind it
+        plugin.lava_get_queued_job_pages.side_effect = lambda: queued_job_pages(True)
+        await plugin.schedule(coordinator)
+        assert list(plugin.job_queue.jobs) == ["2", "1", "0"]
+        assert "0" in plugin.job_tags_cache
+
+        # only jobs new or of changed device types are matched between full passes
+        plugin.full_schedule_ticks = 3
+        mocker_update_cache = mocker.spy(plugin, "_Plugin__update_cache")
+
+        def scheduled_jobs():
+            jobs = [
+                call.args[1]
+                for call in mocker_update_cache.call_args_list
+                if call.args[0] == "scheduler_cache"
+            ]
+            mocker_update_cache.reset_mock()
+            return jobs
+
+        plugin.lava_get_queued_job_pages.side_effect = queued_job_pages
+        await plugin.schedule(coordinator)
+        assert scheduled_jobs() == ["0", "1", "2"]
+
+        queued_jobs.insert(0, {"id": "3", "requested_device_type": "docker"})
+        await plugin.schedule(coordinator)
+        assert scheduled_jobs() == ["3"]
+
+        await plugin.schedule(coordinator)
+        assert scheduled_jobs() == ["0", "1", "2", "3"]
+
+    @pytest.mark.asyncio
+    async def test_schedule_backlog(self, asyncio_patch, mocker, plugin, coordinator):
+        device = {
+            "current_job": None,
+            "health": "Maintenance",
+            "hostname": "$resource1",
+            "state": "Idle",
+            "type": "docker",
+        }
+        asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_devices", [device]
+        )
+        asyncio_patch(
+            mocker,
+            "fc_server.plugins.lava.Plugin._Plugin__get_device_tags",
+            ("$resource1", []),
+        )
+        asyncio_patch(
+            mocker, "fc_server.plugins.lava.Plugin.lava_get_job_info", {"tags": []}
+        )
+
+        async def queued_job_pages():
+            yield [{"id": "0", "requested_device_type": "docker"}]
+
+        mocker.patch.object(
+            plugin, "lava_get_queued_job_pages", MagicMock(side_effect=queued_job_pages)
+        )
+
+        # new job tightens polling
+        await plugin.schedule(coordinator)
+        assert plugin.schedule_interval == plugin.schedule_controller.minimum
+
+        # backlog no managed device could take lets polling back off
+        for _ in range(plugin.schedule_controller.idle_passes):
+            await plugin.schedule(coordinator)
+        assert plugin.schedule_interval > plugin.schedule_controller.minimum
+
+
+# pylint: disable=protected-access
+class TestLavaNativeBackend:
+    def test_from_identity(self, native_plugin, lava_standin):
+        assert native_plugin.lava_backend == "native"
+        assert native_plugin.lava_rpc.uri == lava_standin.uri
+
+    @pytest.mark.parametrize("lava_standin", [(2, 150)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_query(self, native_plugin, lava_standin):
+        devices = await native_plugin.lava_get_devices()
+        assert [device["hostname"] for device in devices] == [
+            "docker-0000",
+            "docker-0001",
+        ]
+
+        device_info = await native_plugin.lava_get_device_info("docker-0000")
+        assert device_info["tags"] == []
+        assert await native_plugin.lava_get_device_info("foo") is None
+
+        job_info = await native_plugin.lava_get_job_info(1)
+        assert job_info["state"] == "Submitted"
 
+        assert len([job async for job in native_plugin.lava_get_queued_jobs()]) == 150
+
+        await native_plugin.lava_cancel_job(1)
+        assert len(lava_standin.jobs) == 149
+
+    @pytest.mark.parametrize("lava_standin", [(0, 1050)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_queued_job_pages(self, native_plugin, lava_standin):
+        pages = [page async for page in native_plugin.lava_get_queued_job_pages()]
+        assert [len(page) for page in pages] == [100] * 10 + [50]
+        assert [job["id"] for page in pages for job in page] == list(range(1050))
+        assert native_plugin.lava_queue_depth == 1050
+
+        lava_standin.failing_pages.add(3)
+        with pytest.raises(LavaQueueError):
+            async for _ in native_plugin.lava_get_queued_job_pages():
+                pass
+        assert native_plugin.lava_queue_depth == 1050
+        lava_standin.failing_pages.clear()
+
+        lava_standin.jobs = lava_standin.jobs[:20]
+        assert len([job async for job in native_plugin.lava_get_queued_jobs()]) == 20
+        assert native_plugin.lava_queue_depth == 20
+
+        # let outstanding cancelled page fetches settle
+        await asyncio.sleep(0.1)
+        lava_standin.calls.clear()
+        assert len([job async for job in native_plugin.lava_get_queued_jobs()]) == 20
+        assert lava_standin.calls == ["jobs.queue"]
+
+    @pytest.mark.parametrize("lava_standin", [(2, 0)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_update_devices(self, native_plugin, lava_standin):
+        assert await native_plugin.lava_online_devices(
+            "docker-0000", "docker-0001", desc="foo"
+        )
+        assert lava_standin.devices["docker-0000"]["health"] == "Good"
+        assert lava_standin.devices["docker-0001"]["description"] == "foo"
+
+        assert await native_plugin.lava_maintenance_devices("docker-0000")
+        assert lava_standin.devices["docker-0000"]["health"] == "Maintenance"
+
+        assert not await native_plugin.lava_maintenance_devices("foo")
+
+    @pytest.mark.parametrize("lava_standin", [(3, 0)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_bulk_update_devices(self, native_plugin, lava_standin):
+        results = await asyncio.gather(
+            native_plugin.lava_maintenance_devices("docker-0000", "docker-0001"),
+            native_plugin.lava_online_devices("docker-0002"),
+            native_plugin.lava_maintenance_devices("foo"),
+        )
+
+        assert results == [True, True, False]
+        assert lava_standin.requests == 1
+        assert lava_standin.devices["docker-0002"]["health"] == "Good"
+
+    @pytest.mark.parametrize("lava_standin", [(2, 0)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_coalesce_device_updates(self, native_plugin, lava_standin):
+        results = await asyncio.gather(
+            native_plugin.lava_maintenance_devices("docker-0000"),
+            native_plugin.lava_online_devices("docker-0000", "foo"),
+            native_plugin.lava_maintenance_devices("docker-0000", "docker-0001"),
+        )
+
+        # only the same update is shared, repeated one still applies last
+        assert results == [True, False, True]
+        assert lava_standin.requests == 1
+        assert lava_standin.calls.count("devices.update") == 4
+        assert lava_standin.devices["docker-0000"]["health"] == "Maintenance"
+
+    @pytest.mark.parametrize("lava_standin", [(1, 0)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_cancel_device_updates(self, native_plugin):
+        update = asyncio.create_task(native_plugin.lava_online_devices("docker-0000"))
+        await asyncio.sleep(0)
+        native_plugin._Lava__update_flusher.cancel()
+
+        # requesters don't hang once the flusher is gone
+        await asyncio.wait([update], timeout=1)
+        assert update.cancelled()
+        assert native_plugin._Lava__update_flusher is None
+        assert await native_plugin.lava_online_devices("docker-0000")
+
+    @pytest.mark.skipif(
+        not importlib.util.find_spec("lavacli"), reason="lavacli not installed"
+    )
+    @pytest.mark.parametrize("lava_standin", [(1000, 0)], indirect=True)
+    @pytest.mark.asyncio
+    async def test_latency(self, plugin, native_plugin, lavacli_identity):
+        plugin.identities = lavacli_identity
+
+        start = time.perf_counter()
+        fork_devices = await plugin.lava_get_devices()
+        fork_latency = time.perf_counter() - start
+
+        start = time.perf_counter()
+        native_devices = await native_plugin.lava_get_devices()
+        native_latency = time.perf_counter() - start
+
+        assert len(fork_devices) == len(native_devices) == 1000
+        assert native_latency < fork_latency
+
+
+class TestLavaEvents:
+    @staticmethod
+    async def wait_for(condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError("condition not reached")
+
+    @pytest.mark.asyncio
+    async def test_event_schedule(self, mocker, coordinator, lava_standin):
+        config = {
+            "identities": "$lava_identity",
+            "priority": 1,
+            "event_stream": lava_standin.event_url,
+        }
+        plugin = Plugin(config)
+        plugin._Plugin__managed_devices.update({"$resource1": "docker"})
+        plugin.device_info_cache.set("$resource1", {"tags": []})
         mocker.patch(
-            "fc_server.plugins.lava.Plugin._Plugin__reset_possible_resource",
-            return_value=mocker_coro(),
+            "fc_server.plugins.lava.Plugin.lava_maintenance_devices", return_value=[]
         )
+        await plugin.init(coordinator)
 
-        async def mocker_seize():
-            pass
+        # subscribed: poll only for reconciliation, catch up once
+        await self.wait_for(lambda: plugin.event_stream.connected)
+        assert plugin.schedule_interval == plugin.reconcile_interval
+        assert plugin.schedule_event.is_set()
+        plugin.schedule_event.clear()
 
-        mocker_seize = mocker.patch(
-            "fc_server.plugins.lava.Plugin._Plugin__seize_resource",
-            return_value=mocker_seize(),
+        # jobs of unmanaged device type and unmanaged devices are ignored
+        await lava_standin.publish(
+            "testjob", {"job": 1, "state": "Submitted", "device_type": "imx8mm"}
+        )
+        await lava_standin.publish("device", {"device": "imx8mm-1", "state": "Idle"})
+        await asyncio.sleep(0.1)
+        assert not plugin.schedule_event.is_set()
+
+        await lava_standin.publish(
+            "testjob", {"job": 2, "state": "Submitted", "device_type": "docker"}
+        )
+        await self.wait_for(plugin.schedule_event.is_set)
+        plugin.schedule_event.clear()
+
+        await lava_standin.publish(
+            "device", {"device": "$resource1", "state": "Running"}
         )
+        await self.wait_for(plugin.schedule_event.is_set)
+        assert "$resource1" not in plugin.device_info_cache
+        plugin.schedule_event.clear()
+
+        # malformed events and failed handlers don't end the subscription
+        for websocket in list(lava_standin.subscribers):
+            await websocket.send_str(json.dumps([1, "uuid", "datetime", "user", "{}"]))
+        on_event = plugin.event_stream.on_event
+        plugin.event_stream.on_event = MagicMock(side_effect=RuntimeError)
+        await lava_standin.publish("device", {"device": "$resource1"})
+        await self.wait_for(lambda: plugin.event_stream.on_event.called)
+        plugin.event_stream.on_event = on_event
+        await lava_standin.publish("device", {"device": "$resource1", "state": "Idle"})
+        await self.wait_for(plugin.schedule_event.is_set)
+        assert plugin.event_stream.connected
+
+        # fallback to poll once subscription lost
+        plugin.event_stream.retry_interval = 60
+        for websocket in list(lava_standin.subscribers):
+            await websocket.close()
+        await self.wait_for(lambda: not plugin.event_stream.connected)
+        assert plugin.schedule_interval == plugin.schedule_controller.interval
+
+        event_task = plugin._Plugin__event_task
+        await plugin.shutdown()
+        assert event_task.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_event_spacing(self, mocker, plugin, coordinator):
+        plugin.event_schedule_spacing = 0.1
+        plugin._Plugin__managed_devices.update({"$resource1": "docker"})
+        on_lava_event = plugin._Plugin__on_lava_event
+
+        async def no_devices():
+            return []
 
+        mocker.patch.object(
+            plugin, "lava_get_devices", MagicMock(side_effect=no_devices)
+        )
+
+        # a pass just started, burst of events is coalesced into one later pass
         await plugin.schedule(coordinator)
-        assert mocker_seize.called == seize
+        for state in ("Running", "Idle"):
+            on_lava_event("device", {"device": "$resource1", "state": state})
+        on_lava_event("testjob", {"state": "Submitted", "device_type": "docker"})
+        assert not plugin.schedule_event.is_set()
+        await self.wait_for(plugin.schedule_event.is_set)
+        assert plugin._Plugin__event_device_types == {"docker"}
+
+        # pass started meanwhile covers the events, no delayed request left
+        plugin.schedule_event.clear()
+        await plugin.schedule(coordinator)
+        on_lava_event("device", {"device": "$resource1", "state": "Running"})
+        await plugin.schedule(coordinator)
+        await asyncio.sleep(0.2)
+        assert not plugin.schedule_event.is_set()
+
+
+class TestLavaJobQueue:
+    def test_track(self):
+        job_queue = LavaJobQueue()
+
+        job_queue.begin()
+        assert job_queue.update([{"id": 3}, {"id": 1}]) == [{"id": 3}, {"id": 1}]
+        assert job_queue.update([{"id": 2}]) == [{"id": 2}]
+        assert job_queue.commit() == set()
+        assert list(job_queue.jobs) == [3, 1, 2]
+
+        job_queue.begin()
+        assert job_queue.update([{"id": 1}, {"id": 4}, {"id": 2, "tag": 1}]) == [
+            {"id": 4},
+            {"id": 2, "tag": 1},
+        ]
+        assert job_queue.commit() == {3}
+        assert list(job_queue.jobs) == [1, 4, 2]
+        assert 4 in job_queue
+        assert 3 not in job_queue
+        assert len(job_queue) == 3
+
+
+class TestLavaTagIndex:
+    def test_match(self):
+        tag_index = LavaTagIndex()
+        tag_index.update("imx8mm-1", "imx8mm", ["usb", "eth"])
+        tag_index.update("imx8mm-2", "imx8mm", ["usb"])
+        tag_index.update("imx8mm-3", "imx8mm", [])
+        tag_index.update("imx93-1", "imx93", ["usb", "eth"])
+
+        def match(device_type, tags, devices=None):
+            bitmap = tag_index.bitmap(devices) if devices is not None else None
+            return tag_index.devices(tag_index.match(device_type, tags, bitmap))
+
+        assert match("imx8mm", []) == ["imx8mm-1", "imx8mm-2", "imx8mm-3"]
+        assert match("imx8mm", ["usb"]) == ["imx8mm-1", "imx8mm-2"]
+        assert match("imx8mm", ["usb", "eth"]) == ["imx8mm-1"]
+        assert not match("imx8mm", ["usb", "can"])
+        assert match("imx8mm", ["usb"], ["imx8mm-2", "imx8mm-3", "imx93-1"]) == [
+            "imx8mm-2"
+        ]
+        assert match("imx93", ["eth"]) == ["imx93-1"]
+        assert not match("imx95", [])
+
+    def test_update(self):
+        tag_index = LavaTagIndex()
+        tag_index.update("imx8mm-1", "imx8mm", ["usb"])
+        tag_index.update("imx8mm-2", "imx8mm", ["usb"])
+
+        tag_index.update("imx8mm-1", "imx8mm", ["eth"])
+        assert tag_index.devices(tag_index.match("imx8mm", ["usb"])) == ["imx8mm-2"]
+        assert tag_index.devices(tag_index.match("imx8mm", ["eth"])) == ["imx8mm-1"]
+
+        # slot of removed device is reused
+        tag_index.remove("imx8mm-1")
+        tag_index.update("imx8mm-3", "imx8mm", ["usb"])
+        assert len(tag_index) == 2
+        assert tag_index.bitmap(["imx8mm-2", "imx8mm-3"]) == 0b11
+        assert not tag_index.devices(tag_index.match("imx8mm", ["eth"]))